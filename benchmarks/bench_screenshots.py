@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+End-to-end benchmarks of ScreenShotsAPI against local FakeBrowserStack server.
+
+    $ python benchmarks/bench_screenshots.py --jobs 10 --image-size 1048576 --json results.jsonl
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from browserstacker import ScreenShotsAPI  # noqa: E402
+from browserstacker.cache import CatalogCache  # noqa: E402
+from browserstacker.fake import FakeBrowserStack  # noqa: E402
+from browserstacker.metrics import MetricsCollector  # noqa: E402
+from browserstacker.scheduler import JobScheduler  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def measure(func):
+    """
+    Returns wall time, peak memory and result of the function call.
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time()
+    result = func()
+    elapsed = time() - start
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return elapsed, peak, result
+
+
+def make_api(server, **kwargs):
+    api = ScreenShotsAPI('user', 'key', **kwargs)
+    api.root_url = server.url
+    return api
+
+
+def bench_browsers(server, options):
+    calls = options.calls
+    results = []
+    for name, kwargs in (('browsers', {}), ('browsers-cached', {'catalog_cache': CatalogCache(options.catalog_path)})):
+        api = make_api(server, **kwargs)
+        elapsed, peak, _ = measure(lambda: [api.browsers(os='Windows', browser=['chrome', 'ie']) for _ in range(calls)])
+        results.append({'name': name, 'elapsed': elapsed, 'peak_memory': peak, 'calls_per_second': calls / elapsed})
+        api.close()
+    return results
+
+
+def bench_make(server, options, concurrency, instrumented=False):
+    destination = tempfile.mkdtemp()
+    api = make_api(server, pool_maxsize=max(concurrency, 10))
+    metrics = MetricsCollector(api.hooks) if instrumented else None
+    requests_before, bytes_before = server.stats['requests'], server.stats['bytes']
+
+    def run():
+        images = 0
+        for i in range(options.jobs):
+            images += len(api.make(
+                'http://www.example.com/%s' % i, server.browsers, os.path.join(destination, str(i)),
+                timeout=options.poll_interval, concurrency=concurrency
+            ))
+        return images
+
+    try:
+        elapsed, peak, images = measure(run)
+        pool_hits = api.pool_stats['hits']
+    finally:
+        api.close()
+        shutil.rmtree(destination)
+    result = {
+        'name': 'make-concurrency-%s%s' % (concurrency, '-instrumented' if instrumented else ''),
+        'elapsed': elapsed,
+        'peak_memory': peak,
+        'jobs_per_minute': options.jobs * 60 / elapsed,
+        'images_per_second': images / elapsed,
+        'bytes_per_second': (server.stats['bytes'] - bytes_before) / elapsed,
+        'requests': server.stats['requests'] - requests_before,
+        'pool_hits': pool_hits,
+    }
+    if metrics is not None:
+        summary = metrics.summary()
+        result.update(sleep_seconds=summary['sleep_seconds'], work_seconds=summary['work_seconds'])
+    return result
+
+
+def bench_batch(server, options):
+    destination = tempfile.mkdtemp()
+    api = make_api(server, pool_maxsize=max(options.concurrency, 10))
+    scheduler = JobScheduler(api, concurrency=options.concurrency, timeout=options.poll_interval,
+                             retry_delay=options.poll_interval)
+    for i in range(options.jobs):
+        scheduler.add('http://www.example.com/%s' % i, server.browsers, os.path.join(destination, str(i)))
+    bytes_before = server.stats['bytes']
+    try:
+        elapsed, peak, jobs = measure(scheduler.run)
+    finally:
+        api.close()
+        shutil.rmtree(destination)
+    images = sum(len(job.result) for job in jobs)
+    return {
+        'name': 'batch',
+        'elapsed': elapsed,
+        'peak_memory': peak,
+        'jobs_per_minute': len(jobs) * 60 / elapsed,
+        'images_per_second': images / elapsed,
+        'bytes_per_second': (server.stats['bytes'] - bytes_before) / elapsed,
+        'failed': sum(1 for job in jobs if job.status != 'done'),
+    }
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return '%.2f' % value
+    return str(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=5, help='Number of jobs per scenario')
+    parser.add_argument('--calls', type=int, default=50, help='Number of browsers() calls')
+    parser.add_argument('--image-size', type=int, default=512 * 1024, help='Size of every image in bytes')
+    parser.add_argument('--render-time', type=float, default=0.2, help='Seconds until a screenshot is done')
+    parser.add_argument('--latency', type=float, default=0.01, help='Seconds added to every request')
+    parser.add_argument('--parallel-limit', type=int, default=3, help='Parallel jobs limit of the fake account')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent downloads')
+    parser.add_argument('--poll-interval', type=float, default=0.1, help='Initial polling interval')
+    parser.add_argument('--json', help='Append results as a JSON line to this file')
+    options = parser.parse_args(argv)
+    options.catalog_path = os.path.join(tempfile.mkdtemp(), 'browsers.json')
+
+    server = FakeBrowserStack(
+        render_time=options.render_time, render_jitter=0.5, latency=options.latency,
+        parallel_limit=options.parallel_limit, image_size=options.image_size
+    )
+    with server:
+        results = bench_browsers(server, options)
+        results.append(bench_make(server, options, 1))
+        results.append(bench_make(server, options, options.concurrency))
+        results.append(bench_make(server, options, options.concurrency, instrumented=True))
+        results.append(bench_batch(server, options))
+    shutil.rmtree(os.path.dirname(options.catalog_path))
+
+    for result in results:
+        print(' '.join('%s=%s' % (key, format_value(value)) for key, value in sorted(result.items())))
+    if options.json:
+        with open(options.json, 'a') as f:
+            f.write(json.dumps({
+                'timestamp': time(),
+                'python': platform.python_version(),
+                'options': dict((key, value) for key, value in vars(options).items() if key != 'catalog_path'),
+                'results': results,
+            }) + '\n')
+
+
+if __name__ == '__main__':
+    main()
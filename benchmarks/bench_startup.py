@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+CLI startup and per-command overhead benchmarks.
+
+    $ python benchmarks/bench_startup.py --runs 20 --json results.jsonl
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import timeit
+from time import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from click.testing import CliRunner  # noqa: E402
+
+from browserstacker.cache import CACHE_DIR_ENVVAR, CatalogCache  # noqa: E402
+from browserstacker.fake import DEFAULT_BROWSERS  # noqa: E402
+
+HEAVY_MODULES = ('requests', 'multiprocessing.pool', 'http.server', 'BaseHTTPServer', 'aiohttp')
+IMPORT_SCRIPT = '''
+import sys
+import browserstacker.cli
+print(",".join(name for name in %r if name in sys.modules))
+''' % (HEAVY_MODULES, )
+
+
+def run_python(code, env):
+    start = time()
+    output = subprocess.check_output([sys.executable, '-c', code], env=env, cwd=ROOT)
+    return time() - start, output.decode('utf-8').strip()
+
+
+def bench_startup(options, env):
+    results = []
+    for name, args in (('help', ['--help']), ('command-help', ['browsers', '--help'])):
+        code = 'from browserstacker.cli import cli; cli(%r)' % args
+        timings = [run_python(code, env)[0] for _ in range(options.runs)]
+        results.append({'name': 'startup-%s' % name, 'min_ms': min(timings) * 1000,
+                        'mean_ms': sum(timings) / len(timings) * 1000})
+    results.append({'name': 'heavy-modules-on-import', 'modules': run_python(IMPORT_SCRIPT, env)[1] or '-'})
+    return results
+
+
+def bench_command(options):
+    from browserstacker.cli import cli
+
+    runner = CliRunner()
+    args = ['browsers', '--offline', '-os', 'Windows']
+    start = time()
+    for _ in range(options.runs):
+        result = runner.invoke(cli, args)
+        assert result.exit_code == 0, result.output
+    elapsed = time() - start
+    return {'name': 'command-browsers-offline', 'mean_ms': elapsed / options.runs * 1000}
+
+
+def bench_attributes(options):
+    from browserstacker.cli.helpers import APIWrapper
+
+    api = APIWrapper('user', 'key')
+    number = options.runs * 10000
+    elapsed = timeit.timeit(lambda: api.logger, number=number)
+    return {'name': 'attribute-access', 'ns_per_access': elapsed / number * 1e9}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='Number of runs per scenario')
+    parser.add_argument('--json', help='Append results as a JSON line to this file')
+    options = parser.parse_args(argv)
+
+    cache_dir = tempfile.mkdtemp()
+    os.environ[CACHE_DIR_ENVVAR] = cache_dir
+    CatalogCache().store(DEFAULT_BROWSERS, {})
+    env = dict(os.environ, PYTHONPATH=ROOT)
+
+    results = bench_startup(options, env)
+    results.append(bench_command(options))
+    results.append(bench_attributes(options))
+
+    for result in results:
+        print(' '.join(
+            '%s=%s' % (key, '%.2f' % value if isinstance(value, float) else value)
+            for key, value in sorted(result.items())
+        ))
+    if options.json:
+        with open(options.json, 'a') as f:
+            f.write(json.dumps({
+                'timestamp': time(),
+                'python': platform.python_version(),
+                'options': vars(options),
+                'results': results,
+            }) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,3 +4,17 @@ try:
     from urlparse import urljoin
 except ImportError:
     from urllib.parse import urljoin
+
+
+try:
+    from os import replace as replace_file
+except ImportError:
+    import os
+
+    def replace_file(src, dst):
+        try:
+            os.rename(src, dst)
+        except OSError:
+            # Windows doesn't allow renaming to an existing file
+            os.remove(dst)
+            os.rename(src, dst)
@@ -0,0 +1,16 @@
+# coding: utf-8
+"""
+HTTP server for the callback receiver and the fake API. Separated from `_compat`, because `http.server` is slow to
+import and is not needed by the client itself.
+"""
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
@@ -0,0 +1,178 @@
+# coding: utf-8
+"""
+Pool of BrowserStack accounts to run more jobs at once than one account allows.
+
+    >>> pool = CredentialPool([('user1', 'key1'), ('user2', 'key2')])
+    >>> api = ScreenShotsAPI('user1', 'key1', credential_pool=pool)
+    >>> api.make('http://www.example.com')
+    >>> pool.utilization()
+    [{'user': 'user1', 'running': 0, 'parallel_limit': None, 'generated': 1, 'rejected': 0, 'utilization': None}, ...]
+"""
+import threading
+from time import time
+
+from .cache import DEFAULT_CACHE_SIZE, BoundedCache
+from .polling import DEFAULT_TIMEOUT
+
+
+def parse_credentials(lines):
+    """
+    Reads `user:key` pairs, one per line. Blank lines and comments are skipped.
+    """
+    credentials = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        user, separator, key = line.partition(':')
+        if not separator or not user or not key:
+            raise ValueError('Expected "user:key", got "%s"' % line)
+        credentials.append((user.strip(), key.strip()))
+    return credentials
+
+
+class Account(object):
+    """
+    Credentials with jobs, that are running under them.
+    """
+
+    def __init__(self, user, key, parallel_limit=None):
+        self.user = user
+        self.key = key
+        self.parallel_limit = parallel_limit
+        self.jobs = set()
+        self.pending = 0
+        self.generated = 0
+        self.rejected = 0
+        self.retry_at = 0
+        self.probe_at = None
+
+    def __repr__(self):
+        return '<Account %s>' % self.user
+
+    @property
+    def auth(self):
+        return self.user, self.key
+
+    @property
+    def running(self):
+        return len(self.jobs) + self.pending
+
+    @property
+    def is_full(self):
+        return self.parallel_limit is not None and self.running >= self.parallel_limit
+
+    def has_capacity(self, now):
+        if now < self.retry_at:
+            return False
+        return not self.is_full or self.probe_at is not None and now >= self.probe_at
+
+    def get_load(self):
+        if self.parallel_limit:
+            return float(self.running) / self.parallel_limit
+        return self.running
+
+    def as_dict(self):
+        return {
+            'user': self.user,
+            'running': self.running,
+            'parallel_limit': self.parallel_limit,
+            'generated': self.generated,
+            'rejected': self.rejected,
+            'utilization': float(self.running) / self.parallel_limit if self.parallel_limit else None,
+        }
+
+
+class CredentialPool(object):
+    """
+    Routes new jobs to the least loaded account with free capacity and remembers, which account owns every job.
+    Parallel limits of accounts are learned from `ParallelLimitReached` responses and probed again after
+    `retry_delay` seconds like in `JobScheduler`.
+    If an account without running jobs is rejected, its slots are occupied by someone else and it is not used
+    for `retry_delay` seconds.
+    """
+
+    def __init__(self, accounts, retry_delay=DEFAULT_TIMEOUT, cache_size=DEFAULT_CACHE_SIZE):
+        self.accounts = [account if isinstance(account, Account) else Account(*account) for account in accounts]
+        if not self.accounts:
+            raise ValueError('At least one account is required')
+        self.retry_delay = retry_delay
+        self.owners = BoundedCache(cache_size)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.accounts)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path) as f:
+            return cls(parse_credentials(f), **kwargs)
+
+    def acquire(self, exclude=()):
+        """
+        Reserves capacity of the least loaded account. Returns None if all accounts are busy.
+        """
+        now = time()
+        with self.lock:
+            candidates = [
+                account for account in self.accounts if account not in exclude and account.has_capacity(now)
+            ]
+            if not candidates:
+                return None
+            account = min(candidates, key=lambda account: account.get_load())
+            if account.is_full:
+                # One job over the learned limit at a time
+                account.probe_at = now + self.retry_delay
+            account.pending += 1
+            return account
+
+    def assign(self, account, job_id):
+        with self.lock:
+            account.pending -= 1
+            account.generated += 1
+            if job_id is not None:
+                account.jobs.add(job_id)
+                self.owners[job_id] = account
+            if account.parallel_limit is not None and account.running > account.parallel_limit:
+                account.parallel_limit = account.running
+
+    def reject(self, account):
+        with self.lock:
+            account.pending -= 1
+            account.rejected += 1
+            if account.jobs:
+                account.parallel_limit = len(account.jobs)
+                account.probe_at = time() + self.retry_delay
+            else:
+                account.retry_at = time() + self.retry_delay
+
+    def cancel(self, account):
+        with self.lock:
+            account.pending -= 1
+
+    def release(self, job_id):
+        """
+        The job is finished, its account could run another one.
+        """
+        account = self.owners.get(job_id)
+        if account is not None:
+            with self.lock:
+                account.jobs.discard(job_id)
+
+    def adopt(self, job_id, user):
+        """
+        Registers a job, started by the account with this user earlier, e.g. by another process.
+        """
+        for account in self.accounts:
+            if account.user == user:
+                with self.lock:
+                    account.jobs.add(job_id)
+                    self.owners[job_id] = account
+                return account
+
+    def get_owner(self, job_id):
+        return self.owners.get(job_id)
+
+    def utilization(self):
+        with self.lock:
+            return [account.as_dict() for account in self.accounts]
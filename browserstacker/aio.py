@@ -0,0 +1,395 @@
+# coding: utf-8
+"""
+Asyncio client for BrowserStack Screenshots API. Requires `aiohttp`.
+"""
+import asyncio
+import os
+from base64 import b64encode
+from time import time
+
+import aiohttp
+
+from ._compat import replace_file, urljoin
+from .cache import DEFAULT_CACHE_SIZE, BoundedCache, CatalogUnavailable
+from .catalog import BrowserCatalog
+from .hooks import CALLBACK, GENERATE, POLL, REQUEST_END, REQUEST_START, RETRY, SAVE, SLEEP, Hooks
+from .manifest import Manifest, hash_file, new_hasher
+from .polling import DEFAULT_DEADLINE, DEFAULT_TIMEOUT, JobPoller
+from .screenshots import (
+    BROWSERS_URL, DEFAULT_CHUNK_SIZE, PARTIAL_SUFFIX, VALIDATOR_SUFFIX, IncompleteDownload, ScreenShotsAPI,
+    check_response, ensure_dir, get_expected_size, get_filename, get_logger, get_resume_headers, get_resume_offset,
+    get_validator, is_resumed_at, prepare_job, remove_file, write_validator
+)
+from .session import DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE, DEFAULT_REQUEST_TIMEOUT
+
+
+class AsyncScreenShotsAPI(object):
+    """
+    Asyncio wrapper for BrowserStack Screenshots API.
+    Mirrors `ScreenShotsAPI`, but all network-bound methods are coroutines.
+    """
+    root_url = ScreenShotsAPI.root_url
+    default_browser = ScreenShotsAPI.default_browser
+
+    def __init__(self, user, key, default_browser=None, verbosity=0, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, keep_alive=True, request_timeout=DEFAULT_REQUEST_TIMEOUT,
+                 chunk_size=DEFAULT_CHUNK_SIZE, catalog_cache=None, cache_size=DEFAULT_CACHE_SIZE, use_manifest=False,
+                 hooks=None, callback_receiver=None):
+        credentials = ('%s:%s' % (user or '', key or '')).encode('latin1')
+        self.auth = 'Basic ' + b64encode(credentials).decode('ascii')
+        self.default_browser = default_browser or self.default_browser
+        self.catalog_cache = catalog_cache
+        self.catalog = None
+        self._uncached_browsers = (None, None)
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.request_timeout = request_timeout
+        self.chunk_size = chunk_size
+        self.session = None
+        self.use_manifest = use_manifest
+        self.hooks = hooks if hooks is not None else Hooks()
+        self.callback_receiver = callback_receiver
+        self._cache = BoundedCache(cache_size)
+        self._manifests = {}
+        self.logger = get_logger(verbosity)
+        self.logger.info('Username: %s; Password: %s;', user, key)
+        self.logger.info('Default browser: %s;', self.default_browser)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        """
+        Closes all pooled connections.
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def get_session(self):
+        """
+        Session is created lazily, because it has to be bound to the running event loop.
+        """
+        if self.session is None:
+            if isinstance(self.request_timeout, tuple):
+                connect, read = self.request_timeout
+                timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+            else:
+                timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_connections * self.pool_maxsize,
+                limit_per_host=self.pool_maxsize,
+                force_close=not self.keep_alive
+            )
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+    async def request(self, method, url, **kwargs):
+        url = urljoin(self.root_url, url)
+        self.logger.debug('Making "%s" request to "%s" with "%s"', method, url, str(kwargs))
+        kwargs.setdefault('headers', {}).setdefault('Authorization', self.auth)
+        self.hooks.emit(REQUEST_START, method=method, url=url)
+        start = time()
+        try:
+            async with self.get_session().request(method, url, **kwargs) as response:
+                content = await response.read()
+        except Exception as exc:
+            self.hooks.emit(REQUEST_END, method=method, url=url, status=None, elapsed=time() - start, size=0, error=exc)
+            raise
+        self.hooks.emit(
+            REQUEST_END, method=method, url=url, status=response.status, elapsed=time() - start, size=len(content),
+            error=None
+        )
+        self.logger.debug('Response: "%s"', content)
+        return response
+
+    async def execute(self, method, url, **kwargs):
+        response = await self.request(method, url, **kwargs)
+        return check_response(await response.json(content_type=None))
+
+    async def fetch_browsers(self, refresh=False, offline=False):
+        """
+        Returns the full browsers catalog, using `catalog_cache` if it is configured.
+        """
+        cache = self.catalog_cache
+        if cache is None:
+            if offline:
+                raise CatalogUnavailable('Catalog cache is not configured')
+            return await self.fetch_uncached_browsers()
+        browsers = cache.get(refresh, offline)
+        if browsers is not None:
+            self.logger.debug('Using cached browsers catalog from "%s"', cache.path)
+            return browsers
+        response = await self.request('GET', BROWSERS_URL, headers=cache.get_validators())
+        if response.status == 304:
+            browsers = cache.revalidate()
+            if browsers is not None:
+                return browsers
+            # Cached entry is gone, the full catalog is needed
+            response = await self.request('GET', BROWSERS_URL)
+        return cache.store(check_response(await response.json(content_type=None)), response.headers)
+
+    async def fetch_uncached_browsers(self):
+        """
+        Requests the catalog with ETag of the previous response. If it is not modified, the previous list is returned,
+        so the indexed catalog is reused.
+        """
+        etag, browsers = self._uncached_browsers
+        headers = {'If-None-Match': etag} if etag and browsers is not None else {}
+        response = await self.request('GET', BROWSERS_URL, headers=headers)
+        if response.status == 304:
+            return browsers
+        fetched = check_response(await response.json(content_type=None))
+        self._uncached_browsers = (response.headers.get('ETag'), fetched)
+        return fetched
+
+    async def browsers(self, browser=None, browser_version=None, device=None, os=None, os_version=None,
+                       refresh=False, offline=False):
+        """
+        Returns list of available browsers & OS.
+        """
+        catalog = await self.get_catalog(refresh, offline)
+        return catalog.filter(
+            browser=browser, browser_version=browser_version, device=device, os=os, os_version=os_version
+        )
+
+    async def get_catalog(self, refresh=False, offline=False):
+        """
+        Returns indexed browsers catalog. Indexes are rebuilt only if the catalog has changed.
+        """
+        browsers = await self.fetch_browsers(refresh, offline)
+        if self.catalog is None or not self.catalog.is_built_from(browsers):
+            self.catalog = BrowserCatalog(browsers)
+        return self.catalog
+
+    async def make(self, url, browsers=None, destination=None, timeout=DEFAULT_TIMEOUT, retries=None, concurrency=1,
+                   deadline=DEFAULT_DEADLINE, **kwargs):
+        """
+        Generates screenshots for given settings and saves it to specified destination.
+        """
+        response = await self.generate(url, browsers, **kwargs)
+        return await self.download(response['job_id'], destination, timeout, retries, concurrency, deadline)
+
+    async def generate(self, url, browsers=None, orientation=None, mac_res=None, win_res=None, quality=None,
+                       local=None, wait_time=None, callback_url=None):
+        """
+        Generates screenshots for a URL.
+        If `callback_receiver` is set, BrowserStack is asked to notify it when the job is done.
+        """
+        if callback_url is None and self.callback_receiver is not None:
+            callback_url = self.callback_receiver.url
+        data = prepare_job(
+            url, browsers, self.default_browser, orientation=orientation, mac_res=mac_res, win_res=win_res,
+            quality=quality, local=local, wait_time=wait_time, callback_url=callback_url
+        )
+        start = time()
+        response = await self.execute('POST', '/screenshots', json=data)
+        self.hooks.emit(
+            GENERATE, url=url, job_id=response.get('job_id'), browsers=len(data['browsers']), elapsed=time() - start
+        )
+        return response
+
+    async def list(self, job_id):
+        """
+        Generate the list of screenshots and their states.
+        """
+        return await self.execute('GET', '/screenshots/%s.json' % job_id)
+
+    async def download(self, job_id, destination=None, timeout=DEFAULT_TIMEOUT, retries=None, concurrency=1,
+                       deadline=DEFAULT_DEADLINE):
+        """
+        Downloads all screenshots for given job_id to `destination` folder and returns mapping of their URLs to
+        local filenames.
+        If `destination` is None, then screenshots will be saved in current directory.
+        Up to `concurrency` screenshots are downloaded at once.
+        """
+        poller = JobPoller(job_id, timeout, deadline, retries)
+        if self.callback_receiver is None:
+            await self.wait(timeout, job_id)
+        elif await self.wait_callback(job_id, deadline) is None:
+            self.logger.debug('No callback for %s, falling back to polling', job_id)
+        # Callback payloads are not trusted, the job is listed anyway
+        return await self.save_many(poller, destination, concurrency)
+
+    async def wait_callback(self, job_id, deadline=None):
+        """
+        Waits for the job's callback without blocking the event loop. Returns its payload or None.
+        """
+        timeout = self.callback_receiver.timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline)
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def set_result(payload):
+            if not future.done():
+                future.set_result(payload)
+
+        def callback(payload):
+            loop.call_soon_threadsafe(set_result, payload)
+
+        start = time()
+        self.callback_receiver.subscribe(job_id, callback)
+        try:
+            response = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            response = None
+        finally:
+            self.callback_receiver.unsubscribe(job_id, callback)
+        self.hooks.emit(CALLBACK, job_id=job_id, received=response is not None, elapsed=time() - start)
+        return response
+
+    async def save_many(self, poller, destination=None, concurrency=1):
+        """
+        Polls the job and saves every screenshot as soon as it is done.
+        """
+        result = {}
+        while True:
+            start = time()
+            ready = poller.update(await self.list(poller.job_id))
+            self.hooks.emit(
+                POLL, job_id=poller.job_id, attempt=poller.polls, ready=len(ready), pending=len(poller.pending),
+                elapsed=time() - start
+            )
+            result.update(await self.save_all(ready, destination, concurrency))
+            if poller.is_finished:
+                break
+            delay = poller.next_delay()
+            if delay is None:
+                self.logger.debug('Deadline exceeded for %s. Pending: %s', poller.job_id, poller.pending)
+                break
+            self.logger.debug('Retrying download for %s in %.2f seconds', poller.job_id, delay)
+            self.hooks.emit(RETRY, reason='pending', job_id=poller.job_id, url=None, attempt=poller.polls, delay=delay)
+            await self.wait(delay, poller.job_id)
+        return result
+
+    async def wait(self, delay, job_id=None):
+        self.hooks.emit(SLEEP, job_id=job_id, duration=delay)
+        await asyncio.sleep(delay)
+
+    async def save_all(self, image_urls, destination=None, concurrency=1):
+        """
+        Saves images, running up to `concurrency` downloads at once. Returns mapping of URLs to filenames.
+        Every URL is downloaded only once, even if it is listed several times.
+        """
+        result, queue = {}, []
+        for image_url in image_urls:
+            if image_url not in result:
+                result[image_url] = self._cache.get(image_url)
+                if result[image_url] is None:
+                    queue.append(image_url)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def save(image_url):
+            async with semaphore:
+                return await self.save(image_url, destination)
+
+        filenames = await asyncio.gather(*[save(image_url) for image_url in queue])
+        result.update(zip(queue, filenames))
+        return result
+
+    async def save(self, image_url, destination=None):
+        """
+        Saves image to `destination` and returns its filename.
+        Images, recorded in the destination's manifest, are not downloaded again.
+        """
+        filename = self._cache.get(image_url)
+        if filename is not None:
+            return filename
+        start = time()
+        if destination:
+            ensure_dir(destination)
+        filename = get_filename(image_url, destination)
+        manifest = self.get_manifest(destination)
+        record = manifest.get(image_url, filename) if manifest is not None else None
+        if record is not None:
+            self.logger.debug('"%s" is already saved to "%s"', image_url, filename)
+            size = record['size']
+        else:
+            self.logger.debug('Saving "%s" to "%s" ...', image_url, filename)
+            size, checksum = await self.fetch(image_url, filename)
+            if manifest is not None:
+                manifest.add(image_url, filename, size, checksum)
+        self._cache[image_url] = filename
+        self.hooks.emit(
+            SAVE, image_url=image_url, filename=filename, size=size, elapsed=time() - start, skipped=record is not None
+        )
+        return filename
+
+    def get_manifest(self, destination=None):
+        if not self.use_manifest:
+            return None
+        key = os.path.abspath(destination or os.curdir)
+        if key not in self._manifests:
+            self._manifests[key] = Manifest(destination)
+        return self._manifests[key]
+
+    async def fetch(self, image_url, filename):
+        """
+        Streams image into a partial file and renames it to `filename` when it is complete.
+        Interrupted downloads are resumed with HTTP Range requests if the server supports them.
+        """
+        partial = filename + PARTIAL_SUFFIX
+        offset = get_resume_offset(partial)
+        headers = get_resume_headers(partial, offset)
+        self.hooks.emit(REQUEST_START, method='GET', url=image_url)
+        start = time()
+        status = size = error = None
+        received = 0
+        try:
+            async with self.get_session().get(image_url, headers=headers) as image_response:
+                status = image_response.status
+                if offset and status in (206, 416) and not is_resumed_at(status, image_response.headers, offset):
+                    # Nothing to resume or another part is sent, the image is downloaded again
+                    os.remove(partial)
+                else:
+                    image_response.raise_for_status()
+                    if status != 206:
+                        offset = 0
+                        write_validator(partial, get_validator(image_response.headers))
+                    hasher = new_hasher()
+                    if offset:
+                        await self.run_in_executor(hash_file, partial, hasher, self.chunk_size)
+                    expected_size = get_expected_size(image_response.headers, offset)
+                    received = await self.save_file(partial, image_response, 'ab' if offset else 'wb', hasher)
+                    size = offset + received
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            self.hooks.emit(
+                REQUEST_END, method='GET', url=image_url, status=status, elapsed=time() - start, size=received,
+                error=error
+            )
+        if size is None:
+            self.hooks.emit(RETRY, reason='range', job_id=None, url=image_url, attempt=1, delay=0)
+            return await self.fetch(image_url, filename)
+        if expected_size is not None and size != expected_size:
+            raise IncompleteDownload('Got %s of %s bytes from "%s"' % (size, expected_size, image_url))
+        replace_file(partial, filename)
+        remove_file(partial + VALIDATOR_SUFFIX)
+        return size, hasher.hexdigest()
+
+    async def save_file(self, filename, content, mode='wb', hasher=None):
+        """
+        Streams response body to local filesystem. Returns number of written bytes.
+        File operations run in the default executor, so other coroutines are not blocked by the disk.
+        """
+        size = 0
+        f = await self.run_in_executor(open, filename, mode)
+        try:
+            async for chunk in content.content.iter_chunked(self.chunk_size):
+                await self.run_in_executor(f.write, chunk)
+                size += len(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+        finally:
+            await self.run_in_executor(f.close)
+        return size
+
+    async def run_in_executor(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
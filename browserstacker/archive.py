@@ -0,0 +1,261 @@
+# coding: utf-8
+"""
+Zip and tar archives as download destinations, to avoid creating thousands of small files.
+
+    >>> with open_archive('screenshots.zip') as archive:
+    ...     api.make('http://www.example.com', destination=archive)
+
+Images are streamed from HTTP responses straight into the archive. Every job's images are stored as
+`<job_id>/<image name>` and `<job_id>.index.json` maps browser keys to entry names. Existing archives are appended to,
+images, that are already there, are not downloaded again.
+While an image is written, images of concurrent downloads are collected in memory.
+`zipfile` and `tarfile` are imported only when an archive is opened.
+"""
+import json
+import os
+import sys
+import threading
+import warnings
+from time import localtime, time
+
+from .catalog import get_key
+
+
+INDEX_SUFFIX = '.index.json'
+
+
+def is_archive(path):
+    return isinstance(path, str) and path.lower().endswith(('.zip', '.tar'))
+
+
+def open_archive(path):
+    if path.lower().endswith('.zip'):
+        return ZipArchive(path)
+    if path.lower().endswith('.tar'):
+        return TarArchive(path)
+    raise ValueError('Unsupported archive: %s. Use .zip or .tar' % path)
+
+
+class ChunkReader(object):
+    """
+    File-like object over an iterator of chunks.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class Archive(object):
+    """
+    Base class for archive formats. Subclasses open the file for appending, load existing entries and implement
+    writing of a single entry with `add` and its removal after a failure with `rollback`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.sizes = {}
+        self.open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.sizes
+
+    def get_path(self, name):
+        return os.path.join(self.path, name)
+
+    def job(self, job_id):
+        return ArchiveJob(self, job_id)
+
+    def write(self, name, chunks, size=None):
+        """
+        Streams chunks into a new entry. The entry is removed if the stream fails. Returns number of written bytes.
+        """
+        if not self.lock.acquire(False):
+            # Another entry is being written
+            data = b''.join(chunks)
+            chunks, size = [data], len(data)
+            self.lock.acquire()
+        try:
+            written = self.add(name, chunks, size)
+            self.sizes[name] = written
+            return written
+        finally:
+            self.lock.release()
+
+    def read(self, name):
+        with self.lock:
+            return self.read_entry(name)
+
+    def get_index(self, job_id):
+        name = job_id + INDEX_SUFFIX
+        if name not in self:
+            return {}
+        return json.loads(self.read(name).decode('utf-8'))
+
+    def write_index(self, job_id, index):
+        """
+        Merges the index with the one from previous runs. It is written only if it is changed.
+        """
+        old_index = self.get_index(job_id)
+        new_index = dict(old_index, **index)
+        if new_index != old_index:
+            data = json.dumps(new_index, indent=2, sort_keys=True).encode('utf-8')
+            with warnings.catch_warnings():
+                # Index of previous runs is replaced with a duplicate entry
+                warnings.simplefilter('ignore')
+                self.write(job_id + INDEX_SUFFIX, [data], len(data))
+        return new_index
+
+
+class ArchiveJob(object):
+    """
+    Destination for a single job's images in an archive.
+    """
+
+    def __init__(self, archive, job_id):
+        self.archive = archive
+        self.job_id = job_id
+        self.index = {}
+
+    def get_name(self, image_url):
+        return '%s/%s' % (self.job_id, image_url.split('/')[-1])
+
+    def add_record(self, record):
+        """
+        Adds a saved screenshot to the job's index and fills its size.
+        """
+        name = self.get_name(record['image_url'])
+        record['bytes'] = self.archive.sizes.get(name)
+        self.index[get_key(record)] = {
+            'name': name, 'image_url': record['image_url'], 'url': record.get('url'), 'size': record['bytes']
+        }
+
+    def close(self):
+        if self.index:
+            self.archive.write_index(self.job_id, self.index)
+
+
+class ZipArchive(Archive):
+    """
+    Zip archive. Images are already compressed, so they are stored as is.
+    """
+
+    def open(self):
+        import zipfile
+
+        self.zip = zipfile.ZipFile(self.path, 'a', zipfile.ZIP_STORED, allowZip64=True)
+        for info in self.zip.infolist():
+            self.sizes[info.filename] = info.file_size
+
+    def add(self, name, chunks, size):
+        import zipfile
+
+        info = zipfile.ZipInfo(name, localtime(time())[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        info.external_attr = 0o644 << 16
+        if sys.version_info < (3, 6):
+            data = b''.join(chunks)
+            self.zip.writestr(info, data)
+            return len(data)
+        start, count = self.zip.start_dir, len(self.zip.filelist)
+        written = 0
+        try:
+            with self.zip.open(info, 'w', force_zip64=size is None or size >= zipfile.ZIP64_LIMIT) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    written += len(chunk)
+        except Exception:
+            self.rollback(start, count)
+            raise
+        return written
+
+    def rollback(self, start, count):
+        """
+        Removes entries, written after `start` offset, from the file and the central directory.
+        """
+        del self.zip.filelist[count:]
+        self.zip.NameToInfo = dict((info.filename, info) for info in self.zip.filelist)
+        self.zip.fp.seek(start)
+        self.zip.fp.truncate()
+        self.zip.start_dir = start
+
+    def read_entry(self, name):
+        return self.zip.read(name)
+
+    def close(self):
+        self.zip.close()
+
+
+class TarArchive(Archive):
+    """
+    Uncompressed tar archive, compressed ones can't be appended to.
+    """
+
+    def open(self):
+        import tarfile
+
+        self.tar = tarfile.open(self.path, 'a')
+        for member in self.tar.getmembers():
+            self.sizes[member.name] = member.size
+
+    def add(self, name, chunks, size):
+        if size is None:
+            # Size is written before the content
+            data = b''.join(chunks)
+            chunks, size = [data], len(data)
+        import tarfile
+
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = time()
+        info.mode = 0o644
+        start, count = self.tar.offset, len(self.tar.members)
+        reader = ChunkReader(chunks)
+        try:
+            self.tar.addfile(info, reader)
+            if reader.read(1):
+                raise IOError('"%s" is larger than %s bytes' % (name, size))
+        except Exception:
+            self.rollback(start, count)
+            raise
+        return size
+
+    def rollback(self, start, count):
+        """
+        Removes entries, written after `start` offset.
+        """
+        del self.tar.members[count:]
+        self.tar.fileobj.seek(start)
+        self.tar.fileobj.truncate()
+        self.tar.offset = start
+
+    def read_entry(self, name):
+        # `extractfile` is not available in the append mode
+        member = self.tar.getmember(name)
+        try:
+            self.tar.fileobj.seek(member.offset_data)
+            return self.tar.fileobj.read(member.size)
+        finally:
+            # New entries are written at the current position
+            self.tar.fileobj.seek(self.tar.offset)
+
+    def close(self):
+        self.tar.close()
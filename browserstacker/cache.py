@@ -0,0 +1,313 @@
+# coding: utf-8
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from time import time
+
+from ._compat import replace_file
+
+
+DEFAULT_CATALOG_TTL = 24 * 60 * 60
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_MEMO_TTL = 10 * 60
+MEMO_FIELDS = ('url', 'orientation', 'mac_res', 'win_res', 'quality', 'local', 'wait_time')
+CACHE_DIR_ENVVAR = 'BROWSERSTACKER_CACHE_DIR'
+
+
+class CatalogUnavailable(RuntimeError):
+    pass
+
+
+def get_cache_dir():
+    """
+    Returns directory for cached data. Could be overridden with BROWSERSTACKER_CACHE_DIR environment variable.
+    """
+    if os.environ.get(CACHE_DIR_ENVVAR):
+        return os.environ[CACHE_DIR_ENVVAR]
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(root, 'browserstacker')
+
+
+def atomic_write(path, data, mode='w'):
+    """
+    Writes data to a temporary file in the same directory and renames it, so readers never see partial content.
+    """
+    directory = os.path.dirname(path) or '.'
+    try:
+        os.makedirs(directory)
+    except OSError:
+        pass
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+        replace_file(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def get_stamp(path):
+    """
+    Files are replaced atomically, so inode changes on every write.
+    """
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime, stat.st_size
+
+
+class CatalogCache(object):
+    """
+    Cache for browsers catalog, stored in memory and on disk.
+    The disk copy is shared between processes and is revalidated with ETag / Last-Modified when `ttl` expires.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_CATALOG_TTL):
+        self.path = path or os.path.join(get_cache_dir(), 'browsers.json')
+        self.ttl = ttl
+        self._entry = None
+        self._stamp = None
+
+    def load(self):
+        """
+        Returns cached entry. Memory copy is re-read if another process updated the file.
+        """
+        try:
+            stamp = get_stamp(self.path)
+        except OSError:
+            return self._entry
+        if stamp != self._stamp:
+            try:
+                with open(self.path) as f:
+                    self._entry = json.load(f)
+            except ValueError:
+                self._entry = None
+            self._stamp = stamp
+        return self._entry
+
+    def get(self, refresh=False, offline=False):
+        """
+        Returns cached browsers if they are fresh. In offline mode stale browsers are returned too.
+        """
+        entry = self.load()
+        if offline:
+            if entry is None:
+                raise CatalogUnavailable('Browsers catalog is not cached: %s' % self.path)
+            return entry['browsers']
+        if entry is not None and not refresh and time() - entry['fetched_at'] < self.ttl:
+            return entry['browsers']
+
+    def get_validators(self):
+        """
+        Headers for conditional request.
+        """
+        headers = {}
+        if self._entry is not None:
+            if self._entry.get('etag'):
+                headers['If-None-Match'] = self._entry['etag']
+            if self._entry.get('last_modified'):
+                headers['If-Modified-Since'] = self._entry['last_modified']
+        return headers
+
+    def revalidate(self):
+        """
+        Catalog was not modified on the server - extends lifetime of the cached entry.
+        Returns None if there is no entry anymore, e.g. the file was removed after the conditional request was sent.
+        """
+        entry = self._entry
+        if entry is None:
+            return None
+        entry['fetched_at'] = time()
+        self.write(entry)
+        return entry['browsers']
+
+    def store(self, browsers, headers):
+        self.write({
+            'browsers': browsers,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'fetched_at': time(),
+        })
+        return browsers
+
+    def write(self, entry):
+        atomic_write(self.path, json.dumps(entry))
+        self._entry = entry
+        self._stamp = get_stamp(self.path)
+
+    def clear(self):
+        self._entry = self._stamp = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class BoundedCache(object):
+    """
+    Thread-safe mapping, that evicts least recently used items when it grows over `maxsize`.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __iter__(self):
+        return iter(list(self.data))
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self.data.pop(key)
+            self.data[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+def get_job_key(payload):
+    """
+    Key of `generate` payload. Order of browsers and case of their fields don't matter, callback URL is ignored.
+    """
+    data = dict((key, payload[key]) for key in MEMO_FIELDS if payload.get(key) is not None)
+    browsers = [
+        dict((key, str(value).lower()) for key, value in browser.items() if value is not None)
+        for browser in payload['browsers']
+    ]
+    data['browsers'] = sorted(browsers, key=lambda browser: sorted(browser.items()))
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class JobMemo(object):
+    """
+    Recently generated jobs and their downloaded results, keyed by normalized `generate` payloads.
+    Entries expire after `ttl` seconds, at most `maxsize` jobs and results are kept.
+    If `path` is given, entries are stored on disk too and shared between processes. Concurrent writers could lose
+    each other's entries, that only leads to extra jobs.
+    """
+
+    def __init__(self, ttl=DEFAULT_MEMO_TTL, maxsize=DEFAULT_CACHE_SIZE, path=None):
+        self.ttl = ttl
+        self.path = path
+        self.jobs = BoundedCache(maxsize)
+        self.results = BoundedCache(maxsize)
+        self.lock = threading.Lock()
+        self._stamp = None
+
+    def is_fresh(self, entry):
+        return time() - entry['created_at'] < self.ttl
+
+    def load(self):
+        """
+        Merges entries, written by other processes.
+        """
+        if self.path is None:
+            return
+        try:
+            stamp = get_stamp(self.path)
+        except OSError:
+            return
+        if stamp == self._stamp:
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            data = {}
+        for name in ('jobs', 'results'):
+            cache = getattr(self, name)
+            for key, entry in data.get(name, []):
+                if key not in cache and self.is_fresh(entry):
+                    cache[key] = entry
+        self._stamp = stamp
+
+    def dump(self):
+        if self.path is None:
+            return
+        with self.lock:
+            self.load()
+            data = {}
+            for name in ('jobs', 'results'):
+                cache = getattr(self, name)
+                entries = [(key, cache.data.get(key)) for key in cache]
+                data[name] = [(key, entry) for key, entry in entries if entry is not None and self.is_fresh(entry)]
+            atomic_write(self.path, json.dumps(data))
+            self._stamp = get_stamp(self.path)
+
+    def lookup(self, cache, key):
+        entry = cache.get(key)
+        if entry is None:
+            with self.lock:
+                self.load()
+            entry = cache.get(key)
+        if entry is not None and self.is_fresh(entry):
+            return entry
+
+    def get_job_entry(self, payload):
+        """
+        Returns response of a fresh job with the same payload, the account, that started it, and its callback URL.
+        """
+        return self.lookup(self.jobs, get_job_key(payload))
+
+    def get_job(self, payload):
+        """
+        Returns response of a fresh job with the same payload.
+        """
+        entry = self.get_job_entry(payload)
+        if entry is not None:
+            return entry['response']
+
+    def add_job(self, payload, response, account=None):
+        self.jobs[get_job_key(payload)] = {
+            'response': response, 'account': account, 'callback_url': payload.get('callback_url'), 'created_at': time()
+        }
+        self.dump()
+
+    def get_results_key(self, job_id, destination):
+        return '%s:%s' % (job_id, os.path.abspath(destination or os.curdir))
+
+    def get_results(self, job_id, destination=None):
+        """
+        Returns fresh results of the job's download to `destination`, if all files still exist.
+        """
+        entry = self.lookup(self.results, self.get_results_key(job_id, destination))
+        if entry is not None and all(os.path.exists(filename) for filename in entry['results'].values()):
+            return entry['results']
+
+    def add_results(self, job_id, destination, results):
+        self.results[self.get_results_key(job_id, destination)] = {'results': results, 'created_at': time()}
+        self.dump()
+
+    def clear(self):
+        self.jobs.clear()
+        self.results.clear()
+        self._stamp = None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
@@ -0,0 +1,131 @@
+# coding: utf-8
+"""
+Embedded receiver for BrowserStack completion callbacks.
+
+    >>> with CallbackReceiver(host='0.0.0.0', port=8000, public_url='http://example.com:8000/') as receiver:
+    ...     api = ScreenShotsAPI('user', 'key', callback_receiver=receiver)
+    ...     api.make('http://www.google.com')
+"""
+import json
+import socket
+import threading
+
+from ._server import BaseHTTPRequestHandler, ThreadedHTTPServer
+from .cache import DEFAULT_CACHE_SIZE, BoundedCache
+
+
+DEFAULT_CALLBACK_TIMEOUT = 300
+
+
+def get_job_id(payload):
+    if isinstance(payload, dict):
+        return payload.get('job_id') or payload.get('id')
+
+
+class CallbackHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            payload = json.loads(body.decode('utf-8'))
+        except ValueError:
+            payload = None
+        job_id = get_job_id(payload)
+        self.send_response(400 if job_id is None else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        if job_id is not None:
+            self.server.receiver.notify(payload)
+
+
+class CallbackReceiver(object):
+    """
+    Threaded HTTP server, that accepts job callbacks and wakes up everyone waiting for the job.
+    Callbacks are not authenticated, so they are only signals to list the job, their payloads are not trusted.
+    BrowserStack has to reach it, so pass `public_url` if the receiver is behind NAT or a proxy.
+    Waiting for a callback is limited by `timeout` seconds, after that clients fall back to polling.
+    Callbacks for jobs, that nobody waits yet, are kept for later, up to `cache_size` of them.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, public_url=None, timeout=DEFAULT_CALLBACK_TIMEOUT,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        self.public_url = public_url
+        self.timeout = timeout
+        self.results = BoundedCache(cache_size)
+        self.listeners = {}
+        self.lock = threading.Lock()
+        self.server = ThreadedHTTPServer((host, port), CallbackHandler)
+        self.server.receiver = self
+        self.thread = None
+
+    @property
+    def url(self):
+        if self.public_url:
+            return self.public_url
+        host, port = self.server.server_address[:2]
+        if host in ('0.0.0.0', ''):
+            host = socket.gethostname()
+        return 'http://%s:%s/' % (host, port)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def notify(self, payload):
+        job_id = get_job_id(payload)
+        with self.lock:
+            self.results[job_id] = payload
+            listeners = self.listeners.pop(job_id, [])
+        for callback in listeners:
+            callback(payload)
+
+    def subscribe(self, job_id, callback):
+        """
+        Calls `callback` with the job's payload when it arrives. If it is already received, calls immediately.
+        Callbacks are called from the server's thread.
+        """
+        with self.lock:
+            payload = self.results.get(job_id)
+            if payload is None:
+                self.listeners.setdefault(job_id, []).append(callback)
+                return
+        callback(payload)
+
+    def unsubscribe(self, job_id, callback):
+        with self.lock:
+            listeners = [item for item in self.listeners.get(job_id, []) if item != callback]
+            if listeners:
+                self.listeners[job_id] = listeners
+            else:
+                self.listeners.pop(job_id, None)
+
+    def wait(self, job_id, timeout=None):
+        """
+        Blocks until the job's callback is received. Returns its payload or None on timeout.
+        """
+        event, received = threading.Event(), []
+
+        def callback(payload):
+            received.append(payload)
+            event.set()
+
+        self.subscribe(job_id, callback)
+        event.wait(self.timeout if timeout is None else timeout)
+        self.unsubscribe(job_id, callback)
+        return received[0] if received else None
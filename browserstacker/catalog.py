@@ -0,0 +1,80 @@
+# coding: utf-8
+import re
+
+
+INDEXED_FIELDS = ('browser', 'browser_version', 'device', 'os', 'os_version')
+KEY_FIELDS = ('os', 'os_version', 'browser', 'browser_version', 'device')
+
+
+def normalize(value):
+    return str(value).lower()
+
+
+def get_key(browser):
+    """
+    Name of the browser & OS combination, that is safe to use as a filename.
+    """
+    parts = [browser.get(field) for field in KEY_FIELDS]
+    key = '_'.join(normalize(part) for part in parts if part)
+    return re.sub(r'[^a-z0-9.\-]+', '_', key).strip('_')
+
+
+class BrowserCatalog(object):
+    """
+    Browsers list with inverted indexes over normalized field values.
+    Filtering is done by intersecting sets of positions instead of scanning the whole list.
+    Filter semantics are the same as in `match_item` - values are case insensitive, multiple values are OR-ed
+    and an item without the filtered key matches any value.
+    """
+
+    def __init__(self, browsers):
+        self.browsers = browsers
+        self.positions = frozenset(range(len(browsers)))
+        self.indexes = {}
+        for key in INDEXED_FIELDS:
+            self.build_index(key)
+
+    def __len__(self):
+        return len(self.browsers)
+
+    def is_built_from(self, browsers):
+        # Unchanged catalogs are returned as the same list, comparing the contents would cost as much as indexing
+        return self.browsers is browsers
+
+    def build_index(self, key):
+        """
+        Maps normalized values to positions of items. Positions of items without `key` are stored under None.
+        """
+        index = {None: set()}
+        for position, item in enumerate(self.browsers):
+            if key in item:
+                index.setdefault(normalize(item[key]), set()).add(position)
+            else:
+                index[None].add(position)
+        self.indexes[key] = index
+        return index
+
+    def lookup(self, key, value):
+        index = self.indexes.get(key) or self.build_index(key)
+        positions = set(index[None])
+        values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+        for sub_value in values:
+            if isinstance(sub_value, (list, tuple)):
+                positions |= self.lookup(key, sub_value)
+            else:
+                positions |= index.get(normalize(sub_value), set())
+        return positions
+
+    def filter(self, **filters):
+        """
+        Returns browsers, that match all non-empty filters, in the original order.
+        """
+        positions = self.positions
+        for key, value in filters.items():
+            if value:
+                positions = positions & self.lookup(key, value)
+                if not positions:
+                    return []
+        if positions is self.positions:
+            return list(self.browsers)
+        return [self.browsers[position] for position in sorted(positions)]
@@ -1,26 +1,163 @@
 # coding: utf-8
+import json
+from functools import wraps
+from os import path
+
 import click
 
-from .helpers import APIWrapper, format_browsers
+from .helpers import APIWrapper, echo_stdout, format_browsers, get_url_dirname, parse_job, parse_size
+from ..cache import DEFAULT_CATALOG_TTL, CatalogCache, JobMemo, get_cache_dir
+from ..catalog import INDEXED_FIELDS
 from ..constants import ORIENTATIONS, MAC_RESOLUTIONS, WIN_RESOLUTIONS, QUALITIES, LOCALS, WAIT_TIMES
+from ..polling import DEFAULT_DEADLINE
+from ..progress import collect_saved
+from ..retry import RetryPolicy
+from ..scheduler import JobScheduler
 
 
 @click.group(context_settings={'auto_envvar_prefix': 'BROWSERSTACK'})
-@click.option('-u', '--user', help='Username on BrowserStack')
-@click.option('-k', '--key', help='Access key')
+@click.option('-u', '--user', multiple=True, help='Username on BrowserStack, repeat with --key for more accounts')
+@click.option('-k', '--key', multiple=True, help='Access key')
+@click.option(
+    '--credentials-file', type=click.Path(exists=True, dir_okay=False), help='Accounts to use, "user:key" per line'
+)
 @click.option('-v', '--verbosity', count=True, help='Verbosity level')
+@click.option(
+    '--catalog-ttl', type=click.IntRange(0), default=DEFAULT_CATALOG_TTL, help='Seconds to cache browsers catalog'
+)
+@click.option('--manifest/--no-manifest', default=True, help='Skip images, downloaded by previous runs')
+@click.option('--metrics-file', type=click.Path(dir_okay=False), help='Write metrics in Prometheus format on exit')
+@click.option('--statsd', metavar='HOST:PORT', help='Send metrics to statsd')
+@click.option(
+    '--callback-listen', metavar='HOST:PORT',
+    help='Wait for job callbacks on this address instead of polling, host is 127.0.0.1 by default'
+)
+@click.option('--callback-public-url', help='URL of the callback receiver, reachable by BrowserStack')
+@click.option('--hash-index', type=click.Path(dir_okay=False), help='Add perceptual hashes of saved screenshots here')
+@click.option('--store', type=click.Path(file_okay=False), help='Save every distinct image once to this directory')
+@click.option(
+    '--store-link', type=click.Choice(['hardlink', 'symlink', 'copy']), default='hardlink',
+    help='How images from the store appear in destinations'
+)
+@click.option('--rate-limit', type=click.FloatRange(0.01), help='API requests per second, shared by all processes')
+@click.option('--rate-burst', type=click.IntRange(1), help='Number of requests, that could be sent at once')
+@click.option('--max-jobs', type=click.IntRange(1), help='Number of jobs running at once, shared by all processes')
+@click.option('--rate-limit-file', type=click.Path(dir_okay=False), help='Shared state of the rate limiter')
+@click.option(
+    '--memo-ttl', type=click.IntRange(1), help='Reuse jobs with the same URL, browsers & options for this many seconds'
+)
+@click.option('--max-retries', type=click.IntRange(0), help='Retries of failed requests and downloads, 0 to disable')
+@click.option('--retry-total', type=click.FloatRange(0), help='Seconds for all attempts of a single request')
+@click.option('--ledger', type=click.Path(dir_okay=False), help='Record jobs here, so they could be resumed')
 @click.version_option()
 @click.pass_context
-def cli(ctx, user, key, verbosity):
-    ctx.obj = APIWrapper(user, key, verbosity=verbosity)
+def cli(ctx, user, key, credentials_file, verbosity, catalog_ttl, manifest, metrics_file, statsd, callback_listen,
+        callback_public_url, hash_index, store, store_link, rate_limit, rate_burst, max_jobs, rate_limit_file, memo_ttl,
+        max_retries, retry_total, ledger):
+    receiver = None
+    if callback_listen:
+        from ..callbacks import CallbackReceiver
+
+        host, _, port = callback_listen.partition(':')
+        receiver = CallbackReceiver(host or '127.0.0.1', int(port or 0), callback_public_url).start()
+        ctx.call_on_close(receiver.stop)
+    if store:
+        from ..store import ContentStore
+
+        store = ContentStore(store, store_link)
+    rate_limiter = None
+    if rate_limit or max_jobs:
+        from ..ratelimit import RateLimiter
+
+        rate_limiter = RateLimiter(rate_limit_file, rate=rate_limit, burst=rate_burst, max_jobs=max_jobs)
+    if len(user) != len(key):
+        raise click.BadParameter('Every --user needs a --key', param_hint='--user/--key')
+    credential_pool = get_credential_pool(zip(user, key), credentials_file)
+    if credential_pool is not None:
+        user, key = credential_pool.accounts[0].auth
+    else:
+        user, key = (user[0], key[0]) if user else (None, None)
+    if ledger:
+        from ..ledger import JobLedger
+
+        ledger = JobLedger(ledger)
+    ctx.obj = APIWrapper(
+        user, key, verbosity=verbosity, catalog_cache=CatalogCache(ttl=catalog_ttl), use_manifest=manifest,
+        callback_receiver=receiver, store=store, rate_limiter=rate_limiter,
+        memo=JobMemo(memo_ttl, path=path.join(get_cache_dir(), 'jobs.json')) if memo_ttl else None,
+        credential_pool=credential_pool, retry_policy=get_retry_policy(max_retries, retry_total), ledger=ledger
+    )
+    if credential_pool is not None:
+        ctx.call_on_close(lambda: log_utilization(ctx.obj))
+    if metrics_file:
+        from ..metrics import MetricsCollector
+
+        metrics = MetricsCollector(ctx.obj.hooks)
+        ctx.call_on_close(lambda: metrics.write_textfile(metrics_file))
+    if statsd:
+        from ..metrics import DEFAULT_STATSD_PORT, StatsdExporter
+
+        host, _, port = statsd.partition(':')
+        exporter = StatsdExporter(ctx.obj.hooks, host or '127.0.0.1', int(port or DEFAULT_STATSD_PORT))
+        ctx.call_on_close(exporter.close)
+    if hash_index:
+        from ..phash import HashIndex
+
+        try:
+            HashIndex(hash_index, ctx.obj.hooks)
+        except ImportError as exc:
+            raise click.UsageError(str(exc))
+
+
+def get_credential_pool(credentials, credentials_file):
+    """
+    Pool of accounts if more than one is given.
+    """
+    credentials = [pair for pair in credentials]
+    if credentials_file:
+        from ..accounts import parse_credentials
+
+        with open(credentials_file) as f:
+            try:
+                credentials += parse_credentials(f)
+            except ValueError as exc:
+                raise click.BadParameter(str(exc), param_hint='--credentials-file')
+        if not credentials:
+            raise click.BadParameter('No accounts found', param_hint='--credentials-file')
+    if len(credentials) > 1 or credentials_file:
+        from ..accounts import CredentialPool
+
+        return CredentialPool(credentials)
+
+
+def get_retry_policy(max_retries, retry_total):
+    kwargs = {}
+    if max_retries is not None:
+        kwargs['attempts'] = max_retries
+    if retry_total is not None:
+        kwargs['total'] = retry_total
+    return RetryPolicy(**kwargs)
+
+
+def log_utilization(api):
+    for account in api.utilization():
+        api.logger.info(
+            'Account %s: %s generated, %s rejected, %s running, parallel limit %s', account['user'],
+            account['generated'], account['rejected'], account['running'], account['parallel_limit']
+        )
 
 
 def browserstacker_command(func):
     """
     Shortcut to define command for BrowserStacker.
     """
+    @wraps(func)
+    def command(api, *args, **kwargs):
+        echo_stdout()
+        return func(api, *args, **kwargs)
+
     pass_decorator = click.make_pass_decorator(APIWrapper)
-    return cli.command()(pass_decorator(func))
+    return cli.command()(pass_decorator(command))
 
 
 def browsers_options(func):
@@ -28,7 +165,9 @@ def browsers_options(func):
         click.option('-bv', '--browser-version', multiple=True, help='Browser version')(
         click.option('-os', '--os', multiple=True, help='OS name')(
         click.option('-ov', '--os-version', multiple=True, help='OS version')(
-        click.option('-d', '--device', multiple=True, help='Device name')(func)))))
+        click.option('-d', '--device', multiple=True, help='Device name')(
+        click.option('--refresh-catalog', is_flag=True, help='Revalidate cached browsers catalog')(
+        click.option('--offline', is_flag=True, help='Use only cached browsers catalog')(func)))))))
 
 
 def screenshots_options(func):
@@ -43,34 +182,123 @@ def screenshots_options(func):
 
 @browserstacker_command
 @browsers_options
-def browsers(api, **kwargs):
+def browsers(api, refresh_catalog, **kwargs):
     click.echo('Available browsers:')
-    browsers = api.browsers(**kwargs)
+    browsers = api.browsers(refresh=refresh_catalog, **kwargs)
     click.echo(format_browsers(browsers))
     click.echo('Total browsers: %s' % len(browsers))
 
 
-def get_browsers(api, browser, browser_version, os, os_version, device):
-    if any([browser, browser_version, os, os_version, device]):
-        return api.browsers(browser, browser_version, device, os, os_version)
+def get_browsers(api, browser, browser_version, device, os, os_version, refresh_catalog, offline):
+    if any([browser, browser_version, device, os, os_version]):
+        return api.browsers(
+            browser=browser, browser_version=browser_version, device=device, os=os, os_version=os_version,
+            refresh=refresh_catalog, offline=offline
+        )
+
+
+def download_options(func):
+    return click.option(
+        '-n', '--concurrency', type=click.IntRange(1), default=1, help='Number of simultaneous downloads'
+    )(click.option(
+        '--deadline', type=click.IntRange(1), default=DEFAULT_DEADLINE, help='Seconds to wait for screenshots'
+    )(click.option(
+        '--output', type=click.Choice(['text', 'jsonl']), default='text',
+        help='Output format. "jsonl" prints JSON records as soon as screenshots are saved'
+    )(func)))
+
+
+def archive_option(func):
+    return click.option(
+        '--archive', type=click.Path(dir_okay=False), help='Append the images to this .zip or .tar archive'
+    )(func)
+
+
+def get_destination(destination, archive):
+    """
+    Opened archive or a directory.
+    """
+    if not archive:
+        return destination
+    if destination:
+        raise click.UsageError('Use either --destination or --archive')
+    from ..archive import open_archive
+
+    try:
+        return open_archive(archive)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc), param_hint='--archive')
+
+
+def processing_options(func):
+    return click.option(
+        '--resize', metavar='WIDTHxHEIGHT', callback=parse_size, help='Fit images into the box after download'
+    )(click.option(
+        '--convert', type=click.Choice(['png', 'jpeg', 'webp']), help='Re-encode images into this format'
+    )(click.option(
+        '--image-quality', type=click.IntRange(1, 100), help='Quality of re-encoded JPEG and WebP images'
+    )(click.option(
+        '--optimize', is_flag=True, help='Optimize re-encoded images'
+    )(click.option(
+        '--strip-metadata', is_flag=True, help='Remove metadata from images'
+    )(click.option(
+        '--in-place', is_flag=True, help='Replace downloaded images with processed ones'
+    )(click.option(
+        '--processes', type=click.IntRange(0), help='Number of image processing workers, 0 to process inline'
+    )(func)))))))
+
+
+def get_pipeline(resize, convert, image_quality, optimize, strip_metadata, in_place, processes):
+    if not any([resize, convert, image_quality, optimize, strip_metadata]):
+        return None
+    from ..processing import ImagePipeline, Resize, StripMetadata
+
+    stages = []
+    if resize:
+        stages.append(Resize(*resize))
+    if strip_metadata:
+        stages.append(StripMetadata())
+    return ImagePipeline(
+        stages, format=convert, quality=image_quality, optimize=optimize, in_place=in_place, processes=processes
+    )
+
+
+def echo_progress(records, output):
+    if output == 'jsonl':
+        for record in records:
+            click.echo(json.dumps(record, sort_keys=True))
+    else:
+        click.echo(collect_saved(records))
 
 
 @browserstacker_command
 @click.argument('url', required=True)
 @click.option('-ds', '--destination', help='Directory to save the images')
+@archive_option
+@download_options
+@processing_options
 @browsers_options
 @screenshots_options
-def make(api, url, browser, browser_version, os, os_version, device, **kwargs):
-    kwargs['browsers'] = get_browsers(api, browser, browser_version, device, os, os_version)
-    click.echo(api.make(url, **kwargs))
+def make(api, url, browser, browser_version, os, os_version, device, refresh_catalog, offline, output, resize,
+         convert, image_quality, optimize, strip_metadata, in_place, processes, archive, **kwargs):
+    kwargs['browsers'] = get_browsers(api, browser, browser_version, device, os, os_version, refresh_catalog, offline)
+    pipeline = get_pipeline(resize, convert, image_quality, optimize, strip_metadata, in_place, processes)
+    kwargs['destination'] = get_destination(kwargs['destination'], archive)
+    try:
+        echo_progress(api.iter_make(url, pipeline=pipeline, **kwargs), output)
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+        if archive:
+            kwargs['destination'].close()
 
 
 @browserstacker_command
 @click.argument('url', required=True)
 @browsers_options
 @screenshots_options
-def generate(api, url, browser, browser_version, os, os_version, device, **kwargs):
-    kwargs['browsers'] = get_browsers(api, browser, browser_version, device, os, os_version)
+def generate(api, url, browser, browser_version, os, os_version, device, refresh_catalog, offline, **kwargs):
+    kwargs['browsers'] = get_browsers(api, browser, browser_version, device, os, os_version, refresh_catalog, offline)
     click.echo(api.generate(url, **kwargs))
 
 
@@ -83,5 +311,149 @@ def list(api, job_id):
 @browserstacker_command
 @click.argument('job_id', required=True)
 @click.option('-ds', '--destination', help='Directory to save the images')
-def download(api, job_id, destination):
-    click.echo(api.download(job_id, destination))
+@archive_option
+@download_options
+@processing_options
+def download(api, job_id, destination, archive, concurrency, deadline, output, **processing):
+    from ..ledger import JobClaimed
+
+    pipeline = get_pipeline(**processing)
+    destination = get_destination(destination, archive)
+    try:
+        records = api.iter_download(job_id, destination, concurrency=concurrency, deadline=deadline, pipeline=pipeline)
+        echo_progress(records, output)
+    except JobClaimed as exc:
+        raise click.ClickException(str(exc))
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+        if archive:
+            destination.close()
+
+
+@browserstacker_command
+@click.option('-ds', '--destination', help='Directory to save the images instead of the recorded one')
+@click.option('--limit', type=click.IntRange(1), help='Maximum number of jobs to resume')
+@download_options
+@processing_options
+def resume(api, destination, limit, concurrency, deadline, output, **processing):
+    """
+    Downloads unfinished jobs from the ledger. Several workers could resume at once, every job is claimed by one.
+    """
+    if api.ledger is None:
+        raise click.UsageError('Resuming requires --ledger')
+    pipeline = get_pipeline(**processing)
+    kwargs = dict(concurrency=concurrency, deadline=deadline, pipeline=pipeline, limit=limit)
+    try:
+        if output == 'jsonl':
+            echo_progress(api.iter_resume(destination, **kwargs), output)
+        else:
+            click.echo(api.resume(destination, **kwargs))
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+
+
+@browserstacker_command
+@click.argument('job_id', required=True)
+@click.argument('baseline', type=click.Path(file_okay=False))
+@click.option('-ds', '--destination', help='Directory to save the images')
+@click.option(
+    '--diff-dir', type=click.Path(file_okay=False), help='Directory to save diff images of changed screenshots'
+)
+@click.option(
+    '--threshold', type=click.IntRange(0, 255), default=0, help='Maximum difference of pixel channels to ignore'
+)
+@click.option(
+    '--max-ratio', type=click.FloatRange(0, 1), default=0, help='Maximum ratio of changed pixels to ignore'
+)
+@click.option('--processes', type=click.IntRange(0), help='Number of diff workers, 0 to compare inline')
+@click.option('--update-baseline', is_flag=True, help='Replace baseline images with downloaded ones')
+@download_options
+def diff(api, job_id, baseline, destination, diff_dir, threshold, max_ratio, processes, update_baseline, concurrency,
+         deadline, output):
+    """
+    Downloads screenshots and compares them with images in BASELINE directory, matched by browser & OS.
+    Exits with status 1 if some screenshots are changed or missing.
+    """
+    from ..diff import CHANGED, MISSING, diff_screenshots, update_baseline as save_baseline
+
+    records = api.iter_download(job_id, destination, concurrency=concurrency, deadline=deadline)
+    if update_baseline:
+        click.echo(save_baseline(records, baseline))
+        return
+    results = diff_screenshots(records, baseline, diff_dir, threshold, max_ratio, processes)
+    if output == 'jsonl':
+        for key in sorted(results):
+            click.echo(json.dumps(results[key], sort_keys=True))
+    else:
+        for key in sorted(results):
+            result = results[key]
+            if 'ratio' in result:
+                click.echo('%s: %s (%.4f%%)' % (key, result['status'], result['ratio'] * 100))
+            else:
+                click.echo('%s: %s' % (key, result['status']))
+    if any(result['status'] in (CHANGED, MISSING) for result in results.values()):
+        click.get_current_context().exit(1)
+
+
+@browserstacker_command
+@click.argument('index', type=click.Path(exists=True, dir_okay=False))
+@click.argument('image', type=click.Path(exists=True, dir_okay=False))
+@click.option('-a', '--algorithm', type=click.Choice(['ahash', 'dhash', 'phash']), default='phash', help='Hash type')
+@click.option('--distance', type=click.IntRange(0, 64), default=10, help='Maximum Hamming distance')
+@click.option('--browser-key', help='Only screenshots of this browser, e.g. windows_10_chrome_50.0')
+@click.option('--url', help='Only screenshots of this page')
+@click.option('--limit', type=click.IntRange(1), help='Maximum number of results')
+@click.option('--output', type=click.Choice(['text', 'jsonl']), default='text', help='Output format')
+def similar(api, index, image, algorithm, distance, browser_key, url, limit, output):
+    """
+    Finds screenshots in INDEX, that look like IMAGE. Closest ones go first.
+    """
+    from ..phash import HashIndex
+
+    try:
+        index = HashIndex(index)
+    except ImportError as exc:
+        raise click.UsageError(str(exc))
+    results = index.search(image, algorithm, distance, browser_key, url, limit)
+    for result in results:
+        if output == 'jsonl':
+            click.echo(json.dumps(result, sort_keys=True))
+        else:
+            click.echo('%s %s %s %s' % (result['distance'], result['key'], result['url'], result['path']))
+
+
+@browserstacker_command
+@click.argument('jobs', type=click.File('r'), default='-')
+@click.option('-ds', '--destination', default='.', help='Directory to save the images, every URL gets a subdirectory')
+@click.option('-p', '--parallel-limit', type=click.IntRange(1), help='Number of jobs running at once')
+@download_options
+@browsers_options
+@screenshots_options
+def batch(api, jobs, destination, parallel_limit, concurrency, deadline, output, browser, browser_version, os,
+          os_version, device, refresh_catalog, offline, **options):
+    """
+    Runs jobs from a file or stdin. Every line is a URL followed by optional `key=value` options or a JSON object
+    with `url` and options. Options are `generate` arguments, browser filters, `browsers` and `destination`.
+    Browser filters and screenshot options from the command line are defaults for all lines.
+    """
+    default_browsers = get_browsers(api, browser, browser_version, device, os, os_version, refresh_catalog, offline)
+    defaults = dict((key, value) for key, value in options.items() if value is not None)
+    scheduler = JobScheduler(api, parallel_limit=parallel_limit, concurrency=concurrency, deadline=deadline)
+    for line in jobs:
+        job = parse_job(line)
+        if job is None:
+            continue
+        filters = dict((key, job.pop(key)) for key in INDEXED_FIELDS if key in job)
+        if filters:
+            # Catalog is fetched once and then filtered through its indexes
+            job['browsers'] = api.browsers(offline=offline, **filters)
+        job.setdefault('browsers', default_browsers)
+        job.setdefault('destination', path.join(destination, get_url_dirname(job['url'])))
+        scheduler.add(**dict(defaults, **job))
+    for job in scheduler.iter_run():
+        if output == 'jsonl':
+            click.echo(json.dumps(job.as_dict(), sort_keys=True))
+        else:
+            click.echo(job.as_dict())
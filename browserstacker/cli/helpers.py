@@ -1,6 +1,10 @@
 # coding: utf-8
+import json
+import re
+
 import click
 
+from ..cache import CatalogUnavailable
 from ..screenshots import ScreenShotsAPI
 
 
@@ -15,6 +19,50 @@ def format_browsers(browsers):
     ) + DELIMITER
 
 
+def parse_job(line):
+    """
+    Job line is a JSON object with `url` and options or a URL followed by `key=value` options.
+    Repeated keys are collected into lists. Returns None for blank lines and comments.
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if line.startswith('{'):
+        return json.loads(line)
+    parts = line.split()
+    job = {'url': parts[0]}
+    for part in parts[1:]:
+        key, _, value = part.partition('=')
+        if key in job:
+            if not isinstance(job[key], list):
+                job[key] = [job[key]]
+            job[key].append(value)
+        else:
+            job[key] = value
+    return job
+
+
+def get_url_dirname(url):
+    """
+    Directory name for screenshots of `url`.
+    """
+    url = re.sub(r'^[a-z]+://', '', url.lower())
+    return re.sub(r'[^a-z0-9.\-]+', '_', url).strip('_.') or 'url'
+
+
+def parse_size(ctx, param, value):
+    """
+    Parses `WIDTHxHEIGHT` or `WIDTH` into a pair of integers. Missing height is None.
+    """
+    if value is None:
+        return None
+    match = re.match(r'^(\d+)(?:x(\d+))?$', value.lower())
+    if match is None:
+        raise click.BadParameter('Expected WIDTHxHEIGHT or WIDTH')
+    width, height = match.groups()
+    return int(width), int(height) if height else None
+
+
 def echo_stdout():
     stdout = click.get_text_stream('stdout')
     if stdout.readable():
@@ -26,7 +74,8 @@ class APIWrapper(ScreenShotsAPI):
     Convenience wrapper for ScreenShotsAPI for better integration with command line.
     """
 
-    def __getattribute__(self, item):
-        result = super(APIWrapper, self).__getattribute__(item)
-        echo_stdout()
-        return result
+    def fetch_browsers(self, refresh=False, offline=False):
+        try:
+            return super(APIWrapper, self).fetch_browsers(refresh, offline)
+        except CatalogUnavailable as exc:
+            raise click.ClickException(str(exc))
@@ -0,0 +1,228 @@
+# coding: utf-8
+"""
+Visual diff of downloaded screenshots against a baseline directory. Requires `numpy` and `Pillow`.
+Baseline images are named after browser keys, e.g. `windows_10_chrome_50.0.png`.
+
+    >>> records = api.iter_make('http://www.example.com', destination='current')
+    >>> diff_screenshots(records, 'baseline', diff_dir='diff')
+    {'windows_10_chrome_50.0': {
+        'key': 'windows_10_chrome_50.0',
+        'status': 'changed',
+        'path': 'current/chrome_50.png',
+        'baseline': 'baseline/windows_10_chrome_50.0.png',
+        'pixels': 1310720,
+        'changed': 5120,
+        'ratio': 0.0039,
+        'bbox': [0, 120, 1280, 124],
+        'diff': 'diff/windows_10_chrome_50.0.png'
+    }}
+"""
+import os
+import shutil
+
+from .catalog import get_key
+from .progress import SCREENSHOT
+from .screenshots import ensure_dir
+
+
+MATCH = 'match'
+CHANGED = 'changed'
+NEW = 'new'
+MISSING = 'missing'
+HIGHLIGHT = (255, 0, 0)
+
+
+def load_numpy():
+    try:
+        import numpy
+        from PIL import Image
+    except ImportError:
+        raise ImportError('Visual diff requires numpy and Pillow: pip install browserstacker[diff]')
+    return numpy, Image
+
+
+def get_image_path(record):
+    """
+    Path of the screenshot in the progress record. Processed images are preferred over originals.
+    """
+    processed = record.get('processed')
+    if processed:
+        return processed['output']
+    return record['path']
+
+
+def index_baseline(baseline):
+    """
+    Mapping of keys to images in the baseline directory.
+    """
+    try:
+        names = os.listdir(baseline)
+    except OSError:
+        return {}
+    index = {}
+    for name in sorted(names):
+        key, extension = os.path.splitext(name)
+        if extension and not name.startswith('.'):
+            index.setdefault(key, os.path.join(baseline, name))
+    return index
+
+
+def read_pixels(path):
+    numpy, Image = load_numpy()
+    image = Image.open(path)
+    try:
+        return numpy.asarray(image.convert('RGB'), dtype=numpy.int16)
+    finally:
+        image.close()
+
+
+def pad(pixels, height, width):
+    """
+    Extends image to `height` x `width` with black pixels. They are marked as changed by `get_outside` mask.
+    """
+    numpy = load_numpy()[0]
+    if pixels.shape[:2] == (height, width):
+        return pixels
+    padded = numpy.zeros((height, width, 3), dtype=numpy.int16)
+    padded[:pixels.shape[0], :pixels.shape[1]] = pixels
+    return padded
+
+
+def get_outside(pixels, height, width):
+    """
+    Mask of `height` x `width` area, that is true for positions outside of the image.
+    """
+    numpy = load_numpy()[0]
+    mask = numpy.ones((height, width), dtype=bool)
+    mask[:pixels.shape[0], :pixels.shape[1]] = False
+    return mask
+
+
+def get_bbox(mask):
+    """
+    Bounding box of changed pixels as [left, top, right, bottom], right and bottom are exclusive.
+    """
+    numpy = load_numpy()[0]
+    rows = numpy.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    columns = numpy.flatnonzero(mask.any(axis=0))
+    return [int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1]
+
+
+def save_diff(current, mask, path):
+    """
+    Saves dimmed current image with changed pixels highlighted.
+    """
+    numpy, Image = load_numpy()
+    output = (numpy.clip(current, 0, 255) // 3).astype(numpy.uint8)
+    output[mask] = HIGHLIGHT
+    ensure_dir(os.path.dirname(path) or os.curdir)
+    Image.fromarray(output, 'RGB').save(path)
+
+
+def compare_images(path, baseline, threshold=0, diff_path=None):
+    """
+    Compares two images. Pixels, that differ by more than `threshold` in any channel, are changed.
+    Images of different sizes are compared over the larger area, so the difference counts as changed.
+    Executed in worker processes.
+    """
+    current, expected = read_pixels(path), read_pixels(baseline)
+    height, width = max(current.shape[0], expected.shape[0]), max(current.shape[1], expected.shape[1])
+    # Pixels outside of either image are changed regardless of `threshold`
+    outside = get_outside(current, height, width) | get_outside(expected, height, width)
+    current, expected = pad(current, height, width), pad(expected, height, width)
+    mask = (abs(current - expected) > threshold).any(axis=2) | outside
+    changed = int(mask.sum())
+    pixels = height * width
+    result = {
+        'path': path,
+        'baseline': baseline,
+        'pixels': pixels,
+        'changed': changed,
+        'ratio': float(changed) / pixels if pixels else 0.0,
+        'bbox': get_bbox(mask),
+        'diff': None,
+    }
+    if diff_path is not None and changed:
+        save_diff(current, mask, diff_path)
+        result['diff'] = diff_path
+    return result
+
+
+def _compare(args):
+    key, path, baseline, threshold, diff_path = args
+    result = compare_images(path, baseline, threshold, diff_path)
+    result['key'] = key
+    return result
+
+
+def iter_compare(tasks, processes=None):
+    """
+    Runs comparisons on a process pool. With `processes=0` they are executed in the calling process.
+    """
+    if processes == 0 or len(tasks) <= 1:
+        for task in tasks:
+            yield _compare(task)
+        return
+    from multiprocessing import Pool
+
+    pool = Pool(processes)
+    try:
+        for result in pool.imap_unordered(_compare, tasks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def get_screenshots(records):
+    """
+    Mapping of keys to local paths of screenshots. Accepts progress records or dicts with browser fields and `path`.
+    """
+    screenshots = {}
+    for record in records:
+        if record.get('event', SCREENSHOT) != SCREENSHOT or record.get('path') is None:
+            continue
+        screenshots[get_key(record)] = get_image_path(record)
+    return screenshots
+
+
+def diff_screenshots(records, baseline, diff_dir=None, threshold=0, max_ratio=0, processes=None):
+    """
+    Compares screenshots from `records` with images in `baseline` directory, matched by browser keys.
+    Returns mapping of keys to results. Screenshot is changed if its ratio of changed pixels is over `max_ratio`.
+    Screenshots without baseline are `new`, baseline images without screenshots are `missing`.
+    If `diff_dir` is given, diff images of changed screenshots are saved there.
+    """
+    screenshots = get_screenshots(records)
+    expected = index_baseline(baseline)
+    results, tasks = {}, []
+    for key, path in sorted(screenshots.items()):
+        if key not in expected:
+            results[key] = {'key': key, 'status': NEW, 'path': path, 'baseline': None}
+            continue
+        diff_path = os.path.join(diff_dir, key + '.png') if diff_dir else None
+        tasks.append((key, path, expected[key], threshold, diff_path))
+    for key in set(expected) - set(screenshots):
+        results[key] = {'key': key, 'status': MISSING, 'path': None, 'baseline': expected[key]}
+    for result in iter_compare(tasks, processes):
+        result['status'] = CHANGED if result['ratio'] > max_ratio else MATCH
+        results[result['key']] = result
+    return results
+
+
+def update_baseline(records, baseline):
+    """
+    Copies screenshots into `baseline` directory under their keys. Returns mapping of keys to baseline paths.
+    """
+    ensure_dir(baseline)
+    expected = index_baseline(baseline)
+    updated = {}
+    for key, path in get_screenshots(records).items():
+        target = os.path.join(baseline, key + os.path.splitext(path)[1])
+        if key in expected and expected[key] != target:
+            os.remove(expected[key])
+        shutil.copyfile(path, target)
+        updated[key] = target
+    return updated
@@ -0,0 +1,329 @@
+# coding: utf-8
+"""
+Local stand-in for BrowserStack Screenshots API. Useful for integration tests and benchmarks.
+
+    >>> with FakeBrowserStack(render_time=2, parallel_limit=5) as server:
+    ...     api = ScreenShotsAPI('user', 'key')
+    ...     api.root_url = server.url
+    ...     api.make('http://www.example.com', timeout=0.5)
+"""
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import uuid
+from time import sleep, time
+
+import requests
+
+from ._server import BaseHTTPRequestHandler, ThreadedHTTPServer
+
+
+DEFAULT_BROWSERS = [
+    {'os': 'Windows', 'os_version': '10', 'browser': 'chrome', 'browser_version': '50.0', 'device': None},
+    {'os': 'Windows', 'os_version': '10', 'browser': 'firefox', 'browser_version': '45.0', 'device': None},
+    {'os': 'Windows', 'os_version': '8.1', 'browser': 'ie', 'browser_version': '11.0', 'device': None},
+    {'os': 'Windows', 'os_version': 'XP', 'browser': 'ie', 'browser_version': '7.0', 'device': None},
+    {'os': 'OS X', 'os_version': 'El Capitan', 'browser': 'safari', 'browser_version': '9.1', 'device': None},
+    {'os': 'OS X', 'os_version': 'El Capitan', 'browser': 'chrome', 'browser_version': '50.0', 'device': None},
+    {'os': 'ios', 'os_version': '9.1', 'browser': 'Mobile Safari', 'browser_version': None, 'device': 'iPhone 6S'},
+    {'os': 'android', 'os_version': '5.0', 'browser': 'Android Browser', 'browser_version': None,
+     'device': 'Google Nexus 6'},
+]
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+
+def make_image(size):
+    """
+    Deterministic image-like payload of the given size.
+    """
+    pattern = bytes(bytearray(range(251)))
+    body = PNG_HEADER + pattern * (size // len(pattern) + 1)
+    return body[:size]
+
+
+def get_etag(content):
+    return '"%s"' % hashlib.md5(content).hexdigest()
+
+
+def get_image_name(browser):
+    parts = [browser.get('os'), browser.get('os_version'), browser.get('browser'), browser.get('browser_version')]
+    return re.sub(r'[^a-z0-9.]+', '_', '_'.join(str(part).lower() for part in parts if part)) + '.png'
+
+
+class Job(object):
+
+    def __init__(self, job_id, url, browsers, server, user=''):
+        self.id = job_id
+        self.url = url
+        self.user = user
+        self.created_at = time()
+        self.screenshots = []
+        for browser in browsers:
+            render_time = server.render_time * (1 + random.uniform(-server.render_jitter, server.render_jitter))
+            self.screenshots.append(dict(
+                browser,
+                id=uuid.uuid4().hex,
+                url=url,
+                ready_at=self.created_at + render_time,
+                final_state='timed-out' if random.random() < server.timeout_rate else 'done',
+                image_url='%simages/%s/%s' % (server.url, job_id, get_image_name(browser)),
+            ))
+
+    def get_state(self, screenshot, now):
+        if now < screenshot['ready_at']:
+            return 'processing'
+        return screenshot['final_state']
+
+    def is_running(self, now):
+        return any(now < screenshot['ready_at'] for screenshot in self.screenshots)
+
+    def as_dict(self, now):
+        screenshots = []
+        for screenshot in self.screenshots:
+            state = self.get_state(screenshot, now)
+            data = dict((key, value) for key, value in screenshot.items() if key not in ('ready_at', 'final_state'))
+            data['state'] = state
+            if state != 'done':
+                data['image_url'] = None
+            screenshots.append(data)
+        return {
+            'id': self.id,
+            'job_id': self.id,
+            'state': 'done' if not self.is_running(now) else 'processing',
+            'screenshots': screenshots,
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def send(self, status, body, content_type='application/json', headers=()):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        # Stats are updated before the client could read the response
+        self.fake.record(self.path, len(body))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def get_user(self):
+        """
+        Returns authenticated user or None for wrong credentials. Without configured credentials the user is ''.
+        """
+        if not self.fake.accounts:
+            return ''
+        header = self.headers.get('Authorization') or ''
+        if not header.startswith('Basic '):
+            return None
+        try:
+            user, _, key = base64.b64decode(header[6:].encode('ascii')).decode('latin1').partition(':')
+        except (TypeError, ValueError):
+            return None
+        if self.fake.accounts.get(user) == key:
+            return user
+
+    def send_failure(self):
+        """
+        Answers with an injected failure if there is one for this path.
+        """
+        failure = self.fake.pop_failure(self.path)
+        if failure is None:
+            return False
+        status, retry_after = failure
+        if status is not None:
+            headers = [('Retry-After', str(retry_after))] if retry_after is not None else []
+            self.send(status, b'<html><body>Error</body></html>', 'text/html', headers)
+        elif self.path.startswith('/images/'):
+            # Connection is dropped in the middle of the image
+            content = self.fake.image
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(content)))
+            self.send_header('ETag', get_etag(content))
+            self.end_headers()
+            self.wfile.write(content[:len(content) // 2])
+            self.close_connection = True
+        else:
+            self.close_connection = True
+        return True
+
+    def do_GET(self):
+        self.fake.delay()
+        if self.send_failure():
+            return
+        if self.path.startswith('/images/'):
+            return self.send_image()
+        user = self.get_user()
+        if user is None:
+            return self.send(401, {'error': 'Sign up or sign in'})
+        if self.path == '/screenshots/browsers.json':
+            return self.send_browsers()
+        match = re.match(r'^/screenshots/(\w+)\.json$', self.path)
+        job = self.fake.jobs.get(match.group(1)) if match else None
+        if job is not None and job.user == user:
+            return self.send(200, job.as_dict(time()))
+        self.send(404, {'message': 'Not found'})
+
+    def do_POST(self):
+        self.fake.delay()
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.send_failure():
+            return
+        user = self.get_user()
+        if user is None:
+            return self.send(401, {'error': 'Sign up or sign in'})
+        if self.path != '/screenshots':
+            return self.send(404, {'message': 'Not found'})
+        try:
+            payload = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return self.send(422, {'message': 'Validation failed'})
+        job = self.fake.create_job(
+            payload.get('url'), payload.get('browsers') or [], payload.get('callback_url'), user
+        )
+        if job is None:
+            return self.send(422, {'message': 'Parallel limit reached'})
+        self.send(200, job.as_dict(job.created_at))
+
+    def send_browsers(self):
+        etag = self.fake.catalog_etag
+        if self.headers.get('If-None-Match') == etag:
+            return self.send(304, b'', headers=[('ETag', etag)])
+        self.send(200, self.fake.browsers, headers=[('ETag', etag)])
+
+    def send_image(self):
+        content = self.fake.image
+        etag = get_etag(content)
+        match = re.match(r'^bytes=(\d+)-$', self.headers.get('Range') or '')
+        if_range = self.headers.get('If-Range')
+        if match and self.fake.supports_range and if_range in (None, etag):
+            offset = int(match.group(1))
+            if offset >= len(content):
+                return self.send(416, b'', 'image/png', [('Content-Range', 'bytes */%s' % len(content))])
+            content_range = 'bytes %s-%s/%s' % (offset, len(content) - 1, len(content))
+            return self.send(206, content[offset:], 'image/png', [('Content-Range', content_range), ('ETag', etag)])
+        self.send(200, content, 'image/png', [('Accept-Ranges', 'bytes'), ('ETag', etag)])
+
+
+class FakeBrowserStack(object):
+    """
+    Threaded HTTP server, that emulates BrowserStack Screenshots API.
+    Screenshots are ready after `render_time` seconds (+/- `render_jitter` fraction), `timeout_rate` of them time out.
+    Every request is delayed by `latency` seconds. Jobs over `parallel_limit` per account are rejected.
+    `credentials` is a pair of user and key or a list of such pairs, every pair is a separate account.
+    If a job has `callback_url`, it is notified when all screenshots are done, unless `send_callbacks` is False.
+    Failures of next requests are injected with `fail`.
+    """
+
+    def __init__(self, browsers=None, render_time=0, render_jitter=0, timeout_rate=0, latency=0, parallel_limit=None,
+                 image_size=64 * 1024, supports_range=True, credentials=None, send_callbacks=True, host='127.0.0.1',
+                 port=0):
+        self.browsers = browsers or DEFAULT_BROWSERS
+        self.render_time = render_time
+        self.render_jitter = render_jitter
+        self.timeout_rate = timeout_rate
+        self.latency = latency
+        self.parallel_limit = parallel_limit
+        self.image = make_image(image_size)
+        self.supports_range = supports_range
+        if credentials and not isinstance(credentials[0], (list, tuple)):
+            credentials = [credentials]
+        self.accounts = dict(credentials or [])
+        self.send_callbacks = send_callbacks
+        self.timers = []
+        self.catalog_etag = '"%s"' % uuid.uuid4().hex
+        self.jobs = {}
+        self.failures = []
+        self.stats = {'requests': 0, 'bytes': 0, 'jobs': 0, 'rejected': 0, 'images': 0}
+        self.lock = threading.Lock()
+        self.server = ThreadedHTTPServer((host, port), Handler)
+        self.server.fake = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%s/' % (host, port)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        for timer in self.timers:
+            timer.cancel()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def fail(self, count=1, status=503, retry_after=None, path='/'):
+        """
+        Next `count` requests to paths, starting with `path`, get an HTML error page with `status`.
+        If `status` is None, the connection is dropped, images are cut in half.
+        """
+        with self.lock:
+            self.failures.extend([(path, status, retry_after)] * count)
+
+    def pop_failure(self, path):
+        with self.lock:
+            for index, failure in enumerate(self.failures):
+                if path.startswith(failure[0]):
+                    return self.failures.pop(index)[1:]
+
+    def delay(self):
+        if self.latency:
+            sleep(self.latency)
+
+    def record(self, path, size):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += size
+            if path.startswith('/images/'):
+                self.stats['images'] += 1
+
+    def create_job(self, url, browsers, callback_url=None, user=''):
+        now = time()
+        with self.lock:
+            running = sum(1 for job in self.jobs.values() if job.user == user and job.is_running(now))
+            if self.parallel_limit is not None and running >= self.parallel_limit:
+                self.stats['rejected'] += 1
+                return None
+            job = Job(uuid.uuid4().hex, url, browsers, self, user)
+            self.jobs[job.id] = job
+            self.stats['jobs'] += 1
+        if callback_url and self.send_callbacks:
+            ready_at = max([screenshot['ready_at'] for screenshot in job.screenshots] or [now])
+            timer = threading.Timer(max(ready_at - time(), 0), self.callback, (job, callback_url))
+            timer.daemon = True
+            timer.start()
+            self.timers.append(timer)
+        return job
+
+    def callback(self, job, callback_url):
+        try:
+            requests.post(callback_url, json=job.as_dict(time()), timeout=10)
+        except requests.RequestException:
+            pass
@@ -0,0 +1,61 @@
+# coding: utf-8
+"""
+Instrumentation events, emitted by `ScreenShotsAPI`.
+
+    request_start - method, url
+    request_end - method, url, status, elapsed, size, error
+    generate - url, job_id, browsers, elapsed
+    poll - job_id, attempt, ready, pending, elapsed
+    sleep - job_id, duration
+    save - image_url, filename, size, elapsed, skipped
+    retry - reason, job_id, url, attempt, delay
+    callback - job_id, received, elapsed
+    progress - record, see `browserstacker.progress`
+"""
+
+
+REQUEST_START = 'request_start'
+REQUEST_END = 'request_end'
+GENERATE = 'generate'
+POLL = 'poll'
+SLEEP = 'sleep'
+SAVE = 'save'
+RETRY = 'retry'
+CALLBACK = 'callback'
+PROGRESS = 'progress'
+EVENTS = (REQUEST_START, REQUEST_END, GENERATE, POLL, SLEEP, SAVE, RETRY, CALLBACK, PROGRESS)
+
+
+class Hooks(object):
+    """
+    Registry of callbacks for instrumentation events. Every callback is called with event name and data dict.
+    Emitting an event without callbacks is a single dict lookup.
+    """
+
+    def __init__(self):
+        self.callbacks = {}
+
+    def __bool__(self):
+        return bool(self.callbacks)
+
+    __nonzero__ = __bool__
+
+    def register(self, event, callback):
+        if event not in EVENTS:
+            raise ValueError('Unknown event: %s' % event)
+        # Lists are replaced, not mutated, so emitting from other threads is safe
+        self.callbacks[event] = self.callbacks.get(event, []) + [callback]
+        return callback
+
+    def unregister(self, event, callback):
+        callbacks = [item for item in self.callbacks.get(event, []) if item != callback]
+        if callbacks:
+            self.callbacks[event] = callbacks
+        else:
+            self.callbacks.pop(event, None)
+
+    def emit(self, event, **data):
+        callbacks = self.callbacks.get(event)
+        if callbacks:
+            for callback in callbacks:
+                callback(event, data)
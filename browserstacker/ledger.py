@@ -0,0 +1,197 @@
+# coding: utf-8
+"""
+Ledger of submitted jobs in an SQLite file, so jobs survive crashes of the process, that started them.
+
+    >>> ledger = JobLedger('jobs.sqlite')
+    >>> api = ScreenShotsAPI('user', 'key', ledger=ledger)
+    >>> api.generate('http://www.example.com')  # The process dies here
+    >>> api.resume()  # Later or in another process
+
+Every job is recorded with its payload, account, destination, claim and saved screenshots.
+A job is claimed by the process, that downloads it. Other processes on the same host take over
+claims of dead processes at once, claims of other hosts expire if they are not renewed within `claim_ttl` seconds.
+"""
+import json
+import os
+import socket
+from time import time
+
+from .cache import get_cache_dir
+from .catalog import get_key
+from .ratelimit import DEFAULT_LOCK_TIMEOUT, ensure_parent, is_alive, transaction
+
+
+DEFAULT_LEDGER_NAME = 'ledger.sqlite'
+DEFAULT_CLAIM_TTL = 5 * 60
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, url TEXT, payload TEXT, account TEXT, '
+    'destination TEXT, state TEXT, error TEXT, host TEXT, pid INTEGER, claimed_at REAL, claims INTEGER, '
+    'created REAL, updated REAL)',
+    'CREATE TABLE IF NOT EXISTS screenshots (job_id TEXT, key TEXT, image_url TEXT, state TEXT, path TEXT, '
+    'record TEXT, updated REAL, PRIMARY KEY (job_id, key))',
+    'CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)',
+)
+JOB_FIELDS = (
+    'job_id', 'url', 'payload', 'account', 'destination', 'state', 'error', 'host', 'pid', 'claimed_at', 'claims',
+    'created', 'updated'
+)
+
+
+class JobClaimed(RuntimeError):
+    """
+    The job is downloaded by another live process.
+    """
+
+
+def load_job(row):
+    job = dict(zip(JOB_FIELDS, row))
+    if job['payload'] is not None:
+        job['payload'] = json.loads(job['payload'])
+    return job
+
+
+class JobLedger(object):
+    """
+    Jobs and their screenshots, shared by all processes, that use the same file.
+    """
+
+    def __init__(self, path=None, claim_ttl=DEFAULT_CLAIM_TTL, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+        self.path = path or os.path.join(get_cache_dir(), DEFAULT_LEDGER_NAME)
+        self.claim_ttl = claim_ttl
+        self.lock_timeout = lock_timeout
+        self.host = socket.gethostname()
+        ensure_parent(self.path)
+        with self.transaction() as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    def transaction(self):
+        return transaction(self.path, self.lock_timeout)
+
+    def add_job(self, job_id, payload, account=None):
+        """
+        Records a generated job. It is not claimed until its download starts.
+        """
+        now = time()
+        with self.transaction() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, NULL, ?, NULL, NULL, NULL, NULL, 0, ?, ?)',
+                (job_id, payload.get('url'), json.dumps(payload, sort_keys=True), account, PENDING, now, now)
+            )
+
+    def start(self, job_id, destination=None):
+        """
+        Claims the job for the current process before its download. Unknown jobs are added without payload.
+        Raises `JobClaimed` if another live process holds the claim.
+        """
+        now = time()
+        with self.transaction() as connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO jobs (job_id, state, claims, created) VALUES (?, ?, 0, ?)',
+                (job_id, PENDING, now)
+            )
+            row = connection.execute(
+                'SELECT %s FROM jobs WHERE job_id = ?' % ', '.join(JOB_FIELDS), (job_id, )
+            ).fetchone()
+            job = load_job(row)
+            if self.is_claimed(job, now) and not self.is_own(job):
+                raise JobClaimed('Job %s is downloaded by another process (%s, pid %s)' % (
+                    job_id, job['host'], job['pid']
+                ))
+            connection.execute(
+                'UPDATE jobs SET destination = COALESCE(?, destination), host = ?, pid = ?, claimed_at = ?, '
+                'updated = ? WHERE job_id = ?',
+                (destination, self.host, os.getpid(), now, now, job_id)
+            )
+
+    def is_own(self, job):
+        return job['host'] == self.host and job['pid'] == os.getpid()
+
+    def is_claimed(self, job, now):
+        if job['pid'] is None or job['claimed_at'] is None:
+            return False
+        if job['host'] == self.host and not is_alive(job['pid']):
+            return False
+        return job['claimed_at'] >= now - self.claim_ttl
+
+    def claim(self, exclude=()):
+        """
+        Claims the oldest pending job, that is not claimed by another live process. Returns the job or None.
+        """
+        now = time()
+        with self.transaction() as connection:
+            rows = connection.execute(
+                'SELECT %s FROM jobs WHERE state = ? ORDER BY created' % ', '.join(JOB_FIELDS), (PENDING, )
+            )
+            for row in rows.fetchall():
+                job = load_job(row)
+                if job['job_id'] in exclude or self.is_claimed(job, now):
+                    continue
+                connection.execute(
+                    'UPDATE jobs SET host = ?, pid = ?, claimed_at = ?, claims = claims + 1, updated = ? '
+                    'WHERE job_id = ?', (self.host, os.getpid(), now, now, job['job_id'])
+                )
+                return job
+
+    def renew(self, job_id):
+        """
+        Extends the current process' claim of the job.
+        """
+        with self.transaction() as connection:
+            connection.execute(
+                'UPDATE jobs SET claimed_at = ? WHERE job_id = ? AND host = ? AND pid = ?',
+                (time(), job_id, self.host, os.getpid())
+            )
+
+    def release(self, job_id, error=None):
+        """
+        Drops the current process' claim, so the job could be resumed by others.
+        """
+        with self.transaction() as connection:
+            connection.execute(
+                'UPDATE jobs SET pid = NULL, claimed_at = NULL, error = COALESCE(?, error), updated = ? '
+                'WHERE job_id = ? AND host = ? AND pid = ?', (error, time(), job_id, self.host, os.getpid())
+            )
+
+    def finish(self, job_id, state=DONE, error=None):
+        with self.transaction() as connection:
+            connection.execute(
+                'UPDATE jobs SET state = ?, error = ?, pid = NULL, claimed_at = NULL, updated = ? WHERE job_id = ?',
+                (state, error, time(), job_id)
+            )
+
+    def add_screenshot(self, record):
+        """
+        Records a saved or failed screenshot from a progress record.
+        """
+        with self.transaction() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO screenshots VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (record['job_id'], get_key(record), record['image_url'], record['state'], record['path'],
+                 json.dumps(record, sort_keys=True), time())
+            )
+
+    def get_job(self, job_id):
+        with self.transaction() as connection:
+            row = connection.execute(
+                'SELECT %s FROM jobs WHERE job_id = ?' % ', '.join(JOB_FIELDS), (job_id, )
+            ).fetchone()
+        return load_job(row) if row is not None else None
+
+    def get_jobs(self, state=None):
+        with self.transaction() as connection:
+            if state is None:
+                rows = connection.execute('SELECT %s FROM jobs ORDER BY created' % ', '.join(JOB_FIELDS))
+            else:
+                rows = connection.execute(
+                    'SELECT %s FROM jobs WHERE state = ? ORDER BY created' % ', '.join(JOB_FIELDS), (state, )
+                )
+            return [load_job(row) for row in rows.fetchall()]
+
+    def get_screenshots(self, job_id):
+        with self.transaction() as connection:
+            rows = connection.execute('SELECT record FROM screenshots WHERE job_id = ? ORDER BY key', (job_id, ))
+            return [json.loads(record) for (record, ) in rows.fetchall()]
@@ -0,0 +1,80 @@
+# coding: utf-8
+import hashlib
+import json
+import os
+import threading
+
+
+MANIFEST_NAME = '.browserstacker-manifest.jsonl'
+
+
+def new_hasher():
+    return hashlib.sha256()
+
+
+def hash_file(filename, hasher, chunk_size):
+    """
+    Feeds content of existing file into `hasher`.
+    """
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher
+
+
+class Manifest(object):
+    """
+    Journal of images, downloaded to a single directory.
+    Records are appended as JSON lines, so a crashed run loses at most one record.
+    """
+
+    def __init__(self, destination=None):
+        self.destination = destination or os.curdir
+        self.path = os.path.join(self.destination, MANIFEST_NAME)
+        self.records = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.records)
+
+    def load(self):
+        try:
+            f = open(self.path)
+        except IOError:
+            return
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Partially written line
+                    continue
+                self.records[record['image_url']] = record
+
+    def get(self, image_url, filename):
+        """
+        Returns record if the image is already downloaded and the file still has the same size.
+        """
+        record = self.records.get(image_url)
+        if record is None or record['filename'] != os.path.basename(filename):
+            return None
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            return None
+        if size == record['size']:
+            return record
+
+    def add(self, image_url, filename, size, checksum, **extra):
+        record = dict(extra, image_url=image_url, filename=os.path.basename(filename), size=size, sha256=checksum)
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self.lock:
+            self.records[image_url] = record
+            try:
+                os.makedirs(self.destination)
+            except OSError:
+                pass
+            with open(self.path, 'a') as f:
+                f.write(line)
+        return record
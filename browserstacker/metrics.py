@@ -0,0 +1,256 @@
+# coding: utf-8
+"""
+Aggregators for instrumentation events.
+
+    >>> api = ScreenShotsAPI('user', 'key')
+    >>> metrics = MetricsCollector(api.hooks)
+    >>> api.make('http://www.example.com')
+    >>> metrics.summary()['histograms']['request_duration_seconds{method="GET"}']
+    {'count': 3, 'sum': 0.92, 'min': 0.21, 'max': 0.37, 'mean': 0.31, 'p50': 0.37, 'p90': 0.37, 'p99': 0.37}
+    >>> metrics.write_textfile('/var/lib/node_exporter/browserstacker.prom')
+"""
+import socket
+import threading
+from bisect import bisect_left
+
+from .cache import atomic_write
+from .hooks import CALLBACK, EVENTS, GENERATE, POLL, REQUEST_END, RETRY, SAVE, SLEEP
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DEFAULT_PREFIX = 'browserstacker'
+DEFAULT_STATSD_PORT = 8125
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, value) for key, value in labels)
+
+
+class Histogram(object):
+    """
+    Counts observations in fixed buckets. Quantiles are estimated as upper bounds of buckets, limited by the observed
+    minimum and maximum.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank, total = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return max(min(bound, self.max), self.min)
+        return self.max
+
+    def cumulative(self):
+        """
+        Pairs of upper bound and number of observations less or equal to it, as in Prometheus.
+        """
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf', ), self.counts):
+            total += count
+            yield bound, total
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': float(self.sum) / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+
+class MetricsCollector(object):
+    """
+    Aggregates events into counters and histograms. Could be exported in Prometheus text format.
+    """
+
+    def __init__(self, hooks=None, buckets=DEFAULT_BUCKETS, prefix=DEFAULT_PREFIX):
+        self.buckets = buckets
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        if hooks is not None:
+            self.attach(hooks)
+
+    def attach(self, hooks):
+        for event in EVENTS:
+            hooks.register(event, self.handle)
+
+    def detach(self, hooks):
+        for event in EVENTS:
+            hooks.unregister(event, self.handle)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets)
+            self.histograms[key].observe(value)
+
+    def get(self, name, **labels):
+        """
+        Sum of counter values with given name and labels.
+        """
+        return sum(
+            value for (key, key_labels), value in self.counters.items()
+            if key == name and set(labels.items()) <= set(key_labels)
+        )
+
+    def handle(self, event, data):
+        if event == REQUEST_END:
+            self.inc('requests_total', method=data['method'], status=data['status'] or 'error')
+            self.inc('received_bytes_total', data['size'])
+            self.observe('request_duration_seconds', data['elapsed'], method=data['method'])
+        elif event == GENERATE:
+            self.inc('jobs_total')
+            self.observe('generate_duration_seconds', data['elapsed'])
+        elif event == POLL:
+            self.inc('polls_total')
+            self.observe('poll_duration_seconds', data['elapsed'])
+        elif event == SLEEP:
+            self.inc('sleep_seconds_total', data['duration'])
+        elif event == SAVE:
+            self.inc('images_total', status='skipped' if data['skipped'] else 'saved')
+            self.observe('save_duration_seconds', data['elapsed'])
+        elif event == RETRY:
+            self.inc('retries_total', reason=data['reason'])
+        elif event == CALLBACK:
+            self.inc('callbacks_total', status='received' if data['received'] else 'missed')
+            self.observe('callback_wait_seconds', data['elapsed'])
+
+    def summary(self):
+        """
+        Counters and histogram summaries. `work_seconds` is the total time spent in HTTP requests.
+        """
+        with self.lock:
+            counters = dict(
+                (name + format_labels(labels), value) for (name, labels), value in self.counters.items()
+            )
+            histograms = dict(
+                (name + format_labels(labels), histogram.summary())
+                for (name, labels), histogram in self.histograms.items()
+            )
+            work = sum(
+                histogram.sum for (name, _), histogram in self.histograms.items()
+                if name == 'request_duration_seconds'
+            )
+        return {
+            'counters': counters,
+            'histograms': histograms,
+            'sleep_seconds': self.get('sleep_seconds_total'),
+            'work_seconds': work,
+        }
+
+    def to_prometheus(self):
+        """
+        Metrics in Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for name in sorted(set(name for name, _ in self.counters)):
+                lines.append('# TYPE %s_%s counter' % (self.prefix, name))
+                for (key, labels), value in sorted(self.counters.items()):
+                    if key == name:
+                        lines.append('%s_%s%s %s' % (self.prefix, name, format_labels(labels), value))
+            for name in sorted(set(name for name, _ in self.histograms)):
+                lines.append('# TYPE %s_%s histogram' % (self.prefix, name))
+                for (key, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if key != name:
+                        continue
+                    for bound, count in histogram.cumulative():
+                        lines.append('%s_%s_bucket%s %s' % (
+                            self.prefix, name, format_labels(labels + (('le', bound), )), count
+                        ))
+                    lines.append('%s_%s_sum%s %s' % (self.prefix, name, format_labels(labels), histogram.sum))
+                    lines.append('%s_%s_count%s %s' % (self.prefix, name, format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """
+        Writes metrics for node_exporter textfile collector. File is replaced atomically.
+        """
+        atomic_write(path, self.to_prometheus())
+
+
+class StatsdExporter(object):
+    """
+    Sends events to statsd over UDP as counters and timers. Delivery errors are ignored.
+    """
+
+    def __init__(self, hooks=None, host='127.0.0.1', port=DEFAULT_STATSD_PORT, prefix=DEFAULT_PREFIX):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if hooks is not None:
+            self.attach(hooks)
+
+    def attach(self, hooks):
+        for event in EVENTS:
+            hooks.register(event, self.handle)
+
+    def detach(self, hooks):
+        for event in EVENTS:
+            hooks.unregister(event, self.handle)
+
+    def close(self):
+        self.socket.close()
+
+    def format(self, event, data):
+        if event == REQUEST_END:
+            yield 'requests.%s.%s:1|c' % (data['method'], data['status'] or 'error')
+            yield 'request_duration.%s:%d|ms' % (data['method'], data['elapsed'] * 1000)
+            if data['size']:
+                yield 'received_bytes:%s|c' % data['size']
+        elif event == GENERATE:
+            yield 'jobs:1|c'
+            yield 'generate_duration:%d|ms' % (data['elapsed'] * 1000)
+        elif event == POLL:
+            yield 'polls:1|c'
+        elif event == SLEEP:
+            yield 'sleep:%d|ms' % (data['duration'] * 1000)
+        elif event == SAVE:
+            yield 'images.%s:1|c' % ('skipped' if data['skipped'] else 'saved')
+            yield 'save_duration:%d|ms' % (data['elapsed'] * 1000)
+        elif event == RETRY:
+            yield 'retries.%s:1|c' % data['reason']
+        elif event == CALLBACK:
+            yield 'callbacks.%s:1|c' % ('received' if data['received'] else 'missed')
+            yield 'callback_wait:%d|ms' % (data['elapsed'] * 1000)
+
+    def handle(self, event, data):
+        lines = ['%s.%s' % (self.prefix, line) for line in self.format(event, data)]
+        if lines:
+            try:
+                self.socket.sendto('\n'.join(lines).encode('utf-8'), self.address)
+            except socket.error:
+                pass
@@ -0,0 +1,264 @@
+# coding: utf-8
+"""
+Index of perceptual hashes of saved screenshots. Requires `numpy` and `Pillow`.
+Hashes are computed as soon as screenshots are saved and appended to a JSON lines file.
+Similar images are found with BK-trees by Hamming distance between hashes.
+
+    >>> api = ScreenShotsAPI('user', 'key')
+    >>> index = HashIndex('screenshots.index.jsonl', api.hooks)
+    >>> api.make('http://www.example.com', destination='screenshots')
+    >>> index.search('new.png', key='windows_10_chrome_50.0', max_distance=6)
+    [{'distance': 2, 'path': '/.../screenshots/chrome_50.png', 'key': 'windows_10_chrome_50.0', ...}]
+"""
+import json
+import logging
+import os
+import threading
+from numbers import Integral
+
+from .catalog import get_key
+from .diff import get_image_path
+from .hooks import PROGRESS
+from .progress import SCREENSHOT
+
+
+DEFAULT_INDEX_NAME = '.browserstacker-index.jsonl'
+DEFAULT_DISTANCE = 10
+HASH_SIZE = 8
+ALGORITHMS = ('ahash', 'dhash', 'phash')
+
+logger = logging.getLogger(__name__)
+
+
+def load_numpy():
+    try:
+        import numpy
+        from PIL import Image
+    except ImportError:
+        raise ImportError('Perceptual hashes require numpy and Pillow: pip install browserstacker[diff]')
+    return numpy, Image
+
+
+def to_int(bits):
+    return int(''.join('1' if bit else '0' for bit in bits.flatten()), 2)
+
+
+def get_pixels(image, width, height):
+    numpy, Image = load_numpy()
+    return numpy.asarray(image.convert('L').resize((width, height), Image.LANCZOS), dtype=numpy.float64)
+
+
+def average_hash(image, size=HASH_SIZE):
+    """
+    Bits are set for pixels brighter than the average of the downscaled image.
+    """
+    pixels = get_pixels(image, size, size)
+    return to_int(pixels > pixels.mean())
+
+
+def difference_hash(image, size=HASH_SIZE):
+    """
+    Bits are set for pixels brighter than their left neighbours.
+    """
+    pixels = get_pixels(image, size + 1, size)
+    return to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def get_dct_matrix(size):
+    numpy = load_numpy()[0]
+    n = numpy.arange(size)
+    return numpy.cos(numpy.pi * numpy.outer(n, 2 * n + 1) / (2.0 * size))
+
+
+def perceptual_hash(image, size=HASH_SIZE, factor=4):
+    """
+    Bits are set for low frequencies of the image's DCT over their median.
+    """
+    numpy = load_numpy()[0]
+    pixels = get_pixels(image, size * factor, size * factor)
+    matrix = get_dct_matrix(size * factor)
+    frequencies = matrix.dot(pixels).dot(matrix.T)[:size, :size]
+    return to_int(frequencies > numpy.median(frequencies))
+
+
+HASHES = {'ahash': average_hash, 'dhash': difference_hash, 'phash': perceptual_hash}
+
+
+def compute_hashes(path):
+    """
+    Returns all hashes of the image as hex strings.
+    """
+    Image = load_numpy()[1]
+    image = Image.open(path)
+    try:
+        return dict((name, format_hash(function(image))) for name, function in HASHES.items())
+    finally:
+        image.close()
+
+
+def format_hash(value):
+    return '%016x' % value
+
+
+def hamming(first, second):
+    return bin(first ^ second).count('1')
+
+
+class BKTree(object):
+    """
+    Metric tree for nearest neighbour queries by Hamming distance.
+    Every node is a list of hash, its items and mapping of distances to child nodes.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """
+        Returns pairs of distance and item, that are not farther than `max_distance`, closest first.
+        """
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda pair: pair[0])
+        return results
+
+
+class HashIndex(object):
+    """
+    Perceptual hashes of screenshots with browser keys (see `browserstacker.catalog.get_key`) and page URLs.
+    Entries are appended as JSON lines, BK-trees are built on the first query for every algorithm and key.
+    If `hooks` are given, screenshots are indexed as soon as they are saved.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_NAME, hooks=None):
+        # Fail early instead of inside the progress hook after the first download
+        load_numpy()
+        self.path = path
+        self.entries = {}
+        self.trees = {}
+        self.lock = threading.Lock()
+        self.load()
+        if hooks is not None:
+            self.attach(hooks)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        try:
+            f = open(self.path)
+        except IOError:
+            return
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Partially written line
+                    continue
+                self.entries[entry['path']] = entry
+
+    def attach(self, hooks):
+        hooks.register(PROGRESS, self.handle)
+
+    def detach(self, hooks):
+        hooks.unregister(PROGRESS, self.handle)
+
+    def handle(self, event, data):
+        record = data['record']
+        if record['event'] != SCREENSHOT or record['path'] is None:
+            return
+        try:
+            self.add(
+                get_image_path(record), key=get_key(record), url=record.get('url'), image_url=record['image_url'],
+                job_id=record['job_id']
+            )
+        except (IOError, OSError) as exc:
+            logger.debug('Can not index "%s": %r', record['path'], exc)
+
+    def add(self, path, key=None, url=None, **extra):
+        """
+        Computes hashes of the image and adds it to the index. Files, that are already indexed, are skipped.
+        """
+        path = os.path.abspath(path)
+        size = os.path.getsize(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry['size'] == size and entry['key'] == key and entry['url'] == url:
+            return entry
+        entry = dict(extra, path=path, size=size, key=key, url=url, **compute_hashes(path))
+        line = json.dumps(entry, sort_keys=True) + '\n'
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.path, 'a') as f:
+                f.write(line)
+            replaced = path in self.entries
+            self.entries[path] = entry
+            if replaced:
+                self.trees = {}
+            else:
+                for (algorithm, tree_key), tree in self.trees.items():
+                    if tree_key is None or tree_key == key:
+                        tree.add(int(entry[algorithm], 16), entry)
+        return entry
+
+    def get_tree(self, algorithm, key=None):
+        with self.lock:
+            tree = self.trees.get((algorithm, key))
+            if tree is None:
+                tree = BKTree()
+                for entry in self.entries.values():
+                    if key is None or entry['key'] == key:
+                        tree.add(int(entry[algorithm], 16), entry)
+                self.trees[(algorithm, key)] = tree
+            return tree
+
+    def search(self, image, algorithm='phash', max_distance=DEFAULT_DISTANCE, key=None, url=None, limit=None):
+        """
+        Finds indexed images, similar to `image` (a path or a hash), closest first.
+        Optionally, results are limited to the browser `key` and page `url`.
+        """
+        if algorithm not in HASHES:
+            raise ValueError('Unknown algorithm: %s. Use one of %s' % (algorithm, ', '.join(ALGORITHMS)))
+        if isinstance(image, Integral):
+            value = image
+        else:
+            value = int(compute_hashes(image)[algorithm], 16)
+        results = []
+        for distance, entry in self.get_tree(algorithm, key).search(value, max_distance):
+            if url is not None and entry['url'] != url:
+                continue
+            results.append(dict(entry, distance=distance))
+            if limit is not None and len(results) >= limit:
+                break
+        return results
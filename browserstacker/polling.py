@@ -0,0 +1,100 @@
+# coding: utf-8
+import random
+from time import time
+
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_MAX_DELAY = 60
+DEFAULT_DEADLINE = 600
+FINAL_STATES = ('done', 'timed-out')
+
+
+class Backoff(object):
+    """
+    Exponential backoff with jitter.
+    Every delay is chosen randomly between half and full of exponentially growing value, capped by `maximum`.
+    """
+
+    def __init__(self, initial=DEFAULT_TIMEOUT, maximum=DEFAULT_MAX_DELAY, factor=2, jitter=0.5):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = min(self.maximum, self.initial * self.factor ** self.attempt)
+        self.attempt += 1
+        return delay - random.uniform(0, delay * self.jitter)
+
+    def reset(self):
+        self.attempt = 0
+
+
+def get_screenshot_key(screenshot, position):
+    return screenshot.get('id') or position
+
+
+class JobPoller(object):
+    """
+    Tracks states of screenshots of a single job between polls.
+    """
+
+    def __init__(self, job_id, timeout=DEFAULT_TIMEOUT, deadline=DEFAULT_DEADLINE, retries=None,
+                 max_delay=DEFAULT_MAX_DELAY):
+        self.job_id = job_id
+        self.backoff = Backoff(timeout, max_delay)
+        self.started_at = time()
+        self.deadline_at = self.started_at + deadline if deadline is not None else None
+        self.retries = retries
+        self.polls = 0
+        self.states = {}
+        self.saved = set()
+        self.screenshots = {}
+        self.new_failures = []
+
+    def update(self, response):
+        """
+        Registers `list` response and returns image URLs, that became ready since the previous update.
+        Screenshots, that timed out since the previous update, are stored in `new_failures`.
+        """
+        self.polls += 1
+        ready = []
+        self.new_failures = []
+        for position, screenshot in enumerate(response['screenshots']):
+            key = get_screenshot_key(screenshot, position)
+            state = screenshot['state']
+            if state == 'done' and not screenshot['image_url']:
+                state = 'processing'
+            if state != self.states.get(key):
+                self.backoff.reset()
+                if state in FINAL_STATES and state != 'done':
+                    self.new_failures.append(screenshot)
+            self.states[key] = state
+            if state == 'done' and screenshot['image_url'] not in self.saved:
+                self.saved.add(screenshot['image_url'])
+                self.screenshots[screenshot['image_url']] = screenshot
+                ready.append(screenshot['image_url'])
+        return ready
+
+    @property
+    def is_finished(self):
+        return all(state in FINAL_STATES for state in self.states.values())
+
+    @property
+    def pending(self):
+        return [key for key, state in self.states.items() if state not in FINAL_STATES]
+
+    def next_delay(self):
+        """
+        Returns time to wait before the next poll or None if job should not be polled anymore.
+        """
+        if self.retries is not None and self.polls > self.retries:
+            return None
+        delay = self.backoff.next_delay()
+        if self.deadline_at is not None:
+            remaining = self.deadline_at - time()
+            if remaining <= 0:
+                return None
+            delay = min(delay, remaining)
+        return delay
@@ -0,0 +1,189 @@
+# coding: utf-8
+"""
+Post-download image processing. Requires `Pillow`.
+
+    >>> pipeline = ImagePipeline([Resize(320), StripMetadata()], format='WEBP', quality=80, suffix='.thumb')
+    >>> with pipeline:
+    ...     api.download(job_id, 'screenshots', pipeline=pipeline)
+    {'http://.../win7_ie_8.0.png': {
+        'path': 'screenshots/win7_ie_8.0.png',
+        'output': 'screenshots/win7_ie_8.0.thumb.webp',
+        'bytes': 9482,
+        'timings': {'decode': 0.012, 'resize': 0.004, 'strip': 0.0, 'encode': 0.031, 'write': 0.001}
+    }}
+"""
+import os
+from io import BytesIO
+from time import time
+
+from .cache import atomic_write
+
+
+EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg', 'WEBP': 'webp'}
+
+
+def load_pil():
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImportError('Image processing requires Pillow: pip install browserstacker[images]')
+    return Image
+
+
+class Resize(object):
+    """
+    Fits image into `width` x `height` box, keeping its aspect ratio. Images are never enlarged.
+    """
+    name = 'resize'
+
+    def __init__(self, width, height=None):
+        self.width = width
+        self.height = height
+
+    def __call__(self, image):
+        image.thumbnail((self.width, self.height or image.size[1]), load_pil().LANCZOS)
+        return image
+
+
+class StripMetadata(object):
+    """
+    Drops text chunks, EXIF and other metadata.
+    """
+    name = 'strip'
+
+    def __call__(self, image):
+        image.info = {}
+        return image
+
+
+class ImageBuffer(object):
+    """
+    Collects chunks of an image while it is downloaded, so it is not read back from disk for processing.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def update(self, chunk):
+        self.chunks.append(chunk)
+
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+
+def get_output(filename, format, suffix, in_place):
+    stem, extension = os.path.splitext(filename)
+    if format is not None:
+        extension = '.' + EXTENSIONS.get(format, format.lower())
+    if in_place:
+        return stem + extension
+    return stem + suffix + extension
+
+
+def process_image(stages, options, filename, data=None):
+    """
+    Runs `stages` over the image and encodes it. Executed in worker processes.
+    Returns output path, its size and time spent in every stage.
+    """
+    Image = load_pil()
+    timings = {}
+    start = time()
+    image = Image.open(BytesIO(data) if data is not None else filename)
+    image.load()
+    format = options['format'] or image.format or 'PNG'
+    timings['decode'] = time() - start
+    for stage in stages:
+        start = time()
+        image = stage(image)
+        timings[stage.name] = time() - start
+    start = time()
+    if format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    params = {'optimize': options['optimize']}
+    if options['quality'] is not None:
+        params['quality'] = options['quality']
+    buffer = BytesIO()
+    image.save(buffer, format, **params)
+    content = buffer.getvalue()
+    timings['encode'] = time() - start
+    start = time()
+    output = get_output(filename, options['format'], options['suffix'], options['in_place'])
+    atomic_write(output, content, 'wb')
+    if options['in_place'] and output != filename:
+        os.remove(filename)
+    timings['write'] = time() - start
+    return {'path': filename, 'output': output, 'bytes': len(content), 'timings': timings}
+
+
+class ImagePipeline(object):
+    """
+    Processes downloaded images on a process pool, so CPU-heavy work doesn't block downloads.
+    Results are written next to originals with `suffix` or replace them if `in_place` is True.
+    Replaced originals don't match the manifest anymore and will be downloaded again by the next run.
+    With `processes=0` images are processed in the calling thread.
+    """
+
+    def __init__(self, stages=(), format=None, quality=None, optimize=False, suffix='.processed', in_place=False,
+                 processes=None):
+        self.stages = list(stages)
+        self.options = {
+            'format': format.upper() if format else None,
+            'quality': quality,
+            'optimize': optimize,
+            'suffix': suffix,
+            'in_place': in_place,
+        }
+        self.processes = processes
+        self.pool = None
+        self.pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def get_pool(self):
+        if self.pool is None:
+            from multiprocessing import Pool
+
+            self.pool = Pool(self.processes)
+        return self.pool
+
+    def submit(self, filename, data=None):
+        """
+        Schedules processing of the image. Returns an object with `ready()` and `get()` methods.
+        If `data` is not given, the image is read from `filename`.
+        """
+        if self.processes == 0:
+            result = ImmediateResult(process_image(self.stages, self.options, filename, data))
+        else:
+            result = self.get_pool().apply_async(process_image, (self.stages, self.options, filename, data))
+        self.pending[filename] = result
+        return result
+
+    def pop(self, filename):
+        """
+        Returns scheduled processing of the image. Images, that were not submitted yet, are read from disk.
+        """
+        if filename not in self.pending:
+            self.submit(filename)
+        return self.pending.pop(filename)
+
+
+class ImmediateResult(object):
+
+    def __init__(self, value):
+        self.value = value
+
+    def ready(self):
+        return True
+
+    def get(self):
+        return self.value
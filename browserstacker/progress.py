@@ -0,0 +1,57 @@
+# coding: utf-8
+"""
+Progress records, yielded by `ScreenShotsAPI.iter_download` and `ScreenShotsAPI.iter_make`.
+
+    job_started - job_id
+    screenshot - job_id, image_url, url, path, bytes, elapsed, state and browser fields
+    job_finished - job_id, state, saved, failed, pending, elapsed
+"""
+import os
+from time import time
+
+from .catalog import INDEXED_FIELDS
+
+
+JOB_STARTED = 'job_started'
+SCREENSHOT = 'screenshot'
+JOB_FINISHED = 'job_finished'
+
+
+def get_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def screenshot_record(poller, screenshot, path=None):
+    """
+    Record for a saved or failed screenshot. `elapsed` is counted from the start of the job's download.
+    """
+    record = dict((key, screenshot.get(key)) for key in INDEXED_FIELDS)
+    record.update(
+        event=SCREENSHOT,
+        job_id=poller.job_id,
+        image_url=screenshot.get('image_url'),
+        url=screenshot.get('url'),
+        state=screenshot.get('state'),
+        path=path,
+        bytes=get_size(path) if path is not None else None,
+        elapsed=time() - poller.started_at,
+    )
+    return record
+
+
+def job_record(event, poller, **extra):
+    return dict(extra, event=event, job_id=poller.job_id, elapsed=time() - poller.started_at)
+
+
+def collect_saved(records):
+    """
+    Mapping of image URLs to local filenames, as returned by `download`.
+    If images were processed, values are processing results instead.
+    """
+    return dict(
+        (record['image_url'], record.get('processed') or record['path']) for record in records
+        if record['event'] == SCREENSHOT and record['path'] is not None
+    )
@@ -0,0 +1,178 @@
+# coding: utf-8
+"""
+Rate limiter, shared by all processes on a host through an SQLite file.
+
+    >>> limiter = RateLimiter(rate=2, burst=5, max_jobs=3)
+    >>> api = ScreenShotsAPI('user', 'key', rate_limiter=limiter)
+
+API requests take tokens from a bucket, that is refilled with `rate` tokens per second up to `burst` tokens.
+Every generated job holds a slot until it is downloaded, at most `max_jobs` jobs run at once.
+When the bucket is empty or all slots are taken, callers wait instead of failing.
+"""
+import errno
+import os
+import sqlite3
+from contextlib import contextmanager
+from time import sleep, time
+
+from .cache import get_cache_dir
+
+
+DEFAULT_RATE_LIMIT_NAME = 'ratelimit.sqlite'
+DEFAULT_JOB_TTL = 60 * 60
+DEFAULT_POLL_INTERVAL = 0.5
+DEFAULT_LOCK_TIMEOUT = 30
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS bucket (name TEXT PRIMARY KEY, tokens REAL, updated REAL)',
+    'CREATE TABLE IF NOT EXISTS slots (id TEXT PRIMARY KEY, job_id TEXT, pid INTEGER, acquired REAL)',
+)
+
+
+def ensure_parent(path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+
+
+@contextmanager
+def transaction(path, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+    """
+    Exclusive SQLite transaction. Other processes wait for it up to `lock_timeout` seconds.
+    """
+    connection = sqlite3.connect(path, timeout=lock_timeout, isolation_level=None)
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
+
+
+def is_alive(pid):
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+class RateLimiter(object):
+    """
+    Token bucket and job slots, stored in an SQLite database. Every update is done in an exclusive transaction,
+    so processes never see each other's partial changes.
+    Slots of dead processes and slots older than `job_ttl` are released automatically.
+    """
+
+    def __init__(self, path=None, rate=None, burst=None, max_jobs=None, name='default', job_ttl=DEFAULT_JOB_TTL,
+                 poll_interval=DEFAULT_POLL_INTERVAL, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+        self.path = path or os.path.join(get_cache_dir(), DEFAULT_RATE_LIMIT_NAME)
+        self.rate = rate
+        self.burst = burst or max(rate or 1, 1)
+        self.max_jobs = max_jobs
+        self.name = name
+        self.job_ttl = job_ttl
+        self.poll_interval = poll_interval
+        self.lock_timeout = lock_timeout
+        ensure_parent(self.path)
+        with self.transaction() as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    def transaction(self):
+        return transaction(self.path, self.lock_timeout)
+
+    def take(self):
+        """
+        Takes a token if it is available. Otherwise returns seconds until the next token.
+        """
+        if self.rate is None:
+            return 0
+        with self.transaction() as connection:
+            now = time()
+            row = connection.execute('SELECT tokens, updated FROM bucket WHERE name = ?', (self.name, )).fetchone()
+            if row is None:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, row[0] + max(now - row[1], 0) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                delay = 0
+            else:
+                delay = (1 - tokens) / self.rate
+            connection.execute('INSERT OR REPLACE INTO bucket VALUES (?, ?, ?)', (self.name, tokens, now))
+        return delay
+
+    def acquire(self):
+        """
+        Waits for a token. Returns seconds spent waiting.
+        """
+        waited = 0
+        while True:
+            delay = self.take()
+            if not delay:
+                return waited
+            sleep(delay)
+            waited += delay
+
+    def expire(self, connection, now):
+        connection.execute('DELETE FROM slots WHERE acquired < ?', (now - self.job_ttl, ))
+        for (pid, ) in connection.execute('SELECT DISTINCT pid FROM slots').fetchall():
+            if not is_alive(pid):
+                connection.execute('DELETE FROM slots WHERE pid = ?', (pid, ))
+
+    def get_running(self):
+        """
+        Number of job slots, taken by all processes.
+        """
+        with self.transaction() as connection:
+            self.expire(connection, time())
+            return connection.execute('SELECT COUNT(*) FROM slots').fetchone()[0]
+
+    def has_free_job(self):
+        return self.max_jobs is None or self.get_running() < self.max_jobs
+
+    def take_job(self, slot):
+        """
+        Takes a job slot with the given id if there is a free one. Returns True on success.
+        """
+        if self.max_jobs is None:
+            return True
+        with self.transaction() as connection:
+            now = time()
+            self.expire(connection, now)
+            if connection.execute('SELECT COUNT(*) FROM slots').fetchone()[0] >= self.max_jobs:
+                return False
+            connection.execute('INSERT INTO slots VALUES (?, NULL, ?, ?)', (slot, os.getpid(), now))
+        return True
+
+    def acquire_job(self, slot):
+        """
+        Waits for a free job slot. Returns seconds spent waiting.
+        """
+        waited = 0
+        while not self.take_job(slot):
+            sleep(self.poll_interval)
+            waited += self.poll_interval
+        return waited
+
+    def bind_job(self, slot, job_id):
+        """
+        Associates the slot with a generated job, so it could be released by the job's id.
+        """
+        if self.max_jobs is not None:
+            with self.transaction() as connection:
+                connection.execute('UPDATE slots SET job_id = ? WHERE id = ?', (job_id, slot))
+
+    def release_job(self, slot=None, job_id=None):
+        if self.max_jobs is not None:
+            with self.transaction() as connection:
+                connection.execute('DELETE FROM slots WHERE id = ? OR job_id = ?', (slot, job_id))
@@ -0,0 +1,153 @@
+# coding: utf-8
+"""
+Retries of single API requests and image downloads, separate from polling of screenshot states.
+
+    >>> api = ScreenShotsAPI('user', 'key', retry_policy=RetryPolicy(attempts=5, total=30))
+
+Connection errors, timeouts, incomplete downloads, error pages and 408 / 429 / 5xx responses are retried with
+exponential backoff and jitter. `Retry-After` is respected and all attempts of a request fit into `total` seconds.
+Requests, that are not idempotent (job generation), are repeated only if the server certainly didn't process them.
+"""
+import threading
+from time import time
+
+from .polling import Backoff
+
+
+DEFAULT_ATTEMPTS = 4
+DEFAULT_INITIAL_DELAY = 0.5
+DEFAULT_MAX_DELAY = 10
+DEFAULT_TOTAL = 60
+RETRY_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+# The server refused these requests before processing them
+UNSAFE_RETRY_STATUSES = frozenset([429, 503])
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+
+class APIError(RuntimeError):
+    """
+    Unexpected API response, e.g. an HTML error page or a throttling response.
+    """
+
+    def __init__(self, message, status=None, retry_after=None):
+        super(APIError, self).__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value, now=None):
+    """
+    Seconds to wait from `Retry-After` header, that is either a number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    from email.utils import mktime_tz, parsedate_tz
+
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(mktime_tz(parsed) - (time() if now is None else now), 0)
+
+
+def get_status(exc):
+    status = getattr(exc, 'status', None)
+    if status is None:
+        status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    return status
+
+
+def get_retry_after(exc):
+    retry_after = getattr(exc, 'retry_after', None)
+    if retry_after is None:
+        response = getattr(exc, 'response', None)
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+    return retry_after
+
+
+def get_network_reason(exc, idempotent):
+    """
+    Reason to retry a network error of `requests`. Only connection timeouts are safe for non-idempotent requests.
+    """
+    try:
+        from requests import exceptions
+    except ImportError:
+        return None
+    if not idempotent:
+        return 'timeout' if isinstance(exc, exceptions.ConnectTimeout) else None
+    if isinstance(exc, exceptions.Timeout):
+        return 'timeout'
+    if isinstance(exc, (exceptions.ConnectionError, exceptions.ChunkedEncodingError)):
+        return 'connection'
+    return None
+
+
+def classify(exc, idempotent=True, statuses=RETRY_STATUSES):
+    """
+    Returns reason to retry the error or None if it is fatal. Doesn't depend on whether retries are enabled.
+    """
+    status = get_status(exc)
+    if status is not None:
+        if not idempotent:
+            statuses = frozenset(statuses) & UNSAFE_RETRY_STATUSES
+        return 'status_%s' % status if status in statuses else None
+    reason = getattr(exc, 'retry_reason', None)
+    if reason is not None:
+        return reason
+    return get_network_reason(exc, idempotent)
+
+
+class RetryPolicy(object):
+    """
+    Decides which errors are retried and how long to wait before the next attempt.
+    At most `attempts` retries are made, delays grow from `initial` to `maximum` seconds.
+    Counters of all retries are kept in `stats`.
+    """
+
+    def __init__(self, attempts=DEFAULT_ATTEMPTS, initial=DEFAULT_INITIAL_DELAY, maximum=DEFAULT_MAX_DELAY,
+                 total=DEFAULT_TOTAL, statuses=RETRY_STATUSES):
+        self.attempts = attempts
+        self.initial = initial
+        self.maximum = maximum
+        self.total = total
+        self.statuses = frozenset(statuses)
+        self.stats = {'retries': 0, 'recovered': 0, 'failed': 0}
+        self.lock = threading.Lock()
+
+    def __bool__(self):
+        return self.attempts > 0
+
+    __nonzero__ = __bool__
+
+    def classify(self, exc, idempotent=True):
+        """
+        Returns reason to retry the error or None if it is fatal.
+        """
+        return classify(exc, idempotent, self.statuses)
+
+    def get_backoff(self):
+        return Backoff(self.initial, self.maximum)
+
+    def get_delay(self, exc, attempt, started_at, backoff):
+        """
+        Seconds to wait before retrying after `attempt` retries or None if there is no time or attempts left.
+        """
+        if attempt >= self.attempts:
+            return None
+        remaining = started_at + self.total - time()
+        if remaining <= 0:
+            return None
+        retry_after = get_retry_after(exc)
+        if retry_after is None:
+            return min(backoff.next_delay(), remaining)
+        if retry_after > remaining:
+            return None
+        return retry_after
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
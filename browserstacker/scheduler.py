@@ -0,0 +1,202 @@
+# coding: utf-8
+from collections import deque
+from time import sleep, time
+
+from .hooks import SLEEP
+from .polling import DEFAULT_DEADLINE, DEFAULT_TIMEOUT, JobPoller
+from .progress import screenshot_record
+from .screenshots import AuthError, ParallelLimitReached
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job(object):
+    """
+    Single screenshots generation request, processed by `JobScheduler`.
+    """
+
+    def __init__(self, url, browsers=None, destination=None, **options):
+        self.url = url
+        self.browsers = browsers
+        self.destination = destination
+        self.options = options
+        self.job_id = None
+        self.status = QUEUED
+        self.poller = None
+        self.next_poll_at = None
+        self.submissions = 0
+        self.result = {}
+        self.error = None
+
+    def __repr__(self):
+        return '<Job %s %s %s>' % (self.url, self.job_id, self.status)
+
+    def as_dict(self):
+        return {
+            'url': self.url,
+            'job_id': self.job_id,
+            'status': self.status,
+            'submissions': self.submissions,
+            'screenshots': self.result,
+            'error': self.error,
+        }
+
+
+class JobScheduler(object):
+    """
+    Runs many jobs, keeping as many of them in flight as the account allows.
+    If the limit is unknown, it is learned from `ParallelLimitReached` responses and rejected jobs are requeued.
+    A learned limit may be caused by someone else's jobs, so one more job is tried every `retry_delay` seconds.
+    Screenshots are downloaded as soon as they are done.
+    With the API's `ledger` running jobs are claimed and their saved screenshots are recorded.
+    """
+
+    def __init__(self, api, parallel_limit=None, concurrency=1, timeout=DEFAULT_TIMEOUT, deadline=DEFAULT_DEADLINE,
+                 retry_delay=DEFAULT_TIMEOUT):
+        self.api = api
+        self.parallel_limit = parallel_limit
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retry_delay = retry_delay
+        self.jobs = []
+        self.queue = deque()
+        self.running = []
+        self.finished = deque()
+        self.retry_at = 0
+        self.probe_at = None
+
+    def add(self, url, browsers=None, destination=None, **options):
+        job = Job(url, browsers, destination, **options)
+        self.jobs.append(job)
+        self.queue.append(job)
+        return job
+
+    def run(self):
+        """
+        Processes all added jobs and returns them with their final statuses.
+        """
+        for _ in self.iter_run():
+            pass
+        return self.jobs
+
+    def iter_run(self):
+        """
+        Same as `run`, but yields every job as soon as it is finished.
+        """
+        while self.queue or self.running:
+            self.submit()
+            self.poll()
+            while self.finished:
+                yield self.finished.popleft()
+            delay = self.get_delay()
+            if delay > 0:
+                self.api.hooks.emit(SLEEP, job_id=None, duration=delay)
+                sleep(delay)
+
+    @property
+    def has_capacity(self):
+        if self.parallel_limit is None or len(self.running) < self.parallel_limit:
+            return True
+        return self.probe_at is not None and time() >= self.probe_at
+
+    def submit(self):
+        while self.queue and self.has_capacity and time() >= self.retry_at:
+            limiter = self.api.rate_limiter
+            if limiter is not None and not limiter.has_free_job():
+                # Slots are occupied by other processes or our running jobs
+                self.retry_at = time() + self.retry_delay
+                break
+            job = self.queue.popleft()
+            job.submissions += 1
+            probing = self.parallel_limit is not None and len(self.running) >= self.parallel_limit
+            if probing:
+                self.probe_at = time() + self.retry_delay
+            try:
+                job.job_id = self.api.generate(job.url, job.browsers, **job.options)['job_id']
+            except ParallelLimitReached:
+                self.queue.appendleft(job)
+                if self.running:
+                    self.parallel_limit = len(self.running)
+                    self.probe_at = time() + self.retry_delay
+                    self.api.logger.debug('Parallel limit is set to %s', self.parallel_limit)
+                else:
+                    # Slots are occupied by someone else
+                    self.retry_at = time() + self.retry_delay
+                break
+            except AuthError:
+                raise
+            except Exception as exc:
+                self.fail(job, exc)
+                continue
+            if self.api.ledger is not None:
+                self.api.ledger.start(job.job_id, job.destination)
+            job.status = RUNNING
+            job.poller = JobPoller(job.job_id, self.timeout, self.deadline)
+            job.next_poll_at = time() + self.timeout
+            self.running.append(job)
+            if probing:
+                self.parallel_limit = len(self.running)
+                self.api.logger.debug('Parallel limit is raised to %s', self.parallel_limit)
+
+    def poll(self):
+        for job in list(self.running):
+            if time() < job.next_poll_at:
+                continue
+            try:
+                response = self.api.list(job.job_id)
+                ready = job.poller.update(response)
+                saved = self.api.save_all(ready, job.destination, self.concurrency)
+                job.result.update(saved)
+                if self.api.ledger is not None:
+                    for image_url, filename in saved.items():
+                        screenshot = job.poller.screenshots[image_url]
+                        self.api.ledger.add_screenshot(screenshot_record(job.poller, screenshot, filename))
+            except AuthError:
+                raise
+            except Exception as exc:
+                self.running.remove(job)
+                self.fail(job, exc)
+                continue
+            if job.poller.is_finished:
+                self.finish(job, DONE)
+                continue
+            delay = job.poller.next_delay()
+            if delay is None:
+                self.finish(job, FAILED, 'Deadline exceeded')
+            else:
+                job.next_poll_at = time() + delay
+
+    def finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        self.running.remove(job)
+        self.api.release_job(job.job_id)
+        if self.api.ledger is not None and status == DONE:
+            self.api.ledger.finish(job.job_id)
+        self.finished.append(job)
+
+    def fail(self, job, exc):
+        self.api.logger.debug('Job for %s failed: %r', job.url, exc)
+        job.status = FAILED
+        job.error = str(exc) or exc.__class__.__name__
+        if job.job_id is not None:
+            self.api.release_job(job.job_id)
+            # Jobs with transient errors stay pending in the ledger, so they could be resumed
+            if self.api.ledger is not None and not self.api.is_transient(exc):
+                self.api.ledger.finish(job.job_id, FAILED, job.error)
+        self.finished.append(job)
+
+    def get_delay(self):
+        now = time()
+        moments = [job.next_poll_at for job in self.running]
+        if self.queue:
+            moments.append(self.retry_at if self.has_capacity else self.probe_at)
+        moments = [moment for moment in moments if moment is not None]
+        if not moments:
+            return 0
+        return max(min(moments) - now, 0)
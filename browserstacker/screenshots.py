@@ -1,17 +1,32 @@
 # coding: utf-8
 import logging
 import os
+import re
 import sys
-from time import sleep
+import threading
+import uuid
+from time import sleep, time
 
-import requests
-
-from ._compat import urljoin
+from ._compat import replace_file, urljoin
+from .archive import Archive, ArchiveJob, is_archive, open_archive
+from .cache import DEFAULT_CACHE_SIZE, BoundedCache, CatalogUnavailable
+from .catalog import BrowserCatalog
+from .hooks import CALLBACK, GENERATE, POLL, PROGRESS, REQUEST_END, REQUEST_START, RETRY, SAVE, SLEEP, Hooks
+from .manifest import Manifest, hash_file, new_hasher
+from .polling import DEFAULT_DEADLINE, DEFAULT_TIMEOUT, JobPoller
+from .processing import ImageBuffer
+from .progress import JOB_FINISHED, JOB_STARTED, collect_saved, job_record, screenshot_record
+from .retry import IDEMPOTENT_METHODS, RETRY_STATUSES, APIError, RetryPolicy, classify, parse_retry_after
+from .session import (
+    DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE, DEFAULT_REQUEST_TIMEOUT, get_pool_stats, make_session
+)
 
 
 DEFAULT_LOGGING_LEVEL = logging.CRITICAL
-DEFAULT_TIMEOUT = 10
-DEFAULT_RETRIES = 6
+DEFAULT_CHUNK_SIZE = 64 * 1024
+PARTIAL_SUFFIX = '.part'
+VALIDATOR_SUFFIX = '.validator'
+BROWSERS_URL = '/screenshots/browsers.json'
 
 
 class AuthError(RuntimeError):
@@ -22,6 +37,10 @@ class ParallelLimitReached(RuntimeError):
     pass
 
 
+class IncompleteDownload(RuntimeError):
+    retry_reason = 'incomplete'
+
+
 def get_logger(verbosity):
     """
     Returns simple console logger.
@@ -50,6 +69,137 @@ def match_item(key, value, item):
         return key not in item or str(item.get(key)).lower() == str(value).lower()
 
 
+def prepare_job(url, browsers, default_browser, **options):
+    """
+    Builds payload for screenshots generation.
+    """
+    if isinstance(browsers, dict):
+        browsers = [browsers]
+    if browsers is None:
+        browsers = [default_browser]
+    data = dict((key, value) for key, value in options.items() if value is not None)
+    data.update(url=url, browsers=browsers)
+    return data
+
+
+def check_response(response):
+    """
+    Raises exceptions for API error responses.
+    """
+    if isinstance(response, dict):
+        if response.get('message') == 'Parallel limit reached':
+            raise ParallelLimitReached
+        elif response.get('error') == 'Sign up or sign in':
+            raise AuthError
+    return response
+
+
+def parse_response(response):
+    """
+    Decodes JSON body of API response. Error pages and responses with retryable statuses raise `APIError`.
+    """
+    status = response.status_code
+    try:
+        data = response.json()
+    except ValueError:
+        raise APIError(
+            'Invalid response with status %s: %r' % (status, response.content[:100]), status,
+            parse_retry_after(response.headers.get('Retry-After'))
+        )
+    check_response(data)
+    if status in RETRY_STATUSES:
+        raise APIError(
+            'Error response with status %s: %s' % (status, data), status,
+            parse_retry_after(response.headers.get('Retry-After'))
+        )
+    return data
+
+
+def get_filename(image_url, destination=None):
+    filename = image_url.split('/')[-1]
+    if destination:
+        filename = os.path.join(destination, filename)
+    return filename
+
+
+def get_resume_offset(partial):
+    try:
+        return os.path.getsize(partial)
+    except OSError:
+        return 0
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def get_validator(headers):
+    """
+    Strong ETag or Last-Modified of the image. It is stored next to the partial file and sent in If-Range.
+    """
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+def write_validator(partial, validator):
+    if validator:
+        with open(partial + VALIDATOR_SUFFIX, 'w') as f:
+            f.write(validator)
+    else:
+        remove_file(partial + VALIDATOR_SUFFIX)
+
+
+def get_resume_headers(partial, offset):
+    """
+    Range request for the rest of the image. If the image has changed since, the server sends it whole.
+    """
+    if not offset:
+        return {}
+    headers = {'Range': 'bytes=%s-' % offset}
+    try:
+        with open(partial + VALIDATOR_SUFFIX) as f:
+            validator = f.read().strip()
+    except (IOError, OSError):
+        validator = None
+    if validator:
+        headers['If-Range'] = validator
+    return headers
+
+
+def is_resumed_at(status, headers, offset):
+    """
+    Checks, that the server sent the rest of the image from `offset`.
+    """
+    if status != 206:
+        return False
+    match = re.match(r'^bytes (\d+)-', headers.get('Content-Range') or '')
+    return match is not None and int(match.group(1)) == offset
+
+
+def get_expected_size(headers, offset=0):
+    """
+    Size of the complete file. Unknown if the response is compressed or has no Content-Length.
+    """
+    if headers.get('Content-Length') is None or headers.get('Content-Encoding', 'identity') != 'identity':
+        return None
+    return offset + int(headers['Content-Length'])
+
+
+def ensure_dir(destination):
+    """
+    Checks, that `destination` exists.
+    """
+    try:
+        os.makedirs(destination)
+    except OSError:
+        pass
+
+
 class ScreenShotsAPI(object):
     """
     Wrapper for BrowserStack Screenshots API.
@@ -63,117 +213,841 @@ class ScreenShotsAPI(object):
         'device': None
     }
 
-    def __init__(self, user, key, default_browser=None, verbosity=0):
-        self.auth = requests.auth.HTTPBasicAuth(user, key)
+    def __init__(self, user, key, default_browser=None, verbosity=0, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False, keep_alive=True,
+                 request_timeout=DEFAULT_REQUEST_TIMEOUT, catalog_cache=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 cache_size=DEFAULT_CACHE_SIZE, use_manifest=False, hooks=None,
+                 callback_receiver=None, store=None, rate_limiter=None, memo=None, credential_pool=None,
+                 retry_policy=None, ledger=None):
+        # Same as HTTPBasicAuth, but doesn't require importing `requests` until the first request
+        self.auth = (user, key)
         self.default_browser = default_browser or self.default_browser
-        self._cache = {}
+        self.catalog_cache = catalog_cache
+        self.catalog = None
+        self._uncached_browsers = (None, None)
+        self.request_timeout = request_timeout
+        self.chunk_size = chunk_size
+        self.session_options = (pool_connections, pool_maxsize, pool_block, keep_alive)
+        self._session = None
+        self.use_manifest = use_manifest
+        self.hooks = hooks if hooks is not None else Hooks()
+        self.callback_receiver = callback_receiver
+        self.store = store
+        self.rate_limiter = rate_limiter
+        self.memo = memo
+        self.credential_pool = credential_pool
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.ledger = ledger
+        self._cache = BoundedCache(cache_size)
+        self._manifests = {}
+        self._slots = {}
+        self._polled_jobs = set()
+        self._lock = threading.Lock()
         self.logger = get_logger(verbosity)
         self.logger.info('Username: %s; Password: %s;', user, key)
         self.logger.info('Default browser: %s;', self.default_browser)
 
-    def execute(self, method, url, **kwargs):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def session(self):
+        """
+        Session is created on the first request, so commands, that don't touch the network, don't load `requests`.
+        """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = make_session(*self.session_options)
+        return self._session
+
+    def close(self):
+        """
+        Closes all pooled connections.
+        """
+        if self._session is not None:
+            self._session.close()
+
+    @property
+    def pool_stats(self):
+        """
+        Connection pool hit/miss counters.
+        """
+        return get_pool_stats(self.session)
+
+    def request(self, method, url, **kwargs):
         url = urljoin(self.root_url, url)
         self.logger.debug('Making "%s" request to "%s" with "%s"', method, url, str(kwargs))
         kwargs.setdefault('auth', self.auth)
-        response = requests.request(method, url, **kwargs)
+        kwargs.setdefault('timeout', self.request_timeout)
+        if self.rate_limiter is not None:
+            waited = self.rate_limiter.acquire()
+            if waited:
+                self.hooks.emit(SLEEP, job_id=None, duration=waited)
+        if self.hooks:
+            response = self.track_request(method, url, **kwargs)
+        else:
+            response = self.session.request(method, url, **kwargs)
         self.logger.debug('Response: "%s"', response.content)
-        response = response.json()
-        if isinstance(response, dict):
-            if response.get('message') == 'Parallel limit reached':
-                raise ParallelLimitReached
-            elif response.get('error') == 'Sign up or sign in':
-                raise AuthError
         return response
 
-    def browsers(self, browser=None, browser_version=None, device=None, os=None, os_version=None):
+    def track_request(self, method, url, **kwargs):
         """
-        Returns list of available browsers & OS.
+        Sends request, emitting `request_start` and `request_end` events.
         """
-        response = self.execute('GET', '/screenshots/browsers.json')
-        for key, value in list(locals().items()):
-            if key in ('self', 'response') or not value:
-                continue
-            response = [item for item in response if match_item(key, value, item)]
+        self.hooks.emit(REQUEST_START, method=method, url=url)
+        start = time()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except Exception as exc:
+            self.hooks.emit(REQUEST_END, method=method, url=url, status=None, elapsed=time() - start, size=0, error=exc)
+            raise
+        self.hooks.emit(
+            REQUEST_END, method=method, url=url, status=response.status_code, elapsed=time() - start,
+            size=len(response.content), error=None
+        )
         return response
 
-    def make(self, url, browsers=None, destination=None, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, **kwargs):
+    def execute(self, method, url, **kwargs):
+        return self.retrying(
+            lambda: parse_response(self.request(method, url, **kwargs)), url, method in IDEMPOTENT_METHODS
+        )
+
+    def retrying(self, func, url, idempotent=True):
+        """
+        Calls `func`, repeating it on transient errors according to `retry_policy`.
+        """
+        policy = self.retry_policy
+        if not policy:
+            return func()
+        started_at = time()
+        backoff = policy.get_backoff()
+        attempt = 0
+        while True:
+            try:
+                result = func()
+            except Exception as exc:
+                reason = policy.classify(exc, idempotent)
+                delay = policy.get_delay(exc, attempt, started_at, backoff) if reason is not None else None
+                if delay is None:
+                    if attempt:
+                        policy.count('failed')
+                    raise
+                attempt += 1
+                policy.count('retries')
+                self.logger.debug('Retrying "%s" in %.2f seconds after %r', url, delay, exc)
+                self.hooks.emit(RETRY, reason=reason, job_id=None, url=url, attempt=attempt, delay=delay)
+                self.wait(delay)
+                continue
+            if attempt:
+                policy.count('recovered')
+            return result
+
+    def is_transient(self, exc):
+        """
+        Whether the error could go away later, e.g. a dropped connection. Doesn't depend on whether retries are enabled.
+        """
+        return classify(exc, statuses=getattr(self.retry_policy, 'statuses', RETRY_STATUSES)) is not None
+
+    def fetch_browsers(self, refresh=False, offline=False):
+        """
+        Returns the full browsers catalog, using `catalog_cache` if it is configured.
+        """
+        cache = self.catalog_cache
+        if cache is None:
+            if offline:
+                raise CatalogUnavailable('Catalog cache is not configured')
+            return self.fetch_uncached_browsers()
+        browsers = cache.get(refresh, offline)
+        if browsers is not None:
+            self.logger.debug('Using cached browsers catalog from "%s"', cache.path)
+            return browsers
+        response, browsers = self.retrying(
+            lambda: self.request_browsers(headers=cache.get_validators()), BROWSERS_URL
+        )
+        if browsers is None:
+            browsers = cache.revalidate()
+            if browsers is not None:
+                return browsers
+            # Cached entry is gone, the full catalog is needed
+            response, browsers = self.retrying(lambda: self.request_browsers(headers={}), BROWSERS_URL)
+        return cache.store(browsers, response.headers)
+
+    def fetch_uncached_browsers(self):
+        """
+        Requests the catalog with ETag of the previous response. If it is not modified, the previous list is returned,
+        so the indexed catalog is reused.
+        """
+        etag, browsers = self._uncached_browsers
+        kwargs = {'headers': {'If-None-Match': etag}} if etag and browsers is not None else {}
+        response, fetched = self.retrying(lambda: self.request_browsers(**kwargs), BROWSERS_URL)
+        if fetched is None:
+            return browsers
+        self._uncached_browsers = (response.headers.get('ETag'), fetched)
+        return fetched
+
+    def request_browsers(self, **kwargs):
+        """
+        Returns the catalog response and its data. Data is None if the catalog is not modified.
+        """
+        response = self.request('GET', BROWSERS_URL, **kwargs)
+        if response.status_code == 304:
+            return response, None
+        return response, parse_response(response)
+
+    def browsers(self, browser=None, browser_version=None, device=None, os=None, os_version=None, refresh=False,
+                 offline=False):
+        """
+        Returns list of available browsers & OS.
+        """
+        catalog = self.get_catalog(refresh, offline)
+        return catalog.filter(
+            browser=browser, browser_version=browser_version, device=device, os=os, os_version=os_version
+        )
+
+    def get_catalog(self, refresh=False, offline=False):
+        """
+        Returns indexed browsers catalog. Indexes are rebuilt only if the catalog has changed.
+        """
+        browsers = self.fetch_browsers(refresh, offline)
+        if self.catalog is None or not self.catalog.is_built_from(browsers):
+            self.catalog = BrowserCatalog(browsers)
+        return self.catalog
+
+    def make(self, url, browsers=None, destination=None, timeout=DEFAULT_TIMEOUT, retries=None, concurrency=1,
+             deadline=DEFAULT_DEADLINE, pipeline=None, **kwargs):
         """
         Generates screenshots for given settings and saves it to specified destination.
         """
         response = self.generate(url, browsers, **kwargs)
-        return self.download(response['job_id'], destination, timeout, retries)
+        return self.download(response['job_id'], destination, timeout, retries, concurrency, deadline, pipeline)
+
+    def iter_make(self, url, browsers=None, destination=None, timeout=DEFAULT_TIMEOUT, retries=None, concurrency=1,
+                  deadline=DEFAULT_DEADLINE, pipeline=None, **kwargs):
+        """
+        Same as `make`, but yields progress records like `iter_download`.
+        """
+        response = self.generate(url, browsers, **kwargs)
+        records = self.iter_download(
+            response['job_id'], destination, timeout, retries, concurrency, deadline, pipeline
+        )
+        for record in records:
+            if record['event'] == JOB_STARTED:
+                record['url'] = url
+            yield record
 
     def generate(self, url, browsers=None, orientation=None, mac_res=None, win_res=None,
                              quality=None, local=None, wait_time=None, callback_url=None):
         """
         Generates screenshots for a URL.
+        If `callback_receiver` is set, BrowserStack is asked to notify it when the job is done.
+        With `rate_limiter` the job takes a slot, that is released when the job is downloaded.
+        With `memo` a fresh job with the same payload is returned instead of starting a new one. Such jobs are polled
+        if they were started with another callback URL.
+        With `credential_pool` the job is started by the least loaded account with free capacity.
+        With `ledger` the job is recorded, so it could be resumed if the process dies before its download.
         """
-        if isinstance(browsers, dict):
-            browsers = [browsers]
-        if browsers is None:
-            browsers = [self.default_browser]
-        data = dict((key, value) for key, value in locals().items() if value is not None and key != 'self')
-        return self.execute('POST', '/screenshots', json=data)
+        if callback_url is None and self.callback_receiver is not None:
+            callback_url = self.callback_receiver.url
+        data = prepare_job(
+            url, browsers, self.default_browser, orientation=orientation, mac_res=mac_res, win_res=win_res,
+            quality=quality, local=local, wait_time=wait_time, callback_url=callback_url
+        )
+        if self.memo is not None:
+            entry = self.memo.get_job_entry(data)
+            if entry is not None:
+                response = entry['response']
+                self.logger.debug('Reusing job %s for "%s"', response.get('job_id'), url)
+                if self.credential_pool is not None and entry.get('account') and response.get('job_id'):
+                    self.credential_pool.adopt(response['job_id'], entry['account'])
+                if entry.get('callback_url') != data.get('callback_url') and response.get('job_id'):
+                    # Its callback goes elsewhere
+                    self._polled_jobs.add(response['job_id'])
+                return response
+        if self.credential_pool is None:
+            response = self.submit(data)
+        else:
+            response = self.submit_pooled(data)
+        if self.memo is not None and response.get('job_id'):
+            self.memo.add_job(data, response, self.get_account(response['job_id']))
+        if self.ledger is not None and response.get('job_id'):
+            self.ledger.add_job(response['job_id'], data, self.get_account(response['job_id']))
+        return response
+
+    def get_account(self, job_id):
+        """
+        User, that owns the job.
+        """
+        if self.credential_pool is not None:
+            account = self.credential_pool.get_owner(job_id)
+            if account is not None:
+                return account.user
+        return self.auth[0]
+
+    def submit(self, data, **kwargs):
+        """
+        Sends `generate` payload to BrowserStack.
+        """
+        start = time()
+        slot = self.acquire_job()
+        try:
+            response = self.execute('POST', '/screenshots', json=data, **kwargs)
+        except Exception:
+            self.release_job(slot=slot)
+            raise
+        if slot is not None:
+            self.rate_limiter.bind_job(slot, response.get('job_id'))
+            if response.get('job_id'):
+                self._slots[response['job_id']] = slot
+        self.hooks.emit(
+            GENERATE, url=data['url'], job_id=response.get('job_id'), browsers=len(data['browsers']),
+            elapsed=time() - start
+        )
+        return response
+
+    def submit_pooled(self, data):
+        """
+        Sends `generate` payload with accounts of `credential_pool` until one of them accepts it.
+        Raises `ParallelLimitReached` if all accounts are busy.
+        """
+        pool = self.credential_pool
+        rejected = []
+        while True:
+            account = pool.acquire(rejected)
+            if account is None:
+                raise ParallelLimitReached
+            try:
+                response = self.submit(data, auth=account.auth)
+            except ParallelLimitReached:
+                self.logger.debug('Parallel limit reached for %s', account.user)
+                pool.reject(account)
+                rejected.append(account)
+                continue
+            except Exception:
+                pool.cancel(account)
+                raise
+            pool.assign(account, response.get('job_id'))
+            return response
+
+    def acquire_job(self):
+        """
+        Waits for a job slot of `rate_limiter`. Returns the slot's id.
+        """
+        if self.rate_limiter is None:
+            return None
+        slot = uuid.uuid4().hex
+        waited = self.rate_limiter.acquire_job(slot)
+        if waited:
+            self.hooks.emit(SLEEP, job_id=None, duration=waited)
+        return slot
+
+    def release_job(self, job_id=None, slot=None):
+        """
+        Frees the job's slot of `rate_limiter` and its claim in `ledger`.
+        Only slots, taken by this instance, are freed - reused jobs of other processes keep theirs.
+        """
+        if slot is None and job_id is not None:
+            slot = self._slots.pop(job_id, None)
+        if self.rate_limiter is not None and slot is not None:
+            self.rate_limiter.release_job(slot)
+        if job_id is not None:
+            if self.credential_pool is not None:
+                self.credential_pool.release(job_id)
+            if self.ledger is not None:
+                self.ledger.release(job_id)
 
     def list(self, job_id):
         """
         Generate the list of screenshots and their states.
+        With `credential_pool` the job is requested with credentials of the account, that started it.
         """
-        return self.execute('GET', '/screenshots/%s.json' % job_id)
+        kwargs = {}
+        if self.credential_pool is not None:
+            account = self.credential_pool.get_owner(job_id)
+            if account is not None:
+                kwargs['auth'] = account.auth
+        if self.ledger is not None:
+            self.ledger.renew(job_id)
+        return self.execute('GET', '/screenshots/%s.json' % job_id, **kwargs)
 
-    def download(self, job_id, destination=None, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+    def utilization(self):
         """
-        Downloads all screenshots for given job_id to `destination` folder.
+        Running jobs and parallel limits of `credential_pool` accounts.
+        """
+        if self.credential_pool is None:
+            return []
+        return self.credential_pool.utilization()
+
+    def download(self, job_id, destination=None, timeout=DEFAULT_TIMEOUT, retries=None, concurrency=1,
+                 deadline=DEFAULT_DEADLINE, pipeline=None):
+        """
+        Downloads all screenshots for given job_id to `destination` folder and returns mapping of their URLs to
+        local filenames.
         If `destination` is None, then screenshots will be saved in current directory.
+        Up to `concurrency` screenshots are downloaded at once.
+        The job is polled with exponential backoff starting from `timeout` seconds until all screenshots are done
+        or `deadline` seconds passed. Optionally, number of polls could be limited with `retries`.
+        With `callback_receiver` the job is not polled until its callback arrives or the receiver's timeout passes.
+        Callbacks are not authenticated, so their payloads are not trusted and the job is listed after them.
+        Saved images are passed to `pipeline` (see `browserstacker.processing`), then values are processing results.
+        With `memo` results of finished downloads are reused while they are fresh and their files exist.
         """
-        self._retries_num = 0
-        sleep(timeout)
-        self.save_many(job_id, destination, timeout, retries)
-        return self._cache
+        use_memo = self.memo is not None and pipeline is None and not isinstance(destination, Archive)
+        if use_memo:
+            results = self.memo.get_results(job_id, destination)
+            if results is not None:
+                self.logger.debug('Reusing downloaded screenshots of %s', job_id)
+                return results
+        records = list(self.iter_download(job_id, destination, timeout, retries, concurrency, deadline, pipeline))
+        results = collect_saved(records)
+        if use_memo and records[-1]['state'] == 'done':
+            self.memo.add_results(job_id, destination, results)
+        return results
 
-    def save_many(self, job_id, destination, timeout, retries):
-        response = self.list(job_id)
-        for screenshot in response['screenshots']:
-            state = screenshot['state']
-            if state == 'timed-out':
-                continue
-            if self._retries_num >= retries:
-                self.logger.debug('Retry limit exceeded for %s' % job_id)
+    def iter_download(self, job_id, destination=None, timeout=DEFAULT_TIMEOUT, retries=None, concurrency=1,
+                      deadline=DEFAULT_DEADLINE, pipeline=None):
+        """
+        Same as `download`, but yields progress records: `job_started`, `screenshot` for every saved or timed out
+        screenshot as soon as it is saved and `job_finished`. See `browserstacker.progress`.
+        Every record is also emitted as `progress` event.
+        With `ledger` the job is claimed by the current process and its screenshots are recorded. If another live
+        process holds the claim, `browserstacker.ledger.JobClaimed` is raised.
+        If `destination` is an archive (see `browserstacker.archive`), images are written into it.
+        """
+        archive = None
+        if isinstance(destination, Archive):
+            if pipeline is not None:
+                raise ValueError('Images in archives can not be processed')
+            archive = destination
+        if self.ledger is not None:
+            self.ledger.start(job_id, archive.path if archive is not None else destination)
+        if archive is not None:
+            destination = archive.job(job_id)
+        poller = JobPoller(job_id, timeout, deadline, retries)
+        saved = failed = 0
+        try:
+            record = job_record(JOB_STARTED, poller)
+            self.hooks.emit(PROGRESS, record=record)
+            yield record
+            if self.callback_receiver is None or job_id in self._polled_jobs:
+                self.wait(timeout, job_id)
+            elif self.wait_callback(job_id, deadline) is None:
+                self.logger.debug('No callback for %s, falling back to polling', job_id)
+            for record in self.iter_save_many(poller, destination, concurrency, pipeline):
+                if record['path'] is None:
+                    failed += 1
+                else:
+                    saved += 1
+                    if archive is not None:
+                        destination.add_record(record)
+                if self.ledger is not None:
+                    self.ledger.add_screenshot(record)
+                self.hooks.emit(PROGRESS, record=record)
+                yield record
+        finally:
+            self.release_job(job_id)
+            if archive is not None:
+                destination.close()
+        if self.ledger is not None and poller.is_finished:
+            self.ledger.finish(job_id)
+        record = job_record(
+            JOB_FINISHED, poller, state='done' if poller.is_finished else 'deadline-exceeded', saved=saved,
+            failed=failed, pending=len(poller.pending)
+        )
+        self.hooks.emit(PROGRESS, record=record)
+        yield record
+
+    def resume(self, destination=None, timeout=DEFAULT_TIMEOUT, retries=None, concurrency=1,
+               deadline=DEFAULT_DEADLINE, pipeline=None, limit=None):
+        """
+        Downloads unfinished jobs of `ledger`. Returns mapping of job ids to results like `download` returns.
+        """
+        results = {}
+        records = self.iter_resume(destination, timeout, retries, concurrency, deadline, pipeline, limit)
+        for record in records:
+            results.setdefault(record['job_id'], []).append(record)
+        return dict((job_id, collect_saved(records)) for job_id, records in results.items())
+
+    def iter_resume(self, destination=None, timeout=DEFAULT_TIMEOUT, retries=None, concurrency=1,
+                    deadline=DEFAULT_DEADLINE, pipeline=None, limit=None):
+        """
+        Claims unfinished jobs of `ledger` one by one, up to `limit` jobs, and yields progress records of their
+        downloads. Jobs, claimed by other live processes, are skipped, so several workers could resume at once.
+        Jobs are saved to their recorded destinations unless `destination` is given.
+        Jobs, that fail with non-transient errors (e.g. expired ones), are marked as failed.
+        """
+        resumed = []
+        while limit is None or len(resumed) < limit:
+            job = self.ledger.claim(resumed)
+            if job is None:
                 break
-            if state != 'done' or not screenshot['image_url']:
-                self.logger.debug('Retrying download for %s' % job_id)
-                self._retries_num += 1
-                sleep(timeout)
-                self.save_many(job_id, destination, timeout, retries)
+            job_id = job['job_id']
+            resumed.append(job_id)
+            if self.credential_pool is not None and job['account']:
+                self.credential_pool.adopt(job_id, job['account'])
+            self.logger.debug('Resuming %s', job_id)
+            target = destination or job['destination']
+            archive = open_archive(target) if is_archive(target) else None
+            records = self.iter_download(
+                job_id, archive or target, timeout, retries, concurrency, deadline, pipeline
+            )
+            try:
+                for record in records:
+                    yield record
+            except AuthError:
+                raise
+            except Exception as exc:
+                self.logger.debug('Resuming %s failed: %r', job_id, exc)
+                if not self.is_transient(exc):
+                    from .ledger import FAILED
+
+                    self.ledger.finish(job_id, FAILED, str(exc) or exc.__class__.__name__)
+            finally:
+                if archive is not None:
+                    archive.close()
+
+    def wait_callback(self, job_id, deadline=None):
+        """
+        Waits for the job's callback, but not longer than `deadline`. Returns its payload or None on timeout.
+        """
+        timeout = self.callback_receiver.timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline)
+        start = time()
+        response = self.callback_receiver.wait(job_id, timeout)
+        self.hooks.emit(CALLBACK, job_id=job_id, received=response is not None, elapsed=time() - start)
+        return response
+
+    def save_many(self, poller, destination=None, concurrency=1, pipeline=None):
+        """
+        Polls the job and saves every screenshot as soon as it is done.
+        """
+        return collect_saved(self.iter_save_many(poller, destination, concurrency, pipeline=pipeline))
+
+    def iter_save_many(self, poller, destination=None, concurrency=1, pipeline=None):
+        """
+        Polls the job and yields `screenshot` records for saved and timed out screenshots.
+        With `pipeline` records of saved screenshots are yielded when their processing is finished.
+        """
+        processing = []
+        while True:
+            start = time()
+            ready = poller.update(self.list(poller.job_id))
+            self.hooks.emit(
+                POLL, job_id=poller.job_id, attempt=poller.polls, ready=len(ready), pending=len(poller.pending),
+                elapsed=time() - start
+            )
+            for screenshot in poller.new_failures:
+                yield screenshot_record(poller, screenshot)
+            for image_url, filename in self.iter_save_all(ready, destination, concurrency, pipeline):
+                screenshot = poller.screenshots[image_url]
+                if self.store is not None:
+                    self.store.add_ref(poller.job_id, screenshot, filename)
+                if pipeline is None:
+                    yield screenshot_record(poller, screenshot, filename)
+                else:
+                    processing.append((screenshot, filename, pipeline.pop(filename)))
+            for record in self.iter_processed(poller, processing):
+                yield record
+            if poller.is_finished:
                 break
-            self.save(screenshot['image_url'], destination)
+            delay = poller.next_delay()
+            if delay is None:
+                self.logger.debug('Deadline exceeded for %s. Pending: %s', poller.job_id, poller.pending)
+                break
+            self.logger.debug('Retrying download for %s in %.2f seconds', poller.job_id, delay)
+            self.hooks.emit(RETRY, reason='pending', job_id=poller.job_id, url=None, attempt=poller.polls, delay=delay)
+            self.wait(delay, poller.job_id)
+        for record in self.iter_processed(poller, processing, wait=True):
+            yield record
+
+    def iter_processed(self, poller, processing, wait=False):
+        """
+        Yields `screenshot` records for finished image processing and removes them from `processing`.
+        """
+        for item in list(processing):
+            screenshot, filename, result = item
+            if wait or result.ready():
+                processing.remove(item)
+                record = screenshot_record(poller, screenshot, filename)
+                record['processed'] = result.get()
+                yield record
+
+    def wait(self, delay, job_id=None):
+        self.hooks.emit(SLEEP, job_id=job_id, duration=delay)
+        sleep(delay)
+
+    def save_all(self, image_urls, destination=None, concurrency=1, pipeline=None):
+        """
+        Saves images, running up to `concurrency` downloads at once. Returns mapping of URLs to filenames.
+        Every URL is downloaded only once, even if it is listed several times.
+        """
+        return dict(self.iter_save_all(image_urls, destination, concurrency, pipeline))
+
+    def iter_save_all(self, image_urls, destination=None, concurrency=1, pipeline=None):
+        """
+        Same as `save_all`, but yields pairs of URL and filename in order of completion.
+        """
+        seen, queue = set(), []
+        for image_url in image_urls:
+            if image_url in seen:
+                continue
+            seen.add(image_url)
+            filename = self._cache.get(image_url)
+            if filename is None:
+                queue.append(image_url)
+            else:
+                yield image_url, filename
+
+        def save(image_url):
+            if pipeline is None:
+                return image_url, self.save(image_url, destination)
+            return image_url, self.save(image_url, destination, pipeline)
 
-    def save(self, image_url, destination=None):
-        filename = image_url.split('/')[-1]
-        if image_url in self._cache:
+        if concurrency <= 1 or len(queue) <= 1:
+            for image_url in queue:
+                yield save(image_url)
             return
-        image_response = requests.get(image_url, stream=True)
+        if destination and not isinstance(destination, ArchiveJob):
+            self.ensure_dir(destination)
+        from multiprocessing.pool import ThreadPool
+
+        pool = ThreadPool(min(concurrency, len(queue)))
+        try:
+            for pair in pool.imap_unordered(save, queue):
+                yield pair
+        finally:
+            pool.close()
+            pool.join()
+
+    def save(self, image_url, destination=None, pipeline=None):
+        """
+        Saves image to `destination` and returns its filename.
+        Images, recorded in the destination's manifest, are not downloaded again.
+        With `store` images are saved to it once and linked to `destination`.
+        If `pipeline` is given, the image is submitted for processing.
+        """
+        filename = self._cache.get(image_url)
+        if filename is not None:
+            return filename
+        if isinstance(destination, ArchiveJob):
+            return self.save_to_archive(image_url, destination)
+        start = time()
         if destination:
             self.ensure_dir(destination)
-            filename = os.path.join(destination, filename)
-        self.logger.debug('Saving "%s" to "%s" ...', image_url, filename)
-        self.save_file(filename, image_response)
+        filename = get_filename(image_url, destination)
+        manifest = self.get_manifest(destination)
+        record = manifest.get(image_url, filename) if manifest is not None else None
+        if record is not None:
+            self.logger.debug('"%s" is already saved to "%s"', image_url, filename)
+            size, checksum = record['size'], record['sha256']
+            if pipeline is not None:
+                pipeline.submit(filename)
+        else:
+            self.logger.debug('Saving "%s" to "%s" ...', image_url, filename)
+            fetch = self.fetch if self.store is None else self.fetch_to_store
+            if pipeline is None:
+                size, checksum = self.retrying(lambda: fetch(image_url, filename), image_url)
+            else:
+                collector = ImageBuffer()
+
+                def fetch_collected():
+                    # Chunks of a failed attempt are dropped, a partial file is passed to the collector again
+                    del collector.chunks[:]
+                    return fetch(image_url, filename, collector)
+
+                size, checksum = self.retrying(fetch_collected, image_url)
+                pipeline.submit(filename, collector.getvalue())
+            if manifest is not None:
+                manifest.add(image_url, filename, size, checksum)
+        if self.store is not None:
+            self.store.remember(image_url, checksum)
+        self._cache[image_url] = filename
+        self.hooks.emit(
+            SAVE, image_url=image_url, filename=filename, size=size, elapsed=time() - start, skipped=record is not None
+        )
+        return filename
+
+    def save_to_archive(self, image_url, destination):
+        """
+        Streams image into the job's archive and returns its path in the archive.
+        Images, that are already in the archive, are not downloaded again.
+        """
+        start = time()
+        archive = destination.archive
+        name = destination.get_name(image_url)
+        skipped = name in archive
+        if skipped:
+            self.logger.debug('"%s" is already saved to "%s"', image_url, archive.path)
+        else:
+            self.logger.debug('Saving "%s" to "%s" ...', image_url, archive.path)
+            self.retrying(lambda: self.fetch_to_archive(image_url, archive, name), image_url)
+        filename = archive.get_path(name)
         self._cache[image_url] = filename
+        self.hooks.emit(
+            SAVE, image_url=image_url, filename=filename, size=archive.sizes[name], elapsed=time() - start,
+            skipped=skipped
+        )
+        return filename
+
+    def get_manifest(self, destination=None):
+        if not self.use_manifest:
+            return None
+        key = os.path.abspath(destination or os.curdir)
+        with self._lock:
+            if key not in self._manifests:
+                self._manifests[key] = Manifest(destination)
+            return self._manifests[key]
+
+    def fetch(self, image_url, filename, collector=None):
+        """
+        Streams image into a partial file and renames it to `filename` when it is complete.
+        Interrupted downloads are resumed with HTTP Range requests if the server supports them.
+        If `collector` is given, the whole image content is passed to its `update` method.
+        Returns size and SHA-256 checksum of the image.
+        """
+        partial = filename + PARTIAL_SUFFIX
+        offset = get_resume_offset(partial)
+        headers = get_resume_headers(partial, offset)
+        self.hooks.emit(REQUEST_START, method='GET', url=image_url)
+        start = time()
+        status = size = error = None
+        received = 0
+        try:
+            image_response = self.session.get(image_url, stream=True, timeout=self.request_timeout, headers=headers)
+            status = image_response.status_code
+            if offset and status in (206, 416) and not is_resumed_at(status, image_response.headers, offset):
+                # Nothing to resume or another part is sent, the image is downloaded again
+                image_response.close()
+                os.remove(partial)
+            else:
+                image_response.raise_for_status()
+                if status != 206:
+                    offset = 0
+                    write_validator(partial, get_validator(image_response.headers))
+                hasher = new_hasher()
+                if offset:
+                    hash_file(partial, hasher, self.chunk_size)
+                    if collector is not None:
+                        hash_file(partial, collector, self.chunk_size)
+                expected_size = get_expected_size(image_response.headers, offset)
+                received = self.save_file(partial, image_response, 'ab' if offset else 'wb', hasher, collector)
+                size = offset + received
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            self.hooks.emit(
+                REQUEST_END, method='GET', url=image_url, status=status, elapsed=time() - start, size=received,
+                error=error
+            )
+        if size is None:
+            self.hooks.emit(RETRY, reason='range', job_id=None, url=image_url, attempt=1, delay=0)
+            return self.fetch(image_url, filename, collector)
+        if expected_size is not None and size != expected_size:
+            raise IncompleteDownload('Got %s of %s bytes from "%s"' % (size, expected_size, image_url))
+        replace_file(partial, filename)
+        remove_file(partial + VALIDATOR_SUFFIX)
+        return size, hasher.hexdigest()
+
+    def fetch_to_store(self, image_url, filename, collector=None):
+        """
+        Streams image into a spool, while hashing it. The image is written to `store` only if it is not there yet,
+        then `filename` is linked to it. Returns size and SHA-256 checksum of the image.
+        """
+        self.hooks.emit(REQUEST_START, method='GET', url=image_url)
+        start = time()
+        status = error = None
+        received = 0
+        spool = self.store.spool()
+        try:
+            image_response = self.session.get(image_url, stream=True, timeout=self.request_timeout)
+            status = image_response.status_code
+            image_response.raise_for_status()
+            expected_size = get_expected_size(image_response.headers, 0)
+            hasher = new_hasher()
+            received = self.write_chunks(spool, image_response, hasher, collector)
+            if expected_size is not None and received != expected_size:
+                raise IncompleteDownload('Got %s of %s bytes from "%s"' % (received, expected_size, image_url))
+            checksum = hasher.hexdigest()
+            if not self.store.put(checksum, spool, received):
+                self.logger.debug('"%s" is already stored as %s', image_url, checksum)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            spool.close()
+            self.hooks.emit(
+                REQUEST_END, method='GET', url=image_url, status=status, elapsed=time() - start, size=received,
+                error=error
+            )
+        self.store.link(checksum, filename)
+        return received, checksum
+
+    def fetch_to_archive(self, image_url, archive, name):
+        """
+        Streams image into a new archive entry. Returns size and SHA-256 checksum of the image.
+        """
+        self.hooks.emit(REQUEST_START, method='GET', url=image_url)
+        start = time()
+        status = error = None
+        received = [0]
+        hasher = new_hasher()
+        try:
+            image_response = self.session.get(image_url, stream=True, timeout=self.request_timeout)
+            status = image_response.status_code
+            image_response.raise_for_status()
+            expected_size = get_expected_size(image_response.headers, 0)
+
+            def iter_chunks():
+                for chunk in image_response.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        received[0] += len(chunk)
+                        hasher.update(chunk)
+                        yield chunk
+                if expected_size is not None and received[0] != expected_size:
+                    raise IncompleteDownload(
+                        'Got %s of %s bytes from "%s"' % (received[0], expected_size, image_url)
+                    )
+
+            archive.write(name, iter_chunks(), expected_size)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            self.hooks.emit(
+                REQUEST_END, method='GET', url=image_url, status=status, elapsed=time() - start, size=received[0],
+                error=error
+            )
+        return received[0], hasher.hexdigest()
 
     def ensure_dir(self, destination):
         """
         Checks, that `destination` exists.
         """
-        try:
-            os.makedirs(destination)
-        except OSError:
-            pass
+        ensure_dir(destination)
+
+    def save_file(self, filename, content, mode='wb', hasher=None, collector=None):
+        """
+        Saves file on local filesystem. Returns number of written bytes.
+        """
+        with open(filename, mode) as f:
+            return self.write_chunks(f, content, hasher, collector)
 
-    def save_file(self, filename, content):
+    def write_chunks(self, f, content, hasher=None, collector=None):
         """
-        Saves file on local filesystem.
+        Writes streamed content to a file object. Returns number of written bytes.
         """
-        with open(filename, 'wb') as f:
-            for chunk in content.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
+        size = 0
+        for chunk in content.iter_content(chunk_size=self.chunk_size):
+            if chunk:
+                f.write(chunk)
+                size += len(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                if collector is not None:
+                    collector.update(chunk)
+        return size
@@ -0,0 +1,50 @@
+# coding: utf-8
+
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_REQUEST_TIMEOUT = (10, 60)
+
+
+def make_session(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False,
+                 keep_alive=True):
+    """
+    Creates `requests` session with a connection pool, shared by API calls and image downloads.
+    `pool_connections` is the number of hosts to keep pools for, `pool_maxsize` is the number of connections per host.
+    """
+    # `requests` is slow to import, so it is loaded only when it is needed
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def get_pool_stats(session):
+    """
+    Returns connection reuse counters for all live pools of the session.
+    Every request, that didn't open a new connection, is counted as a hit.
+    """
+    stats = {'pools': 0, 'requests': 0, 'hits': 0, 'misses': 0}
+    adapters = []
+    for adapter in session.adapters.values():
+        if adapter not in adapters:
+            adapters.append(adapter)
+    for adapter in adapters:
+        manager = getattr(adapter, 'poolmanager', None)
+        if manager is None:
+            continue
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            stats['pools'] += 1
+            stats['requests'] += pool.num_requests
+            stats['misses'] += pool.num_connections
+    stats['hits'] = max(stats['requests'] - stats['misses'], 0)
+    return stats
@@ -0,0 +1,164 @@
+# coding: utf-8
+"""
+Content-addressed storage of screenshots. Every distinct image is stored once under its SHA-256 digest and
+destinations get hard links (or symlinks, or copies) to it.
+
+    root/
+        objects/3f/3fa4...e1    - image content
+        refs.jsonl              - job_id, key, image_url, digest, size and path of every saved screenshot
+
+Images are kept in memory (up to `spool_size`) while they are downloaded and hashed, so duplicates are never written.
+Files in destinations share content with the store, they should be replaced rather than modified in place.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from ._compat import replace_file
+from .catalog import get_key
+
+
+DEFAULT_SPOOL_SIZE = 16 * 1024 * 1024
+HARDLINK = 'hardlink'
+SYMLINK = 'symlink'
+COPY = 'copy'
+LINK_MODES = (HARDLINK, SYMLINK, COPY)
+REFS_NAME = 'refs.jsonl'
+
+
+class ContentStore(object):
+    """
+    Directory of images, addressed by their digests, with a journal of references to them.
+    If hard links are not supported, images are copied.
+    """
+
+    def __init__(self, root, link=HARDLINK, spool_size=DEFAULT_SPOOL_SIZE):
+        if link not in LINK_MODES:
+            raise ValueError('Unknown link mode: %s. Use one of %s' % (link, ', '.join(LINK_MODES)))
+        self.root = root
+        self.link_mode = link
+        self.spool_size = spool_size
+        self.refs_path = os.path.join(root, REFS_NAME)
+        self.refs = {}
+        self.digests = {}
+        self.stats = {'stored': 0, 'deduplicated': 0, 'bytes_stored': 0, 'bytes_deduplicated': 0}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            f = open(self.refs_path)
+        except IOError:
+            return
+        with f:
+            for line in f:
+                try:
+                    ref = json.loads(line)
+                except ValueError:
+                    # Partially written line
+                    continue
+                self.refs[(ref['job_id'], ref['image_url'])] = ref
+                self.digests[ref['image_url']] = ref['digest']
+
+    def get_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def __contains__(self, digest):
+        return os.path.exists(self.get_path(digest))
+
+    def spool(self):
+        """
+        Buffer for a downloaded image. It is kept in memory until it grows over `spool_size`.
+        """
+        return tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+
+    def put(self, digest, spool, size):
+        """
+        Stores content of the spool unless an image with the same digest is already stored.
+        Returns True if the image is new.
+        """
+        path = self.get_path(digest)
+        if os.path.exists(path):
+            self.count('deduplicated', size)
+            return False
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            spool.seek(0)
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(spool, f)
+            replace_file(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.count('stored', size)
+        return True
+
+    def count(self, name, size):
+        with self.lock:
+            self.stats[name] += 1
+            self.stats['bytes_' + name] += size
+
+    def link(self, digest, filename):
+        """
+        Makes `filename` point to the stored image. Existing file is replaced atomically.
+        """
+        path = self.get_path(digest)
+        try:
+            if os.path.samefile(path, filename):
+                return
+        except OSError:
+            pass
+        temp_path = filename + '.link'
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        if self.link_mode == SYMLINK:
+            os.symlink(os.path.abspath(path), temp_path)
+        elif self.link_mode == HARDLINK and hasattr(os, 'link'):
+            try:
+                os.link(path, temp_path)
+            except OSError:
+                # Different devices or no hard links support
+                shutil.copyfile(path, temp_path)
+        else:
+            shutil.copyfile(path, temp_path)
+        replace_file(temp_path, filename)
+
+    def remember(self, image_url, digest):
+        self.digests[image_url] = digest
+
+    def add_ref(self, job_id, screenshot, filename):
+        """
+        Records, that the job's screenshot is saved to `filename`. Returns the reference or None if the image's
+        digest is unknown.
+        """
+        image_url = screenshot['image_url']
+        digest = self.digests.get(image_url)
+        if digest is None:
+            return None
+        ref = {
+            'job_id': job_id,
+            'key': get_key(screenshot),
+            'image_url': image_url,
+            'digest': digest,
+            'size': os.path.getsize(self.get_path(digest)) if digest in self else None,
+            'path': filename,
+        }
+        with self.lock:
+            if self.refs.get((job_id, image_url)) == ref:
+                return ref
+            self.refs[(job_id, image_url)] = ref
+            try:
+                os.makedirs(self.root)
+            except OSError:
+                pass
+            with open(self.refs_path, 'a') as f:
+                f.write(json.dumps(ref, sort_keys=True) + '\n')
+        return ref
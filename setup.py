@@ -89,6 +89,11 @@ setup(
     cmdclass={'test': PyTest},
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        'async': ['aiohttp>=3.0'],
+        'images': ['Pillow'],
+        'diff': ['numpy', 'Pillow'],
+    },
     tests_require=test_requirements,
     entry_points=entry_points,
 )
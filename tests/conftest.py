@@ -1,13 +1,18 @@
 # coding: utf-8
 import os
+import sys
 
 import pytest
 
+from browserstacker.fake import FakeBrowserStack
 from browserstacker.screenshots import ScreenShotsAPI
 
 from ._compat import builtins, mock_open, patch, Mock
 
 
+collect_ignore = ['test_aio.py'] if sys.version_info < (3, 5) else []
+
+
 def _make_mock(request, name, return_value):
     mock = patch(name, return_value)
     mock.start()
@@ -17,12 +22,13 @@ def _make_mock(request, name, return_value):
 
 @pytest.fixture
 def mocked_request(request):
-    return _make_mock(request, 'browserstacker.screenshots.requests.request', Mock())
+    response = Mock(status_code=200, headers={})
+    return _make_mock(request, 'requests.Session.request', Mock(return_value=response))
 
 
 @pytest.fixture
 def mocked_get(request):
-    return _make_mock(request, 'browserstacker.screenshots.requests.get', Mock())
+    return _make_mock(request, 'requests.Session.get', Mock())
 
 
 @pytest.fixture(autouse=True)
@@ -30,6 +36,54 @@ def sleep(request):
     return _make_mock(request, 'browserstacker.screenshots.sleep', Mock())
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmpdir):
+    monkeypatch.setenv('BROWSERSTACKER_CACHE_DIR', str(tmpdir.join('cache')))
+    return tmpdir.join('cache')
+
+
+@pytest.yield_fixture
+def clock():
+    """
+    Fake time, that advances only on `sleep` calls.
+    """
+    with patch('browserstacker.scheduler.sleep') as sleep, patch('browserstacker.scheduler.time') as time, \
+            patch('browserstacker.polling.time', time):
+        time.return_value = 0
+        sleep.side_effect = lambda delay: setattr(time, 'return_value', time.return_value + delay)
+        yield time
+
+
+@pytest.fixture
+def fake_options():
+    """
+    Arguments of `FakeBrowserStack` for `fake_server`. Test modules override it.
+    """
+    return {'image_size': 1024}
+
+
+@pytest.fixture
+def api_options():
+    """
+    Arguments of `ScreenShotsAPI` for `fake_api`. Test modules override it.
+    """
+    return {}
+
+
+@pytest.yield_fixture
+def fake_server(fake_options):
+    with FakeBrowserStack(**fake_options) as server:
+        yield server
+
+
+@pytest.yield_fixture
+def fake_api(fake_server, api_options):
+    api = ScreenShotsAPI(**dict({'user': 'user', 'key': 'key'}, **api_options))
+    api.root_url = fake_server.url
+    yield api
+    api.close()
+
+
 @pytest.fixture
 def browsers_response(mocked_request):
     mocked_request().json.return_value = BROWSERS_RESPONSE
@@ -46,11 +100,19 @@ def mocked_image_response():
 
     class MockedContent:
         content = b'test'
+        status_code = 200
+        headers = {}
 
         def iter_content(self, chunk_size=1024):
             for chunk in (self.content, None):
                 yield chunk
 
+        def raise_for_status(self):
+            pass
+
+        def close(self):
+            pass
+
     return MockedContent()
 
 
@@ -65,7 +127,15 @@ def test_dir_name():
 
 
 @pytest.fixture
-def mocked_open(request):
+def mocked_replace(request):
+    return _make_mock(request, 'browserstacker.screenshots.replace_file', Mock())
+
+
+@pytest.fixture
+def mocked_open(request, mocked_replace):
+    """
+    Nothing is written to disk, so partial files are not renamed either.
+    """
     mock = patch.object(builtins, 'open', mock_open())
     mock.start()
     request.addfinalizer(mock.stop)
@@ -0,0 +1,158 @@
+# coding: utf-8
+import pytest
+
+from browserstacker import ScreenShotsAPI
+from browserstacker.accounts import CredentialPool, parse_credentials
+from browserstacker.fake import DEFAULT_BROWSERS
+from browserstacker.scheduler import JobScheduler
+from browserstacker.screenshots import ParallelLimitReached
+
+from ._compat import patch
+
+
+CREDENTIALS = [('user1', 'key1'), ('user2', 'key2')]
+
+
+@pytest.fixture
+def fake_options():
+    return {'browsers': DEFAULT_BROWSERS[:1], 'image_size': 128, 'credentials': CREDENTIALS, 'parallel_limit': 2}
+
+
+@pytest.fixture
+def pool():
+    return CredentialPool(CREDENTIALS, retry_delay=60)
+
+
+@pytest.fixture
+def api_options(pool):
+    return {'user': 'user1', 'key': 'key1', 'credential_pool': pool}
+
+
+def test_parse_credentials():
+    assert parse_credentials(['# accounts', 'user1:key1', '', ' user2 : key2 \n']) == CREDENTIALS
+    with pytest.raises(ValueError):
+        parse_credentials(['user1'])
+
+
+def test_empty_pool():
+    with pytest.raises(ValueError):
+        CredentialPool([])
+
+
+def test_routing(fake_server, fake_api, pool):
+    fake_server.render_time = 60
+    jobs = [fake_api.generate('http://www.example.com', fake_server.browsers)['job_id'] for _ in range(4)]
+    owners = [pool.get_owner(job_id).user for job_id in jobs]
+    # The least loaded account is used first
+    assert owners == ['user1', 'user2', 'user1', 'user2']
+    with pytest.raises(ParallelLimitReached):
+        fake_api.generate('http://www.example.com', fake_server.browsers)
+    # Limits are learned from rejections
+    assert [account['parallel_limit'] for account in fake_api.utilization()] == [2, 2]
+    assert [account['utilization'] for account in fake_api.utilization()] == [1.0, 1.0]
+    assert fake_server.stats['rejected'] == 2
+    # Jobs are listed with credentials of their owners
+    assert [fake_api.list(job_id)['id'] for job_id in jobs] == jobs
+    for screenshot in fake_server.jobs[jobs[1]].screenshots:
+        screenshot['ready_at'] = 0
+    fake_api.release_job(job_id=jobs[1])
+    job_id = fake_api.generate('http://www.example.com', fake_server.browsers)['job_id']
+    assert pool.get_owner(job_id).user == 'user2'
+
+
+def test_busy_account(fake_server, fake_api, pool):
+    fake_server.render_time = 60
+    # Slots of the first account are taken by someone else
+    other = ScreenShotsAPI('user1', 'key1')
+    other.root_url = fake_server.url
+    for _ in range(2):
+        other.generate('http://www.example.com', fake_server.browsers)
+    other.close()
+    job_id = fake_api.generate('http://www.example.com', fake_server.browsers)['job_id']
+    assert pool.get_owner(job_id).user == 'user2'
+    user1 = pool.accounts[0]
+    assert user1.parallel_limit is None
+    assert not user1.has_capacity(0)
+    assert user1.rejected == 1
+
+
+def test_limit_is_probed():
+    pool = CredentialPool([('user', 'key')], retry_delay=5)
+    with patch('browserstacker.accounts.time') as time:
+        time.return_value = 0
+        pool.assign(pool.acquire(), 'first')
+        account = pool.acquire()
+        pool.reject(account)
+        assert account.parallel_limit == 1
+        assert pool.acquire() is None
+        # Another client's job is finished
+        time.return_value = 5
+        assert pool.acquire() is account
+        # One job over the limit at a time
+        assert pool.acquire() is None
+        pool.assign(account, 'second')
+        assert account.parallel_limit == 2
+
+def test_download(fake_server, fake_api, pool, tmpdir):
+    results = fake_api.make('http://www.example.com', fake_server.browsers, str(tmpdir))
+    assert len(results) == 1
+    assert [account['running'] for account in fake_api.utilization()] == [0, 0]
+    assert [account['generated'] for account in fake_api.utilization()] == [1, 0]
+
+
+def test_scheduler(fake_server, fake_api, tmpdir, sleep):
+    fake_server.render_time = 0.05
+    scheduler = JobScheduler(fake_api, timeout=0.01)
+    for index in range(6):
+        destination = str(tmpdir.join(str(index)))
+        scheduler.add('http://www.example.com/%s' % index, fake_server.browsers, destination=destination)
+    jobs = list(scheduler.iter_run())
+    assert [job.status for job in jobs] == ['done'] * 6
+    assert sum(account['generated'] for account in fake_api.utilization()) == 6
+    assert all(account['generated'] for account in fake_api.utilization())
+
+
+def test_cli(isolated_cli_runner, monkeypatch, fake_server):
+    from browserstacker.cli import cli
+    from browserstacker.cli.helpers import APIWrapper
+
+    monkeypatch.setattr(APIWrapper, 'root_url', fake_server.url)
+    with open('credentials', 'w') as f:
+        f.write('user2:key2\n')
+    result = isolated_cli_runner.invoke(
+        cli, ['-u', 'user1', '-k', 'key1', '--credentials-file', 'credentials', 'make', 'http://www.example.com'],
+        catch_exceptions=False
+    )
+    assert not result.exception
+    assert fake_server.stats['rejected'] == 0
+
+
+@pytest.mark.parametrize('options', (
+    ['-u', 'user1', '-k', 'key1', '-u', 'user2'],
+    ['--credentials-file', 'credentials'],
+))
+def test_cli_invalid_credentials(isolated_cli_runner, options):
+    from browserstacker.cli import cli
+
+    with open('credentials', 'w') as f:
+        f.write('# nothing\n')
+    result = isolated_cli_runner.invoke(cli, options + ['list', 'job'])
+    assert result.exit_code == 2
+
+
+def test_memo_adopts_owner(fake_server, fake_api, pool, tmpdir):
+    from browserstacker.cache import JobMemo
+
+    fake_server.render_time = 60
+    path = str(tmpdir.join('memo.json'))
+    fake_api.memo = JobMemo(path=path)
+    fake_api.generate('http://www.example.com', fake_server.browsers)
+    job_id = fake_api.generate('http://www.example.org', fake_server.browsers)['job_id']
+    assert pool.get_owner(job_id).user == 'user2'
+    other_pool = CredentialPool(CREDENTIALS)
+    other = ScreenShotsAPI('user1', 'key1', credential_pool=other_pool, memo=JobMemo(path=path))
+    other.root_url = fake_server.url
+    assert other.generate('http://www.example.org', fake_server.browsers)['job_id'] == job_id
+    assert other_pool.get_owner(job_id).user == 'user2'
+    assert other.list(job_id)['id'] == job_id
+    other.close()
@@ -0,0 +1,212 @@
+# coding: utf-8
+import asyncio
+import os
+import threading
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from browserstacker.aio import AsyncScreenShotsAPI
+from browserstacker.cache import CatalogCache
+from browserstacker.callbacks import CallbackReceiver
+from browserstacker.metrics import MetricsCollector
+from browserstacker.screenshots import AuthError, ParallelLimitReached
+from .conftest import BROWSERS_RESPONSE
+
+
+JOB_ID = '123'
+IMAGE_CONTENT = b'test' * 1000
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+async def make_server(requests_log, generate_response=None, states=('done', )):
+    states = list(states)
+    payloads = []
+
+    async def browsers(request):
+        requests_log.append(request)
+        return web.json_response(BROWSERS_RESPONSE)
+
+    async def generate(request):
+        requests_log.append(request)
+        payloads.append(await request.json())
+        return web.json_response(generate_response or {'job_id': JOB_ID})
+
+    async def job(request):
+        requests_log.append(request)
+        state = states.pop(0) if len(states) > 1 else states[0]
+        first, second = [str(request.url.with_path('/images/%s.png' % name)) for name in ('first', 'second')]
+        return web.json_response({
+            'screenshots': [
+                {'state': 'done', 'image_url': first},
+                {'state': state, 'image_url': second if state == 'done' else None},
+                {'state': 'done', 'image_url': first},
+            ]
+        })
+
+    async def image(request):
+        requests_log.append(request)
+        return web.Response(body=IMAGE_CONTENT)
+
+    app = web.Application()
+    app.router.add_get('/screenshots/browsers.json', browsers)
+    app.router.add_post('/screenshots', generate)
+    app.router.add_get('/screenshots/{job_id}.json', job)
+    app.router.add_get('/images/{name}', image)
+    server = TestServer(app)
+    server.payloads = payloads
+    await server.start_server()
+    return server
+
+
+async def with_api(server, callback):
+    async with AsyncScreenShotsAPI('user', 'key') as api:
+        api.root_url = str(server.make_url('/'))
+        try:
+            return await callback(api)
+        finally:
+            await server.close()
+
+
+@pytest.mark.parametrize('filters, expected', (
+    ({}, BROWSERS_RESPONSE),
+    ({'os': 'windows', 'browser': ['safari', 'firefox']}, BROWSERS_RESPONSE[:2]),
+))
+def test_browsers(filters, expected):
+    requests_log = []
+
+    async def test():
+        server = await make_server(requests_log)
+        return await with_api(server, lambda api: api.browsers(**filters))
+
+    assert run(test()) == expected
+    assert requests_log[0].headers['Authorization'] == 'Basic dXNlcjprZXk='
+
+
+@pytest.mark.parametrize('response, exception', (
+    ({'message': 'Parallel limit reached'}, ParallelLimitReached),
+    ({'error': 'Sign up or sign in'}, AuthError),
+))
+def test_generate_errors(response, exception):
+
+    async def test():
+        server = await make_server([], generate_response=response)
+        return await with_api(server, lambda api: api.generate('http://www.example.com'))
+
+    with pytest.raises(exception):
+        run(test())
+
+
+def test_make(tmpdir):
+    requests_log = []
+    destination = str(tmpdir)
+
+    async def test():
+        server = await make_server(requests_log, states=('processing', 'done'))
+
+        async def make(api):
+            metrics = MetricsCollector(api.hooks)
+            result = await api.make('http://www.example.com', timeout=0, destination=destination, concurrency=2)
+            return result, server.payloads[0], metrics
+
+        return await with_api(server, make)
+
+    result, payload, metrics = run(test())
+    assert payload == {'url': 'http://www.example.com', 'browsers': [AsyncScreenShotsAPI.default_browser]}
+    assert sorted(os.path.basename(path) for path in result.values()) == ['first.png', 'second.png']
+    for path in result.values():
+        with open(path, 'rb') as fd:
+            assert fd.read() == IMAGE_CONTENT
+    image_requests = [request for request in requests_log if request.path.startswith('/images/')]
+    assert len(image_requests) == 2
+    assert metrics.get('jobs_total') == 1
+    assert metrics.get('polls_total') == 2
+    assert metrics.get('images_total', status='saved') == 2
+
+
+def test_browsers_cached(tmpdir):
+    requests_log = []
+
+    async def test():
+        server = await make_server(requests_log)
+        async with AsyncScreenShotsAPI('user', 'key', catalog_cache=CatalogCache(str(tmpdir.join('b.json')))) as api:
+            api.root_url = str(server.make_url('/'))
+            try:
+                return [await api.browsers(), await api.browsers(os='ios'), await api.browsers(offline=True)]
+            finally:
+                await server.close()
+
+    assert run(test()) == [BROWSERS_RESPONSE, BROWSERS_RESPONSE[4:6], BROWSERS_RESPONSE]
+    assert len(requests_log) == 1
+
+
+def test_make_with_callback(tmpdir):
+    requests_log = []
+    destination = str(tmpdir)
+
+    async def test():
+        server = await make_server(requests_log)
+        with CallbackReceiver(timeout=5) as receiver:
+            async with AsyncScreenShotsAPI('user', 'key', callback_receiver=receiver) as api:
+                api.root_url = str(server.make_url('/'))
+                # Only the job id of a callback is used
+                payload = {
+                    'job_id': JOB_ID, 'screenshots': [{'state': 'done', 'image_url': 'http://example.com/x.png'}]
+                }
+                asyncio.get_event_loop().call_later(0.05, receiver.notify, payload)
+                try:
+                    result = await api.make('http://www.example.com', timeout=60, destination=destination)
+                finally:
+                    await server.close()
+                return result, server.payloads[0]['callback_url'], receiver.url
+
+    result, callback_url, receiver_url = run(test())
+    image_urls = [str(request.url) for request in requests_log if request.path.startswith('/images/')]
+    assert sorted(result) == sorted(image_urls)
+    assert callback_url == receiver_url
+    assert [request.path for request in requests_log] == [
+        '/screenshots', '/screenshots/%s.json' % JOB_ID, '/images/first.png', '/images/second.png'
+    ]
+
+
+def test_save_file_in_executor(monkeypatch, tmpdir):
+    threads = []
+
+    class File(object):
+
+        def __init__(self, filename, mode):
+            self.file = open(filename, mode)
+
+        def write(self, chunk):
+            threads.append(threading.current_thread())
+            self.file.write(chunk)
+
+        def close(self):
+            self.file.close()
+
+    class Content(object):
+
+        async def iter_chunked(self, size):
+            for chunk in (b'first', b'second'):
+                yield chunk
+
+    class Response(object):
+        content = Content()
+
+    monkeypatch.setattr('browserstacker.aio.open', File, raising=False)
+    filename = str(tmpdir.join('image.png'))
+
+    async def test():
+        async with AsyncScreenShotsAPI('user', 'key') as api:
+            return await api.save_file(filename, Response())
+
+    assert run(test()) == 11
+    assert tmpdir.join('image.png').read_binary() == b'firstsecond'
+    # Writes don't block the event loop
+    assert threads and threading.main_thread() not in threads
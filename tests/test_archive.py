@@ -0,0 +1,120 @@
+# coding: utf-8
+import json
+import tarfile
+import zipfile
+
+import pytest
+
+from browserstacker.archive import ChunkReader, open_archive
+from browserstacker.fake import DEFAULT_BROWSERS
+
+
+def get_names(path):
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            return archive.namelist()
+    archive = tarfile.open(path)
+    try:
+        return archive.getnames()
+    finally:
+        archive.close()
+
+
+def read(path, name):
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            return archive.read(name)
+    archive = tarfile.open(path)
+    try:
+        return archive.extractfile(name).read()
+    finally:
+        archive.close()
+
+
+@pytest.fixture
+def fake_options():
+    return {'browsers': DEFAULT_BROWSERS[:3], 'image_size': 4096}
+
+
+@pytest.fixture(params=['zip', 'tar'])
+def path(request, tmpdir):
+    return str(tmpdir.join('screenshots.%s' % request.param))
+
+
+def test_chunk_reader():
+    reader = ChunkReader([b'ab', b'cde', b'f'])
+    assert reader.read(3) == b'abc'
+    assert reader.read(1) == b'd'
+    assert reader.read() == b'ef'
+    assert reader.read(1) == b''
+
+
+def test_unsupported():
+    with pytest.raises(ValueError):
+        open_archive('screenshots.tar.gz')
+
+
+@pytest.mark.parametrize('concurrency', (1, 3))
+def test_make(fake_api, fake_server, path, concurrency):
+    with open_archive(path) as archive:
+        result = fake_api.make('http://www.example.com', fake_server.browsers, archive, concurrency=concurrency)
+    job_id = list(fake_server.jobs)[0]
+    assert len(result) == 3
+    for filename in result.values():
+        assert filename.startswith(path + '/%s/' % job_id)
+    names = get_names(path)
+    assert len(names) == 4
+    index = json.loads(read(path, '%s.index.json' % job_id).decode('utf-8'))
+    assert sorted(entry['name'] for entry in index.values()) == sorted(name for name in names if '.index' not in name)
+    for entry in index.values():
+        assert read(path, entry['name']) == fake_server.image
+        assert entry['size'] == len(fake_server.image)
+
+
+def test_append(fake_api, fake_server, path):
+    with open_archive(path) as archive:
+        job_id = fake_api.generate('http://www.example.com', fake_server.browsers)['job_id']
+        fake_api.download(job_id, archive)
+    # Already saved images are not downloaded again
+    with open_archive(path) as archive:
+        fake_api.download(job_id, archive)
+        other = fake_api.make('http://www.example.org', fake_server.browsers[:1], archive)
+    assert fake_server.stats['images'] == 4
+    names = get_names(path)
+    assert len([name for name in names if name.startswith(job_id + '/')]) == 3
+    assert len(set(names)) == 6
+    other_id = list(other.values())[0].split('/')[-2]
+    assert len(json.loads(read(path, '%s.index.json' % other_id).decode('utf-8'))) == 1
+
+
+def test_partial_entry(fake_api, fake_server, path):
+    # The first image is cut off, its entry is removed and the image is fetched again
+    fake_server.fail(1, None, path='/images/')
+    with open_archive(path) as archive:
+        result = fake_api.make('http://www.example.com', fake_server.browsers[:1], archive)
+    assert len(result) == 1
+    names = get_names(path)
+    assert len(names) == 2
+    assert read(path, [name for name in names if '.index' not in name][0]) == fake_server.image
+
+
+def test_pipeline(fake_api, path):
+    with open_archive(path) as archive:
+        with pytest.raises(ValueError):
+            list(fake_api.iter_download('job', archive, pipeline=object()))
+
+
+def test_cli(isolated_cli_runner, monkeypatch, fake_server):
+    from browserstacker.cli import cli
+    from browserstacker.cli.helpers import APIWrapper
+
+    monkeypatch.setattr(APIWrapper, 'root_url', fake_server.url)
+    result = isolated_cli_runner.invoke(
+        cli, ['make', 'http://www.example.com', '--archive', 'out.zip'], catch_exceptions=False
+    )
+    assert not result.exception
+    assert len(get_names('out.zip')) == 2  # Image and index
+    result = isolated_cli_runner.invoke(cli, ['make', 'http://www.example.com', '--archive', 'out.rar'])
+    assert result.exit_code == 2
+    result = isolated_cli_runner.invoke(cli, ['download', 'job', '--archive', 'out.zip', '-ds', 'out'])
+    assert result.exit_code == 2
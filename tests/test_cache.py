@@ -0,0 +1,171 @@
+# coding: utf-8
+import json
+
+import pytest
+
+from browserstacker import ScreenShotsAPI
+from browserstacker.cache import CatalogCache, CatalogUnavailable, JobMemo, get_job_key
+from browserstacker.fake import FakeBrowserStack
+
+from ._compat import Mock, patch
+from .conftest import BROWSERS_RESPONSE
+
+
+@pytest.fixture
+def catalog_cache(cache_dir):
+    return CatalogCache(str(cache_dir.join('browsers.json')), ttl=60)
+
+
+@pytest.fixture
+def cached_api(catalog_cache):
+    return ScreenShotsAPI(None, None, catalog_cache=catalog_cache)
+
+
+def test_store(catalog_cache, cache_dir):
+    catalog_cache.store(BROWSERS_RESPONSE, {'ETag': '"abc"'})
+    with open(str(cache_dir.join('browsers.json'))) as f:
+        entry = json.load(f)
+    assert entry['browsers'] == BROWSERS_RESPONSE
+    assert entry['etag'] == '"abc"'
+    assert catalog_cache.get() == BROWSERS_RESPONSE
+    assert catalog_cache.get_validators() == {'If-None-Match': '"abc"'}
+
+
+def test_shared_between_instances(catalog_cache):
+    other = CatalogCache(catalog_cache.path)
+    assert other.get() is None
+    catalog_cache.store(BROWSERS_RESPONSE, {'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+    assert other.get() == BROWSERS_RESPONSE
+    assert other.get_validators() == {'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+
+
+def test_expired(catalog_cache):
+    catalog_cache.store(BROWSERS_RESPONSE, {})
+    with patch('browserstacker.cache.time') as time:
+        time.return_value = catalog_cache.load()['fetched_at'] + 61
+        assert catalog_cache.get() is None
+        assert catalog_cache.get(offline=True) == BROWSERS_RESPONSE
+
+
+def test_refresh(catalog_cache):
+    catalog_cache.store(BROWSERS_RESPONSE, {})
+    assert catalog_cache.get(refresh=True) is None
+
+
+def test_offline_without_cache(catalog_cache):
+    with pytest.raises(CatalogUnavailable):
+        catalog_cache.get(offline=True)
+
+
+def test_corrupted_file(catalog_cache, cache_dir):
+    cache_dir.ensure(dir=True)
+    cache_dir.join('browsers.json').write('{')
+    assert catalog_cache.get() is None
+
+
+def test_browsers_cached(cached_api, browsers_response):
+    browsers_response().headers = {'ETag': '"abc"'}
+    assert cached_api.browsers(os='Windows') == BROWSERS_RESPONSE[:2]
+    assert cached_api.browsers() == BROWSERS_RESPONSE
+    assert len([call for call in browsers_response.call_args_list if call[0]]) == 1
+    browsers_response.assert_called_with(
+        'GET',
+        'https://www.browserstack.com/screenshots/browsers.json',
+        auth=cached_api.auth,
+        timeout=cached_api.request_timeout,
+        headers={}
+    )
+
+
+def test_browsers_not_modified(cached_api, catalog_cache, browsers_response):
+    catalog_cache.store(BROWSERS_RESPONSE, {'ETag': '"abc"'})
+    browsers_response().status_code = 304
+    browsers_response().json.side_effect = ValueError
+    assert cached_api.browsers(refresh=True) == BROWSERS_RESPONSE
+    assert browsers_response.call_args[1]['headers'] == {'If-None-Match': '"abc"'}
+
+
+def test_browsers_not_modified_without_entry(cached_api, catalog_cache, browsers_response):
+    assert catalog_cache.revalidate() is None
+    not_modified = Mock(status_code=304, headers={})
+    not_modified.json.side_effect = ValueError
+    browsers_response.side_effect = [not_modified, browsers_response.return_value]
+    # The cache file is removed after the conditional request was sent
+    assert cached_api.browsers(refresh=True) == BROWSERS_RESPONSE
+    assert browsers_response.call_args[1]['headers'] == {}
+    assert catalog_cache.get() == BROWSERS_RESPONSE
+
+def test_browsers_offline(screenshots_api, cached_api, catalog_cache, mocked_request):
+    with pytest.raises(CatalogUnavailable):
+        screenshots_api.browsers(offline=True)
+    catalog_cache.store(BROWSERS_RESPONSE, {})
+    assert cached_api.browsers(offline=True, os='ios') == BROWSERS_RESPONSE[4:6]
+    assert not mocked_request.called
+
+
+def make_payload(**options):
+    browsers = [
+        {'os': 'Windows', 'os_version': '10', 'browser': 'chrome', 'browser_version': '50.0', 'device': None},
+        {'os': 'ios', 'os_version': '9.1', 'browser': 'Mobile Safari', 'device': 'iPhone 6S'},
+    ]
+    return dict(options, url='http://www.example.com', browsers=browsers)
+
+
+def test_job_key():
+    payload = make_payload(quality='Original')
+    same = make_payload(quality='Original', callback_url='http://callback.example.com', orientation=None)
+    same['browsers'] = [dict(browser, os=browser['os'].upper()) for browser in reversed(same['browsers'])]
+    assert get_job_key(payload) == get_job_key(same)
+    assert get_job_key(payload) != get_job_key(make_payload(quality='Compressed'))
+    assert get_job_key(payload) != get_job_key(dict(payload, browsers=payload['browsers'][:1]))
+
+
+def test_memo_ttl():
+    memo = JobMemo(ttl=60, maxsize=2)
+    with patch('browserstacker.cache.time') as time:
+        time.return_value = 0
+        memo.add_job(make_payload(), {'job_id': '1'})
+        memo.add_job(make_payload(quality='Original'), {'job_id': '2'})
+        time.return_value = 59
+        assert memo.get_job(make_payload()) == {'job_id': '1'}
+        memo.add_job(make_payload(quality='Compressed'), {'job_id': '3'})
+        # Evicted, as the least recently used
+        assert memo.get_job(make_payload(quality='Original')) is None
+        time.return_value = 60
+        assert memo.get_job(make_payload()) is None
+
+
+def test_memo_shared(tmpdir):
+    path = str(tmpdir.join('jobs.json'))
+    first, second = JobMemo(path=path), JobMemo(path=path)
+    first.add_job(make_payload(), {'job_id': '1'})
+    second.add_job(make_payload(quality='Original'), {'job_id': '2'})
+    assert first.get_job(make_payload(quality='Original')) == {'job_id': '2'}
+    assert JobMemo(path=path).get_job(make_payload()) == {'job_id': '1'}
+    first.clear()
+    assert JobMemo(path=path).get_job(make_payload()) is None
+
+
+def test_memo_results(tmpdir):
+    memo = JobMemo()
+    filename = tmpdir.join('image.png')
+    filename.write(b'image')
+    memo.add_results('1', str(tmpdir), {'http://example.com/image.png': str(filename)})
+    assert memo.get_results('1', str(tmpdir)) == {'http://example.com/image.png': str(filename)}
+    assert memo.get_results('1') is None
+    filename.remove()
+    assert memo.get_results('1', str(tmpdir)) is None
+
+
+def test_memo_api(tmpdir):
+    with FakeBrowserStack(image_size=128) as server:
+        api = ScreenShotsAPI('user', 'key', memo=JobMemo())
+        api.root_url = server.url
+        destination = str(tmpdir.join('screenshots'))
+        result = api.make('http://www.example.com', server.browsers[:2], destination)
+        stats = dict(server.stats)
+        assert api.make('http://www.example.com', server.browsers[1::-1], destination) == result
+        assert server.stats == stats
+        api.make('http://www.example.com', server.browsers[:2], destination, quality='Original')
+        api.close()
+    assert server.stats['jobs'] == 2
@@ -0,0 +1,80 @@
+# coding: utf-8
+import threading
+
+import pytest
+import requests
+
+from browserstacker.callbacks import CallbackReceiver
+from browserstacker.fake import DEFAULT_BROWSERS
+from browserstacker.metrics import MetricsCollector
+
+
+@pytest.yield_fixture
+def receiver():
+    with CallbackReceiver(timeout=5) as receiver:
+        yield receiver
+
+
+@pytest.fixture
+def fake_options():
+    return {'image_size': 1024, 'render_time': 0.2}
+
+
+@pytest.fixture
+def api_options(receiver):
+    return {'callback_receiver': receiver}
+
+
+def test_wait(receiver):
+    threading.Timer(0.05, requests.post, (receiver.url, ), {'json': {'job_id': '1', 'state': 'done'}}).start()
+    assert receiver.wait('1') == {'job_id': '1', 'state': 'done'}
+    # Already received
+    assert receiver.wait('1', 0) == {'job_id': '1', 'state': 'done'}
+    assert receiver.wait('2', 0.01) is None
+    assert receiver.listeners == {}
+
+
+def test_invalid_payload(receiver):
+    assert requests.post(receiver.url, data='xxx').status_code == 400
+    assert requests.post(receiver.url, json={'state': 'done'}).status_code == 400
+
+
+def test_make(fake_api, fake_server, receiver, tmpdir):
+    metrics = MetricsCollector(fake_api.hooks)
+    result = fake_api.make('http://www.example.com', DEFAULT_BROWSERS[:2], str(tmpdir), timeout=60)
+    assert len(result) == 2
+    assert metrics.get('callbacks_total', status='received') == 1
+    # The job is listed once after the callback
+    assert metrics.get('polls_total') == 1
+    assert metrics.get('sleep_seconds_total') == 0
+    assert fake_server.stats['requests'] == 4
+
+
+def test_fallback_to_polling(fake_api, fake_server, receiver, tmpdir):
+    fake_server.send_callbacks = False
+    receiver.timeout = 0.05
+    metrics = MetricsCollector(fake_api.hooks)
+    result = fake_api.make('http://www.example.com', DEFAULT_BROWSERS[:2], str(tmpdir), timeout=0.05)
+    assert len(result) == 2
+    assert metrics.get('callbacks_total', status='missed') == 1
+    assert metrics.get('polls_total') > 0
+
+
+def test_reused_job_is_polled(fake_api, fake_server, receiver, tmpdir):
+    from browserstacker import ScreenShotsAPI
+    from browserstacker.cache import JobMemo
+
+    path = str(tmpdir.join('memo.json'))
+    # The job is started by another process without callbacks
+    other = ScreenShotsAPI('user', 'key', memo=JobMemo(path=path))
+    other.root_url = fake_server.url
+    job_id = other.generate('http://www.example.com', DEFAULT_BROWSERS[:2])['job_id']
+    other.close()
+    fake_api.memo = JobMemo(path=path)
+    receiver.timeout = 60
+    metrics = MetricsCollector(fake_api.hooks)
+    assert fake_api.generate('http://www.example.com', DEFAULT_BROWSERS[:2])['job_id'] == job_id
+    result = fake_api.download(job_id, str(tmpdir), timeout=0.05)
+    assert len(result) == 2
+    assert metrics.get('callbacks_total', status='missed') == 0
+    assert metrics.get('polls_total') > 0
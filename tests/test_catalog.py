@@ -0,0 +1,75 @@
+# coding: utf-8
+import pytest
+
+from browserstacker import ScreenShotsAPI
+from browserstacker.cache import CatalogCache
+from browserstacker.catalog import BrowserCatalog
+from browserstacker.screenshots import match_item
+
+from .conftest import BROWSERS_RESPONSE
+
+
+@pytest.fixture
+def catalog():
+    return BrowserCatalog(BROWSERS_RESPONSE)
+
+
+def scan(browsers, **filters):
+    for key, value in filters.items():
+        if value:
+            browsers = [item for item in browsers if match_item(key, value, item)]
+    return browsers
+
+
+@pytest.mark.parametrize('filters', (
+    {},
+    {'os': 'Windows'},
+    {'os': 'windows', 'browser': ('FIREFOX', 'safari')},
+    {'os': ['ios', 'android'], 'device': 'ipad mini'},
+    {'browser_version': 17.0},
+    {'device': 'None'},
+    {'os': 'Windows', 'browser': 'chrome'},
+    {'os': ['ios', ['android']]},
+    {'os': None, 'browser': []},
+))
+def test_filter_matches_scan(catalog, filters):
+    assert catalog.filter(**filters) == scan(BROWSERS_RESPONSE, **filters)
+
+
+def test_missing_key_matches():
+    browsers = [{'os': 'Windows', 'browser': 'ie'}, {'os': 'OS X'}]
+    catalog = BrowserCatalog(browsers)
+    assert catalog.filter(browser='chrome') == [{'os': 'OS X'}]
+    assert catalog.filter(browser='ie', os='windows') == browsers[:1]
+
+
+def test_not_indexed_key():
+    browsers = [{'os': 'Windows', 'real_mobile': True}, {'os': 'ios', 'real_mobile': False}]
+    catalog = BrowserCatalog(browsers)
+    assert catalog.filter(real_mobile='true') == browsers[:1]
+    assert 'real_mobile' in catalog.indexes
+
+
+def test_is_built_from(catalog):
+    assert catalog.is_built_from(BROWSERS_RESPONSE)
+    assert not catalog.is_built_from(list(BROWSERS_RESPONSE))
+
+
+def test_catalog_is_reused(cache_dir, browsers_response):
+    api = ScreenShotsAPI(None, None, catalog_cache=CatalogCache())
+    api.browsers(os='Windows')
+    catalog = api.catalog
+    api.browsers(os='ios')
+    assert api.catalog is catalog
+
+
+def test_uncached_catalog_is_reused(browsers_response):
+    api = ScreenShotsAPI(None, None)
+    browsers_response().headers = {'ETag': '"v1"'}
+    api.browsers(os='Windows')
+    catalog = api.catalog
+    browsers_response().status_code = 304
+    browsers_response().json.side_effect = ValueError
+    assert api.browsers(os='ios') == BROWSERS_RESPONSE[4:6]
+    assert browsers_response.call_args[1]['headers'] == {'If-None-Match': '"v1"'}
+    assert api.catalog is catalog
@@ -1,5 +1,8 @@
 # coding: utf-8
+import json
 import os
+import subprocess
+import sys
 
 import pytest
 
@@ -7,7 +10,8 @@ try:
     from browserstacker.cli import cli
 except (SyntaxError, ImportError):
     pytest.skip()
-from browserstacker.cli.helpers import format_browsers
+from browserstacker.cli.helpers import APIWrapper, format_browsers, get_url_dirname, parse_job
+from browserstacker.fake import FakeBrowserStack
 from .conftest import BROWSERS_RESPONSE, IMAGE_URL
 from ._compat import patch
 
@@ -78,11 +82,12 @@ def test_generate(isolated_cli_runner, mocked_request):
 
 
 def test_generate_with_browsers(isolated_cli_runner, mocked_request):
-    mocked_request().json.return_value = {'job_id': JOB_ID, 'screenshots': []}
+    mocked_request().json.side_effect = [BROWSERS_RESPONSE, {'job_id': JOB_ID, 'screenshots': []}]
     result = isolated_cli_runner.invoke(
         cli, ['generate', 'http://www.google.com', '-os', 'Windows'], catch_exceptions=False
     )
     assert not result.exception
+    assert mocked_request.call_args[1]['json']['browsers'] == BROWSERS_RESPONSE[:2]
 
 
 def test_download(isolated_cli_runner, mocked_request, mocked_get, mocked_image_response):
@@ -105,4 +110,127 @@ def test_readable_io_wrapper(isolated_cli_runner, is_readable):
         stdout().readable.return_value = is_readable
         result = isolated_cli_runner.invoke(cli, ['browsers'], catch_exceptions=False)
         assert not result.exception
-        assert stdout().read.called is is_readable
+        assert stdout().read.call_count == int(is_readable)
+
+
+def test_download_concurrency(isolated_cli_runner, mocked_request):
+    mocked_request().json.return_value = {'job_id': JOB_ID, 'screenshots': []}
+    with patch('browserstacker.cli.helpers.APIWrapper.iter_save_all') as iter_save_all:
+        iter_save_all.return_value = []
+        result = isolated_cli_runner.invoke(cli, ['download', JOB_ID, '-n', '4'], catch_exceptions=False)
+    assert not result.exception
+    assert iter_save_all.call_args[0][2] == 4
+
+
+def test_browsers_offline(isolated_cli_runner, browsers_response):
+    result = isolated_cli_runner.invoke(cli, ['browsers', '--offline'])
+    assert result.exit_code == 1
+    assert 'Error: Browsers catalog is not cached' in result.output
+    result = isolated_cli_runner.invoke(cli, ['browsers'], catch_exceptions=False)
+    assert not result.exception
+    browsers_response.reset_mock()
+    result = isolated_cli_runner.invoke(cli, ['browsers', '--offline', '-os', 'ios'], catch_exceptions=False)
+    assert not result.exception
+    assert 'Total browsers: 2' in result.output
+    assert not browsers_response.called
+
+
+@pytest.mark.usefixtures('clock')
+def test_batch(isolated_cli_runner):
+    with open('jobs.jsonl', 'w') as f:
+        f.write('{"url": "http://www.google.com", "quality": "Original"}\n\n{"url": "http://www.example.com"}\n')
+    with patch('browserstacker.cli.helpers.APIWrapper.generate') as generate, \
+            patch('browserstacker.cli.helpers.APIWrapper.list') as list_screenshots:
+        generate.return_value = {'job_id': JOB_ID}
+        list_screenshots.return_value = {'screenshots': []}
+        result = isolated_cli_runner.invoke(cli, ['batch', 'jobs.jsonl', '-p', '1'], catch_exceptions=False)
+    assert not result.exception
+    generate.assert_any_call('http://www.google.com', None, quality='Original')
+    assert result.output.count("'status': 'done'") == 2
+
+
+def test_metrics_file(isolated_cli_runner, mocked_request):
+    mocked_request().json.return_value = {'screenshots': []}
+    mocked_request().content = b'{"screenshots": []}'
+    result = isolated_cli_runner.invoke(cli, ['--metrics-file', 'metrics.prom', 'list', 'xxx'], catch_exceptions=False)
+    assert not result.exception
+    with open('metrics.prom') as f:
+        assert 'browserstacker_requests_total{method="GET",status="200"} 1\n' in f.read()
+
+
+def test_lazy_imports():
+    modules = ('requests', 'multiprocessing.pool', 'email.utils', 'sqlite3', 'socket')
+    code = 'import sys, browserstacker.cli; print(any(name in sys.modules for name in %r))' % (modules, )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=root)
+    assert output.strip() == b'False'
+
+
+def test_download_jsonl(isolated_cli_runner, mocked_request, mocked_get, mocked_image_response):
+    mocked_request().json.return_value = {
+        'screenshots': [dict(BROWSER, id='1', state='done', image_url=IMAGE_URL)]
+    }
+    mocked_get.return_value = mocked_image_response
+    result = isolated_cli_runner.invoke(cli, ['download', JOB_ID, '--output', 'jsonl'], catch_exceptions=False)
+    assert not result.exception
+    records = [json.loads(line) for line in result.output.splitlines()]
+    assert [record['event'] for record in records] == ['job_started', 'screenshot', 'job_finished']
+    assert records[1]['browser'] == 'firefox'
+    assert records[1]['path'] == IMAGE_URL.split('/')[-1]
+
+
+@pytest.mark.parametrize('line, expected', (
+    ('', None),
+    ('# comment', None),
+    ('http://www.google.com', {'url': 'http://www.google.com'}),
+    (
+        'http://www.google.com quality=Original os=Windows os=ios',
+        {'url': 'http://www.google.com', 'quality': 'Original', 'os': ['Windows', 'ios']}
+    ),
+    ('{"url": "http://www.google.com", "browsers": []}\n', {'url': 'http://www.google.com', 'browsers': []}),
+))
+def test_parse_job(line, expected):
+    assert parse_job(line) == expected
+
+
+@pytest.mark.parametrize('url, expected', (
+    ('http://www.google.com', 'www.google.com'),
+    ('https://www.example.com/path/?q=1', 'www.example.com_path_q_1'),
+))
+def test_get_url_dirname(url, expected):
+    assert get_url_dirname(url) == expected
+
+
+@pytest.mark.usefixtures('clock')
+def test_batch_from_stdin(isolated_cli_runner, monkeypatch):
+    with FakeBrowserStack(image_size=16) as server:
+        monkeypatch.setattr(APIWrapper, 'root_url', server.url)
+        result = isolated_cli_runner.invoke(
+            cli,
+            ['batch', '-ds', 'out', '-os', 'Windows', '-ov', '10', '--output', 'jsonl', '-n', '2'],
+            input='http://www.google.com\nhttp://www.example.com/page os=ios\n',
+            catch_exceptions=False
+        )
+        requests = server.stats['requests']
+    assert not result.exception
+    jobs = dict((job['url'], job) for job in map(json.loads, result.output.splitlines()))
+    assert len(jobs['http://www.google.com']['screenshots']) == 2
+    assert len(jobs['http://www.example.com/page']['screenshots']) == 1
+    assert sorted(os.listdir('out')) == ['www.example.com_page', 'www.google.com']
+    assert len(os.listdir(os.path.join('out', 'www.google.com'))) == 3  # 2 images and manifest
+    # Catalog is requested once, then 2 jobs are generated and polled once, then 3 images are downloaded
+    assert requests == 1 + 2 + 2 + 3
+
+
+def test_memo_ttl(isolated_cli_runner, monkeypatch):
+    with FakeBrowserStack() as server:
+        monkeypatch.setattr(APIWrapper, 'root_url', server.url)
+        outputs = [
+            isolated_cli_runner.invoke(
+                cli, ['--memo-ttl', '60', 'generate', 'http://www.google.com'], catch_exceptions=False
+            ).output
+            for _ in range(2)
+        ]
+        jobs = server.stats['jobs']
+    assert outputs[0] == outputs[1]
+    assert jobs == 1
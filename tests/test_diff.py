@@ -0,0 +1,135 @@
+# coding: utf-8
+import json
+import os
+
+import pytest
+
+from browserstacker.diff import (
+    CHANGED, MATCH, MISSING, NEW, compare_images, diff_screenshots, get_key, index_baseline, update_baseline
+)
+from browserstacker.fake import DEFAULT_BROWSERS
+
+
+numpy = pytest.importorskip('numpy')
+Image = pytest.importorskip('PIL.Image')
+
+
+def save_image(path, size=(40, 20), color=(255, 255, 255), box=None):
+    image = Image.new('RGB', size, color)
+    if box is not None:
+        image.paste((0, 0, 0), box)
+    image.save(path)
+    return path
+
+
+def make_record(browser, path):
+    return dict(browser, event='screenshot', path=path)
+
+
+def test_get_key():
+    assert get_key(DEFAULT_BROWSERS[0]) == 'windows_10_chrome_50.0'
+    assert get_key(DEFAULT_BROWSERS[-1]) == 'android_5.0_android_browser_google_nexus_6'
+
+
+def test_compare_images(tmpdir):
+    current = save_image(str(tmpdir.join('current.png')), box=(10, 5, 14, 7))
+    baseline = save_image(str(tmpdir.join('baseline.png')))
+    result = compare_images(current, baseline, diff_path=str(tmpdir.join('diff', 'image.png')))
+    assert result['pixels'] == 800
+    assert result['changed'] == 8
+    assert result['ratio'] == 0.01
+    assert result['bbox'] == [10, 5, 14, 7]
+    diff = numpy.asarray(Image.open(result['diff']))
+    assert tuple(diff[5, 10]) == (255, 0, 0)
+    assert tuple(diff[0, 0]) == (85, 85, 85)
+
+
+def test_compare_threshold(tmpdir):
+    current = save_image(str(tmpdir.join('current.png')), color=(250, 250, 250))
+    baseline = save_image(str(tmpdir.join('baseline.png')))
+    assert compare_images(current, baseline, threshold=5)['changed'] == 0
+    result = compare_images(current, baseline, threshold=4, diff_path=str(tmpdir.join('diff.png')))
+    assert result['ratio'] == 1
+    assert result['bbox'] == [0, 0, 40, 20]
+
+
+def test_compare_different_sizes(tmpdir):
+    current = save_image(str(tmpdir.join('current.png')), size=(40, 25))
+    baseline = save_image(str(tmpdir.join('baseline.png')))
+    result = compare_images(current, baseline)
+    assert result['pixels'] == 1000
+    assert result['changed'] == 200
+    assert result['bbox'] == [0, 20, 40, 25]
+
+
+@pytest.mark.parametrize('threshold', (0, 5))
+def test_compare_grown_dark_image(tmpdir, threshold):
+    current = save_image(str(tmpdir.join('current.png')), size=(10, 20), color=(0, 0, 0))
+    baseline = save_image(str(tmpdir.join('baseline.png')), size=(10, 10), color=(0, 0, 0))
+    result = compare_images(current, baseline, threshold=threshold)
+    assert result['changed'] == 100
+    assert result['bbox'] == [0, 10, 10, 20]
+
+
+@pytest.mark.parametrize('processes', (0, 2))
+def test_diff_screenshots(tmpdir, processes):
+    baseline = tmpdir.mkdir('baseline')
+    current = tmpdir.mkdir('current')
+    records = [{'event': 'job_started', 'job_id': '1'}]
+    for index, browser in enumerate(DEFAULT_BROWSERS[:4]):
+        box = (0, 0, 2, 2) if index == 1 else None
+        records.append(make_record(browser, save_image(str(current.join('%s.png' % index)), box=box)))
+        if index < 3:
+            save_image(str(baseline.join(get_key(browser) + '.png')))
+    save_image(str(baseline.join(get_key(DEFAULT_BROWSERS[4]) + '.png')))
+    # Failed screenshot
+    records.append(make_record(DEFAULT_BROWSERS[4], None))
+    results = diff_screenshots(records, str(baseline), str(tmpdir.join('diff')), processes=processes)
+    statuses = dict((get_key(browser), status) for browser, status in zip(
+        DEFAULT_BROWSERS, [MATCH, CHANGED, MATCH, NEW, MISSING]
+    ))
+    assert dict((key, result['status']) for key, result in results.items()) == statuses
+    changed = results[get_key(DEFAULT_BROWSERS[1])]
+    assert changed['changed'] == 4
+    assert os.listdir(str(tmpdir.join('diff'))) == [get_key(DEFAULT_BROWSERS[1]) + '.png']
+    assert diff_screenshots(records, str(baseline), max_ratio=0.01)[changed['key']]['status'] == MATCH
+
+
+def test_update_baseline(tmpdir):
+    baseline = str(tmpdir.join('baseline'))
+    path = save_image(str(tmpdir.join('image.png')))
+    record = make_record(DEFAULT_BROWSERS[0], path)
+    assert update_baseline([record], baseline) == {
+        get_key(DEFAULT_BROWSERS[0]): os.path.join(baseline, 'windows_10_chrome_50.0.png')
+    }
+    record['path'] = save_image(str(tmpdir.join('image.jpg')))
+    update_baseline([record], baseline)
+    assert index_baseline(baseline) == {
+        'windows_10_chrome_50.0': os.path.join(baseline, 'windows_10_chrome_50.0.jpg')
+    }
+
+
+def test_cli(isolated_cli_runner, monkeypatch, tmpdir):
+    from browserstacker.cli import cli
+    from browserstacker.cli.helpers import APIWrapper
+
+    def iter_download(self, job_id, destination=None, **kwargs):
+        for index, browser in enumerate(DEFAULT_BROWSERS[:2]):
+            box = (0, 0, 4, 5) if index and 'changed' in job_id else None
+            yield make_record(browser, save_image(str(tmpdir.join('%s%s.png' % (job_id, index))), box=box))
+
+    monkeypatch.setattr(APIWrapper, 'iter_download', iter_download)
+    result = isolated_cli_runner.invoke(cli, ['diff', 'job', 'baseline', '--update-baseline'], catch_exceptions=False)
+    assert not result.exception
+    assert len(os.listdir('baseline')) == 2
+    result = isolated_cli_runner.invoke(cli, ['diff', 'job', 'baseline', '--processes', '0'], catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output == 'windows_10_chrome_50.0: match (0.0000%)\nwindows_10_firefox_45.0: match (0.0000%)\n'
+    result = isolated_cli_runner.invoke(
+        cli, ['diff', 'changed', 'baseline', '--processes', '0', '--diff-dir', 'diff', '--output', 'jsonl']
+    )
+    assert result.exit_code == 1
+    records = [json.loads(line) for line in result.output.splitlines()]
+    assert [record['status'] for record in records] == ['match', 'changed']
+    assert records[1]['ratio'] == 0.025
+    assert os.listdir('diff') == ['windows_10_firefox_45.0.png']
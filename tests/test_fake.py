@@ -0,0 +1,89 @@
+# coding: utf-8
+import os
+
+import pytest
+import requests
+
+from browserstacker import ScreenShotsAPI
+from browserstacker.cache import CatalogCache
+from browserstacker.fake import DEFAULT_BROWSERS, make_image
+from browserstacker.screenshots import AuthError, IncompleteDownload, ParallelLimitReached
+
+
+def test_browsers(fake_api, fake_server):
+    assert fake_api.browsers() == DEFAULT_BROWSERS
+    assert fake_api.browsers(os='ios') == [DEFAULT_BROWSERS[6]]
+
+
+def test_make(fake_api, fake_server, tmpdir):
+    result = fake_api.make('http://www.example.com', DEFAULT_BROWSERS[:2], str(tmpdir), timeout=0.01, concurrency=2)
+    assert len(result) == 2
+    for filename in result.values():
+        with open(filename, 'rb') as f:
+            assert f.read() == make_image(1024)
+    assert fake_server.stats['jobs'] == 1
+    assert fake_server.stats['images'] == 2
+    assert fake_api.pool_stats['hits'] > 0
+
+
+def test_render_time(fake_server, fake_api, tmpdir):
+    fake_server.render_time = 0.2
+    job_id = fake_api.generate('http://www.example.com', DEFAULT_BROWSERS[:1])['job_id']
+    assert fake_api.list(job_id)['state'] == 'processing'
+    assert len(fake_api.download(job_id, str(tmpdir), timeout=0.05)) == 1
+
+
+def test_parallel_limit(fake_server, fake_api):
+    fake_server.parallel_limit = 1
+    fake_server.render_time = 60
+    fake_api.generate('http://www.example.com', DEFAULT_BROWSERS[:1])
+    with pytest.raises(ParallelLimitReached):
+        fake_api.generate('http://www.example.com', DEFAULT_BROWSERS[:1])
+    assert fake_server.stats['rejected'] == 1
+
+
+def test_auth(fake_server, fake_api):
+    fake_server.accounts = {'user': 'other'}
+    with pytest.raises(AuthError):
+        fake_api.list('unknown')
+
+
+def test_resume(fake_server, fake_api, tmpdir):
+    job = fake_server.create_job('http://www.example.com', DEFAULT_BROWSERS[:1])
+    image_url = job.screenshots[0]['image_url']
+    filename = str(tmpdir.join(os.path.basename(image_url)))
+    with open(filename + '.part', 'wb') as f:
+        f.write(make_image(1024)[:100])
+    assert fake_api.fetch(image_url, filename)[0] == 1024
+    with open(filename, 'rb') as f:
+        assert f.read() == make_image(1024)
+    assert fake_server.stats['bytes'] == 924
+
+
+def test_resume_changed_image(fake_server, fake_api, tmpdir):
+    job = fake_server.create_job('http://www.example.com', DEFAULT_BROWSERS[:1])
+    image_url = job.screenshots[0]['image_url']
+    filename = str(tmpdir.join(os.path.basename(image_url)))
+    fake_server.fail(1, None, path='/images/')
+    with pytest.raises((IncompleteDownload, requests.RequestException)):
+        fake_api.fetch(image_url, filename)
+    assert os.path.exists(filename + '.part.validator')
+    # The image is changed on the server before the download is resumed
+    fake_server.image = make_image(2048)
+    assert fake_api.fetch(image_url, filename)[0] == 2048
+    with open(filename, 'rb') as f:
+        assert f.read() == make_image(2048)
+    assert not os.path.exists(filename + '.part.validator')
+
+
+def test_catalog_revalidation(fake_server, tmpdir):
+    catalog_cache = CatalogCache(str(tmpdir.join('browsers.json')), ttl=0)
+    api = ScreenShotsAPI('user', 'key', catalog_cache=catalog_cache)
+    api.root_url = fake_server.url
+    assert api.fetch_browsers() == DEFAULT_BROWSERS
+    catalog_size = fake_server.stats['bytes']
+    # 304 Not Modified without body
+    assert api.fetch_browsers() == DEFAULT_BROWSERS
+    api.close()
+    assert fake_server.stats['requests'] == 2
+    assert fake_server.stats['bytes'] == catalog_size
@@ -0,0 +1,220 @@
+# coding: utf-8
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from browserstacker import ScreenShotsAPI
+from browserstacker.fake import DEFAULT_BROWSERS
+from browserstacker.ledger import DONE, FAILED, PENDING, JobClaimed, JobLedger
+from browserstacker.retry import RetryPolicy
+from browserstacker.scheduler import JobScheduler
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join('ledger.sqlite'))
+
+
+@pytest.fixture
+def ledger(path):
+    return JobLedger(path)
+
+
+@pytest.fixture
+def fake_options():
+    return {'browsers': DEFAULT_BROWSERS[:2], 'image_size': 128}
+
+
+@pytest.fixture
+def api_options(ledger):
+    return {'ledger': ledger}
+
+
+def start_download(path, job_id):
+    JobLedger(path).start(job_id, 'screenshots')
+
+
+def try_start(path, job_id, results):
+    try:
+        JobLedger(path).start(job_id, 'other')
+    except JobClaimed:
+        results.put(False)
+    else:
+        results.put(True)
+
+
+def resume(url, path):
+    api = ScreenShotsAPI('user', 'key', ledger=JobLedger(path))
+    api.root_url = url
+    api.resume(timeout=0.01)
+    api.close()
+
+
+def test_claims(ledger, path):
+    ledger.add_job('a', {'url': 'http://www.example.com'}, 'user')
+    ledger.add_job('b', {'url': 'http://www.example.org'}, 'user')
+    job = ledger.claim()
+    assert job['job_id'] == 'a'
+    assert job['payload'] == {'url': 'http://www.example.com'}
+    assert job['account'] == 'user'
+    # Claimed by this live process
+    assert ledger.claim(['b']) is None
+    assert JobLedger(path).claim()['job_id'] == 'b'
+    ledger.release('a')
+    assert ledger.claim()['job_id'] == 'a'
+    ledger.finish('a')
+    ledger.finish('b', FAILED, 'Not found')
+    assert ledger.claim() is None
+    assert [(job['state'], job['error'], job['claims']) for job in ledger.get_jobs()] == [
+        (DONE, None, 2), (FAILED, 'Not found', 1)
+    ]
+
+
+def test_dead_process(ledger, path):
+    process = multiprocessing.Process(target=start_download, args=(path, 'job'))
+    process.start()
+    process.join()
+    job = ledger.get_job('job')
+    assert job['pid'] == process.pid
+    assert job['destination'] == 'screenshots'
+    assert ledger.claim()['job_id'] == 'job'
+
+
+def test_expired_claim(ledger, path):
+    ledger.start('job')
+    assert ledger.claim() is None
+    # Claims of other hosts can't be checked, they expire
+    with ledger.transaction() as connection:
+        connection.execute('UPDATE jobs SET host = ?', ('other', ))
+    assert ledger.claim() is None
+    assert JobLedger(path, claim_ttl=0).claim()['job_id'] == 'job'
+
+
+def test_concurrent_start(fake_api, fake_server, ledger, path, tmpdir):
+    fake_server.render_time = 60
+    job_id = fake_api.generate('http://www.example.com', fake_server.browsers)['job_id']
+    records = fake_api.iter_download(job_id, str(tmpdir), timeout=0.01)
+    next(records)
+    results = multiprocessing.Queue()
+    for expected in (False, True):
+        process = multiprocessing.Process(target=try_start, args=(path, job_id, results))
+        process.start()
+        process.join()
+        assert results.get(timeout=5) is expected
+        if not expected:
+            # The live claim is kept
+            assert ledger.get_job(job_id)['pid'] == os.getpid()
+            assert ledger.get_job(job_id)['destination'] == str(tmpdir)
+            # Own claims could be started again
+            ledger.start(job_id)
+            records.close()
+    assert ledger.get_job(job_id)['destination'] == 'other'
+
+
+def test_resume(fake_api, fake_server, ledger, tmpdir):
+    fake_server.render_time = 0.05
+    job_id = fake_api.generate('http://www.example.com', fake_server.browsers)['job_id']
+    assert ledger.get_job(job_id)['payload']['url'] == 'http://www.example.com'
+    # Download is interrupted
+    records = fake_api.iter_download(job_id, str(tmpdir.join('screenshots')), timeout=0.01)
+    next(records)
+    records.close()
+    job = ledger.get_job(job_id)
+    assert job['state'] == PENDING
+    assert job['pid'] is None
+    results = fake_api.resume(timeout=0.01)
+    assert list(results) == [job_id]
+    assert len(results[job_id]) == 2
+    for filename in results[job_id].values():
+        assert os.path.dirname(filename) == str(tmpdir.join('screenshots'))
+    assert ledger.get_job(job_id)['state'] == DONE
+    screenshots = ledger.get_screenshots(job_id)
+    assert sorted(screenshot['path'] for screenshot in screenshots) == sorted(results[job_id].values())
+    assert fake_api.resume() == {}
+
+
+def test_expired_job(fake_api, ledger):
+    ledger.add_job('unknown', {'url': 'http://www.example.com'})
+    assert fake_api.resume(timeout=0.01) == {'unknown': {}}
+    job = ledger.get_job('unknown')
+    assert job['state'] == FAILED
+    assert job['error']
+
+
+def test_resume_without_retries(fake_server, ledger, tmpdir):
+    api = ScreenShotsAPI('user', 'key', ledger=ledger, retry_policy=RetryPolicy(attempts=0))
+    api.root_url = fake_server.url
+    job_id = api.generate('http://www.example.com', fake_server.browsers)['job_id']
+    fake_server.fail(1, None, path='/screenshots/')
+    assert api.resume(destination=str(tmpdir), timeout=0.01) == {job_id: {}}
+    # Dropped connection is transient even if it is not retried
+    assert ledger.get_job(job_id)['state'] == PENDING
+    assert len(api.resume(destination=str(tmpdir), timeout=0.01)[job_id]) == 2
+    assert ledger.get_job(job_id)['state'] == DONE
+    api.close()
+
+
+def test_workers(fake_api, fake_server, ledger, path, tmpdir):
+    job_ids = [fake_api.generate('http://www.example.com/%s' % i, fake_server.browsers)['job_id'] for i in range(6)]
+    for job_id in job_ids:
+        # Images of the fake server have the same names in all jobs
+        ledger.start(job_id, str(tmpdir.join(job_id)))
+        ledger.release(job_id)
+    processes = [multiprocessing.Process(target=resume, args=(fake_server.url, path)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * 3
+    jobs = ledger.get_jobs()
+    assert sorted(job['job_id'] for job in jobs) == sorted(job_ids)
+    assert [(job['state'], job['claims']) for job in jobs] == [(DONE, 1)] * 6
+    # Every job is downloaded once
+    assert fake_server.stats['images'] == 12
+
+
+def test_scheduler(fake_api, fake_server, ledger, tmpdir):
+    scheduler = JobScheduler(fake_api, timeout=0.01)
+    scheduler.add('http://www.example.com', fake_server.browsers, destination=str(tmpdir))
+    job = scheduler.run()[0]
+    assert ledger.get_job(job.job_id)['state'] == DONE
+    assert ledger.get_job(job.job_id)['destination'] == str(tmpdir)
+    assert len(ledger.get_screenshots(job.job_id)) == 2
+
+
+def test_scheduler_transient_error(fake_server, ledger, tmpdir):
+    api = ScreenShotsAPI('user', 'key', ledger=ledger, retry_policy=RetryPolicy(attempts=1, initial=0.01))
+    api.root_url = fake_server.url
+    fake_server.render_time = 0.05
+    fake_server.fail(3, None, path='/screenshots/')
+    scheduler = JobScheduler(api, timeout=0.01)
+    scheduler.add('http://www.example.com', fake_server.browsers, destination=str(tmpdir))
+    job = scheduler.run()[0]
+    assert job.status == FAILED
+    assert ledger.get_job(job.job_id)['state'] == PENDING
+    results = api.resume(timeout=0.01)
+    assert len(results[job.job_id]) == 2
+    assert ledger.get_job(job.job_id)['state'] == DONE
+    api.close()
+
+
+def test_cli(isolated_cli_runner, monkeypatch, fake_server, path):
+    from browserstacker.cli import cli
+    from browserstacker.cli.helpers import APIWrapper
+
+    monkeypatch.setattr(APIWrapper, 'root_url', fake_server.url)
+    result = isolated_cli_runner.invoke(
+        cli, ['--ledger', path, 'generate', 'http://www.example.com'], catch_exceptions=False
+    )
+    assert not result.exception
+    result = isolated_cli_runner.invoke(
+        cli, ['--ledger', path, 'resume', '-ds', 'out', '--output', 'jsonl'], catch_exceptions=False
+    )
+    assert not result.exception
+    records = [json.loads(line) for line in result.output.splitlines()]
+    assert [record['event'] for record in records] == ['job_started', 'screenshot', 'job_finished']
+    assert len(os.listdir('out')) == 2  # Image and manifest
+    result = isolated_cli_runner.invoke(cli, ['resume'])
+    assert result.exit_code == 2
@@ -0,0 +1,68 @@
+# coding: utf-8
+import hashlib
+import json
+
+import pytest
+
+from browserstacker import ScreenShotsAPI
+from browserstacker.cache import BoundedCache
+from browserstacker.manifest import MANIFEST_NAME, Manifest
+
+from .conftest import IMAGE_URL
+
+
+@pytest.fixture
+def api():
+    return ScreenShotsAPI(None, None, use_manifest=True)
+
+
+def test_add(tmpdir):
+    manifest = Manifest(str(tmpdir))
+    tmpdir.join('image.png').write_binary(b'test')
+    manifest.add(IMAGE_URL, str(tmpdir.join('image.png')), 4, 'abc')
+    assert manifest.get(IMAGE_URL, str(tmpdir.join('image.png')))['sha256'] == 'abc'
+    reloaded = Manifest(str(tmpdir))
+    assert reloaded.records == manifest.records
+    assert reloaded.get(IMAGE_URL, str(tmpdir.join('other.png'))) is None
+    tmpdir.join('image.png').write_binary(b'truncated')
+    assert reloaded.get(IMAGE_URL, str(tmpdir.join('image.png'))) is None
+
+
+def test_partial_line(tmpdir):
+    record = {'image_url': IMAGE_URL, 'filename': 'image.png', 'size': 4, 'sha256': 'abc'}
+    tmpdir.join(MANIFEST_NAME).write(json.dumps(record) + '\n{"image_url": ')
+    assert len(Manifest(str(tmpdir))) == 1
+
+
+def test_save_records_and_skips(api, tmpdir, mocked_get, mocked_image_response):
+    destination = str(tmpdir.join('screenshots'))
+    mocked_get.return_value = mocked_image_response
+    filename = api.save(IMAGE_URL, destination)
+    record = Manifest(destination).get(IMAGE_URL, filename)
+    assert record['size'] == 4
+    assert record['sha256'] == hashlib.sha256(b'test').hexdigest()
+    other_api = ScreenShotsAPI(None, None, use_manifest=True)
+    mocked_get.reset_mock()
+    assert other_api.save(IMAGE_URL, destination) == filename
+    assert not mocked_get.called
+
+
+def test_bounded_cache():
+    cache = BoundedCache(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache['a'] == 1
+    cache['c'] = 3
+    assert 'b' not in cache
+    assert list(cache) == ['a', 'c']
+    assert cache.get('b') is None
+
+
+def test_download_result_is_per_job(screenshots_api, monkeypatch):
+    first, second = 'http://example.com/1.png', 'http://example.com/2.png'
+    screenshots_api._cache[first] = '1.png'
+    monkeypatch.setattr(screenshots_api, 'fetch', lambda image_url, filename: (4, 'abc'))
+    monkeypatch.setattr(screenshots_api, 'list', lambda job_id: {
+        'screenshots': [{'state': 'done', 'image_url': second}]
+    })
+    assert screenshots_api.download('123') == {second: '2.png'}
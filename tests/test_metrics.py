@@ -0,0 +1,112 @@
+# coding: utf-8
+import socket
+
+import pytest
+
+from browserstacker import ScreenShotsAPI
+from browserstacker.fake import DEFAULT_BROWSERS
+from browserstacker.hooks import REQUEST_END, SAVE, Hooks
+from browserstacker.metrics import Histogram, MetricsCollector, StatsdExporter
+
+from ._compat import patch
+
+
+def test_hooks():
+    hooks, events = Hooks(), []
+    assert not hooks
+    callback = hooks.register(SAVE, lambda event, data: events.append((event, data)))
+    assert hooks
+    hooks.emit(SAVE, size=1)
+    hooks.emit(REQUEST_END, size=2)
+    assert events == [(SAVE, {'size': 1})]
+    hooks.unregister(SAVE, callback)
+    assert not hooks
+
+
+def test_unknown_event():
+    with pytest.raises(ValueError):
+        Hooks().register('unknown', lambda event, data: None)
+
+
+def test_no_hooks(screenshots_api, mocked_request):
+    with patch.object(ScreenShotsAPI, 'track_request') as track_request:
+        screenshots_api.list('xxx')
+    assert not track_request.called
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1, 10))
+    for value in (0.05, 0.5, 0.6, 5, 20):
+        histogram.observe(value)
+    assert list(histogram.cumulative()) == [(0.1, 1), (1, 3), (10, 4), ('+Inf', 5)]
+    summary = histogram.summary()
+    assert summary['count'] == 5
+    assert summary['min'] == 0.05
+    assert summary['max'] == 20
+    assert summary['p50'] == 1
+    assert summary['p99'] == 20
+
+
+def test_quantiles_are_observed():
+    histogram = Histogram((0.1, 1, 10))
+    for value in (0.21, 0.34, 0.37):
+        histogram.observe(value)
+    summary = histogram.summary()
+    assert summary['min'] <= summary['p50'] <= summary['p99'] <= summary['max']
+    assert summary['p50'] == 0.37
+    histogram = Histogram((0.1, 1, 10))
+    histogram.observe(5)
+    # Empty buckets are below the minimum
+    assert histogram.quantile(0) == 5
+
+
+def test_collector(fake_api, fake_server, tmpdir):
+    fake_server.render_time = 0.1
+    metrics = MetricsCollector(fake_api.hooks)
+    fake_api.make('http://www.example.com', DEFAULT_BROWSERS[:2], str(tmpdir), timeout=0.05)
+    assert metrics.get('jobs_total') == 1
+    assert metrics.get('images_total', status='saved') == 2
+    assert metrics.get('requests_total', method='POST') == 1
+    assert metrics.get('requests_total', method='GET') == metrics.get('polls_total') + 2
+    assert metrics.get('received_bytes_total') == fake_server.stats['bytes']
+    assert metrics.get('retries_total', reason='pending') == metrics.get('polls_total') - 1
+    summary = metrics.summary()
+    assert summary['sleep_seconds'] >= 0.1
+    assert summary['work_seconds'] > 0
+    assert summary['histograms']['save_duration_seconds']['count'] == 2
+
+
+def test_prometheus(tmpdir):
+    metrics = MetricsCollector(buckets=(0.1, 1))
+    metrics.inc('requests_total', method='GET', status=200)
+    metrics.observe('request_duration_seconds', 0.5, method='GET')
+    path = str(tmpdir.join('metrics.prom'))
+    metrics.write_textfile(path)
+    with open(path) as f:
+        assert f.read() == '''# TYPE browserstacker_requests_total counter
+browserstacker_requests_total{method="GET",status="200"} 1
+# TYPE browserstacker_request_duration_seconds histogram
+browserstacker_request_duration_seconds_bucket{method="GET",le="0.1"} 0
+browserstacker_request_duration_seconds_bucket{method="GET",le="1"} 1
+browserstacker_request_duration_seconds_bucket{method="GET",le="+Inf"} 1
+browserstacker_request_duration_seconds_sum{method="GET"} 0.5
+browserstacker_request_duration_seconds_count{method="GET"} 1
+'''
+
+
+def test_statsd():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(5)
+    hooks = Hooks()
+    exporter = StatsdExporter(hooks, port=receiver.getsockname()[1])
+    hooks.emit(REQUEST_END, method='GET', url='/', status=200, elapsed=0.25, size=10, error=None)
+    try:
+        assert receiver.recv(1024) == (
+            b'browserstacker.requests.GET.200:1|c\n'
+            b'browserstacker.request_duration.GET:250|ms\n'
+            b'browserstacker.received_bytes:10|c'
+        )
+    finally:
+        exporter.close()
+        receiver.close()
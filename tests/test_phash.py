@@ -0,0 +1,144 @@
+# coding: utf-8
+import json
+import random
+from io import BytesIO
+
+import pytest
+
+from browserstacker import ScreenShotsAPI
+from browserstacker.fake import DEFAULT_BROWSERS, FakeBrowserStack
+from browserstacker.phash import BKTree, HashIndex, compute_hashes, hamming
+
+
+numpy = pytest.importorskip('numpy')
+Image = pytest.importorskip('PIL.Image')
+
+
+def make_image(seed, noise=0):
+    """
+    Random blocky image. With `noise` some pixels are changed a bit.
+    """
+    state = numpy.random.RandomState(seed)
+    blocks = state.randint(0, 256, (8, 8, 3))
+    pixels = numpy.kron(blocks, numpy.ones((16, 16, 1))).astype(numpy.int16)
+    if noise:
+        pixels += numpy.random.RandomState(seed + 1000).randint(-noise, noise + 1, pixels.shape)
+    return Image.fromarray(numpy.clip(pixels, 0, 255).astype(numpy.uint8), 'RGB')
+
+
+def save_image(path, seed, noise=0):
+    make_image(seed, noise).save(path)
+    return path
+
+
+@pytest.mark.parametrize('algorithm', ('ahash', 'dhash', 'phash'))
+def test_hashes(tmpdir, algorithm):
+    original = compute_hashes(save_image(str(tmpdir.join('1.png')), 1))[algorithm]
+    similar = compute_hashes(save_image(str(tmpdir.join('2.png')), 1, noise=10))[algorithm]
+    other = compute_hashes(save_image(str(tmpdir.join('3.png')), 2))[algorithm]
+    assert len(original) == 16
+    assert hamming(int(original, 16), int(similar, 16)) <= 4
+    assert hamming(int(original, 16), int(other, 16)) > 10
+
+
+def test_bk_tree():
+    generator = random.Random(1)
+    values = [generator.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for index, value in enumerate(values):
+        tree.add(value, index)
+    tree.add(values[0], 'duplicate')
+    assert len(tree) == 501
+    target = values[0] ^ 0b1011
+    expected = sorted(
+        (hamming(target, value), index) for index, value in enumerate(values) if hamming(target, value) <= 20
+    )
+    results = tree.search(target, 20)
+    assert sorted(item for item in results if item[1] != 'duplicate') == expected
+    assert results[:2] == [(3, 0), (3, 'duplicate')]
+
+
+def test_index(tmpdir):
+    path = str(tmpdir.join('index.jsonl'))
+    index = HashIndex(path)
+    for seed in range(5):
+        image = save_image(str(tmpdir.join('%s.png' % seed)), seed)
+        index.add(image, key='windows_10_chrome_50.0' if seed % 2 else 'ios_9.1', url='http://www.example.com')
+    query = save_image(str(tmpdir.join('query.png')), 3, noise=10)
+    results = index.search(query, max_distance=8)
+    assert [result['path'] for result in results] == [str(tmpdir.join('3.png'))]
+    assert results[0]['key'] == 'windows_10_chrome_50.0'
+    assert index.search(query, max_distance=8, key='ios_9.1') == []
+    assert index.search(query, max_distance=8, url='http://www.google.com') == []
+    assert len(index.search(query, 'dhash', max_distance=64, limit=2)) == 2
+    # Already indexed
+    index.add(str(tmpdir.join('3.png')), key='windows_10_chrome_50.0', url='http://www.example.com')
+    with open(path) as f:
+        assert len(f.readlines()) == 5
+    # Trees are updated on the fly
+    index.add(save_image(str(tmpdir.join('5.png')), 3), key='ios_9.1', url='http://www.example.com')
+    assert [result['key'] for result in index.search(query, max_distance=8)] == ['windows_10_chrome_50.0', 'ios_9.1']
+    reloaded = HashIndex(path)
+    assert len(reloaded) == 6
+    assert reloaded.search(query, max_distance=8) == index.search(query, max_distance=8)
+
+
+def test_index_saved_screenshots(tmpdir):
+    buffer = BytesIO()
+    make_image(1).save(buffer, 'PNG')
+    path = str(tmpdir.join('index.jsonl'))
+    with FakeBrowserStack(browsers=DEFAULT_BROWSERS[:2]) as server:
+        server.image = buffer.getvalue()
+        api = ScreenShotsAPI('user', 'key')
+        api.root_url = server.url
+        index = HashIndex(path, api.hooks)
+        api.make('http://www.example.com', server.browsers, str(tmpdir.join('screenshots')))
+        api.close()
+    assert len(index) == 2
+    query = save_image(str(tmpdir.join('query.png')), 1)
+    results = index.search(query, max_distance=0)
+    assert sorted(result['key'] for result in results) == ['windows_10_chrome_50.0', 'windows_10_firefox_45.0']
+    assert set(result['url'] for result in results) == set(['http://www.example.com'])
+
+
+def test_index_skips_broken_images(tmpdir):
+    index = HashIndex(str(tmpdir.join('index.jsonl')))
+    broken = tmpdir.join('broken.png')
+    broken.write_binary(b'not an image')
+    record = dict(DEFAULT_BROWSERS[0], event='screenshot', path=str(broken), image_url='', job_id='1', url=None)
+    index.handle('progress', {'record': record})
+    assert len(index) == 0
+
+
+def test_cli(isolated_cli_runner, tmpdir):
+    from browserstacker.cli import cli
+
+    index = HashIndex('index.jsonl')
+    index.add(save_image(str(tmpdir.join('1.png')), 1), key='ios_9.1', url='http://www.example.com')
+    save_image('query.png', 1, noise=10)
+    result = isolated_cli_runner.invoke(cli, ['similar', 'index.jsonl', 'query.png'], catch_exceptions=False)
+    assert not result.exception
+    distance, key, url, path = result.output.split()
+    assert int(distance) <= 4
+    assert (key, url, path) == ('ios_9.1', 'http://www.example.com', str(tmpdir.join('1.png')))
+    result = isolated_cli_runner.invoke(
+        cli, ['similar', 'index.jsonl', 'query.png', '--output', 'jsonl', '--browser-key', 'ios_9.1'],
+        catch_exceptions=False
+    )
+    assert json.loads(result.output)['key'] == 'ios_9.1'
+
+
+def raise_import_error():
+    raise ImportError('Perceptual hashes require numpy and Pillow: pip install browserstacker[diff]')
+
+
+def test_missing_dependencies(isolated_cli_runner, monkeypatch):
+    from browserstacker import phash
+    from browserstacker.cli import cli
+
+    monkeypatch.setattr(phash, 'load_numpy', raise_import_error)
+    with pytest.raises(ImportError):
+        HashIndex('index.jsonl')
+    result = isolated_cli_runner.invoke(cli, ['--hash-index', 'index.jsonl', 'list'])
+    assert result.exit_code == 2
+    assert 'pip install browserstacker[diff]' in result.output
@@ -0,0 +1,86 @@
+# coding: utf-8
+import pytest
+
+from browserstacker.polling import Backoff, JobPoller
+
+from ._compat import patch
+
+
+IMAGE_URL = 'http://www.example.com/img/%s.jpg'
+
+
+def make_response(*states):
+    return {
+        'screenshots': [
+            {'id': str(i), 'state': state, 'image_url': IMAGE_URL % i if state == 'done' else None}
+            for i, state in enumerate(states)
+        ]
+    }
+
+
+def test_backoff():
+    backoff = Backoff(initial=1, maximum=10, jitter=0)
+    assert [backoff.next_delay() for _ in range(6)] == [1, 2, 4, 8, 10, 10]
+    backoff.reset()
+    assert backoff.next_delay() == 1
+
+
+def test_backoff_jitter():
+    backoff = Backoff(initial=8, maximum=8, jitter=0.5)
+    for _ in range(100):
+        assert 4 <= backoff.next_delay() <= 8
+
+
+def test_poller_updates():
+    poller = JobPoller('123')
+    assert poller.update(make_response('pending', 'done', 'processing')) == [IMAGE_URL % 1]
+    assert not poller.is_finished
+    assert sorted(poller.pending) == ['0', '2']
+    assert poller.update(make_response('done', 'done', 'processing')) == [IMAGE_URL % 0]
+    assert poller.update(make_response('done', 'done', 'timed-out')) == []
+    assert poller.is_finished
+
+
+def test_poller_done_without_image():
+    poller = JobPoller('123')
+    assert poller.update({'screenshots': [{'state': 'done', 'image_url': None}]}) == []
+    assert not poller.is_finished
+
+
+def test_poller_deadline():
+    with patch('browserstacker.polling.time') as time:
+        time.return_value = 100
+        poller = JobPoller('123', timeout=10, deadline=15)
+        assert poller.next_delay() <= 10
+        time.return_value = 110
+        assert poller.next_delay() <= 5
+        time.return_value = 115
+        assert poller.next_delay() is None
+
+
+def test_poller_retries():
+    poller = JobPoller('123', retries=1)
+    poller.update(make_response('pending'))
+    assert poller.next_delay() is not None
+    poller.update(make_response('pending'))
+    assert poller.next_delay() is None
+
+
+def test_download_does_not_wait_for_pending(screenshots_api, sleep):
+    responses = [make_response('done', 'pending', 'done'), make_response('done', 'done', 'done')]
+    saved = []
+    with patch.object(screenshots_api, 'list') as list, patch.object(screenshots_api, 'save') as save:
+        list.side_effect = responses
+        save.side_effect = lambda image_url, destination: saved.append((len(list.call_args_list), image_url))
+        screenshots_api.download('123')
+    assert saved == [(1, IMAGE_URL % 0), (1, IMAGE_URL % 2), (2, IMAGE_URL % 1)]
+    assert sleep.call_count == 2
+
+
+@pytest.mark.usefixtures('sleep')
+def test_download_deadline(screenshots_api):
+    with patch.object(screenshots_api, 'list') as list, patch('browserstacker.polling.time') as time:
+        time.side_effect = [0, 0, 5, 10]
+        list.return_value = make_response('pending')
+        assert screenshots_api.download('123', deadline=10) == {}
+    assert list.call_count == 3
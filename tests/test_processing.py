@@ -0,0 +1,131 @@
+# coding: utf-8
+import json
+import os
+from io import BytesIO
+
+import pytest
+
+from browserstacker.fake import DEFAULT_BROWSERS
+from browserstacker.processing import ImagePipeline, Resize, StripMetadata, get_output
+
+
+Image = pytest.importorskip('PIL.Image')
+PngImagePlugin = pytest.importorskip('PIL.PngImagePlugin')
+
+
+def make_png(width=64, height=32):
+    image = Image.new('RGB', (width, height), (200, 30, 30))
+    info = PngImagePlugin.PngInfo()
+    info.add_text('Comment', 'x' * 100)
+    buffer = BytesIO()
+    image.save(buffer, 'PNG', pnginfo=info)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def fake_options():
+    return {'browsers': DEFAULT_BROWSERS[:3]}
+
+
+@pytest.fixture
+def fake_server(fake_server):
+    fake_server.image = make_png()
+    return fake_server
+
+
+@pytest.fixture
+def api_options():
+    return {'use_manifest': True}
+
+
+@pytest.fixture
+def image(tmpdir):
+    path = tmpdir.join('image.png')
+    path.write_binary(make_png())
+    return str(path)
+
+
+@pytest.mark.parametrize('format, suffix, in_place, expected', (
+    (None, '.thumb', False, 'dir/image.thumb.png'),
+    ('WEBP', '.thumb', False, 'dir/image.thumb.webp'),
+    ('JPEG', '.thumb', True, 'dir/image.jpg'),
+    (None, '.thumb', True, 'dir/image.png'),
+))
+def test_get_output(format, suffix, in_place, expected):
+    assert get_output('dir/image.png', format, suffix, in_place) == expected
+
+
+def test_process_inline(image):
+    pipeline = ImagePipeline([Resize(16), StripMetadata()], format='webp', quality=80, processes=0)
+    result = pipeline.submit(image).get()
+    assert result['path'] == image
+    assert result['output'] == image[:-4] + '.processed.webp'
+    assert result['bytes'] == os.path.getsize(result['output'])
+    assert sorted(result['timings']) == ['decode', 'encode', 'resize', 'strip', 'write']
+    assert Image.open(result['output']).size == (16, 8)
+    # Original is kept
+    assert Image.open(image).size == (64, 32)
+
+
+def test_process_in_place(image):
+    with open(image, 'rb') as f:
+        data = f.read()
+    pipeline = ImagePipeline([Resize(32, 8)], format='jpeg', in_place=True, processes=0)
+    result = pipeline.submit(image, data).get()
+    assert result['output'] == image[:-4] + '.jpg'
+    assert not os.path.exists(image)
+    assert Image.open(result['output']).size == (16, 8)
+
+
+def test_pop_reads_from_disk(image):
+    pipeline = ImagePipeline(processes=0)
+    assert pipeline.pop(image).get()['output'] == image[:-4] + '.processed.png'
+    assert pipeline.pending == {}
+
+
+def test_download(fake_api, fake_server, tmpdir):
+    destination = str(tmpdir.join('screenshots'))
+    with ImagePipeline([Resize(32)], format='webp', processes=2) as pipeline:
+        result = fake_api.make('http://www.example.com', fake_server.browsers, destination, pipeline=pipeline)
+        assert pipeline.pending == {}
+    assert len(result) == 3
+    for value in result.values():
+        assert value['path'].startswith(destination)
+        assert value['output'].endswith('.processed.webp')
+        assert Image.open(value['output']).size == (32, 16)
+        assert 'resize' in value['timings']
+
+
+def test_download_skipped_images_are_processed(fake_api, fake_server, tmpdir):
+    destination = str(tmpdir.join('screenshots'))
+    job_id = fake_api.generate('http://www.example.com', fake_server.browsers)['job_id']
+    fake_api.download(job_id, destination)
+    images = fake_server.stats['images']
+    fake_api._cache.clear()
+    pipeline = ImagePipeline([Resize(8)], processes=0)
+    result = fake_api.download(job_id, destination, pipeline=pipeline)
+    # Already downloaded images are read from disk
+    assert fake_server.stats['images'] == images
+    assert [Image.open(value['output']).size for value in result.values()] == [(8, 4)] * 3
+
+
+def test_cli(isolated_cli_runner, monkeypatch, fake_server):
+    from browserstacker.cli import cli
+    from browserstacker.cli.helpers import APIWrapper
+
+    monkeypatch.setattr(APIWrapper, 'root_url', fake_server.url)
+    result = isolated_cli_runner.invoke(
+        cli,
+        [
+            'make', 'http://www.example.com', '-os', 'Windows', '--resize', '20x5', '--convert', 'jpeg', '--in-place',
+            '--processes', '0', '--output', 'jsonl'
+        ],
+        catch_exceptions=False
+    )
+    assert not result.exception
+    records = [json.loads(line) for line in result.output.splitlines()]
+    screenshots = [record for record in records if record['event'] == 'screenshot']
+    assert len(screenshots) == 3
+    for record in screenshots:
+        assert record['processed']['output'].endswith('.jpg')
+        assert Image.open(record['processed']['output']).size == (10, 5)
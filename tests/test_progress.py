@@ -0,0 +1,50 @@
+# coding: utf-8
+from time import time
+
+import pytest
+
+from browserstacker.fake import DEFAULT_BROWSERS
+from browserstacker.progress import JOB_FINISHED, JOB_STARTED, SCREENSHOT, collect_saved
+
+
+@pytest.mark.parametrize('concurrency', (1, 2))
+def test_iter_make(fake_api, tmpdir, concurrency):
+    records = list(fake_api.iter_make(
+        'http://www.example.com', DEFAULT_BROWSERS[:2], str(tmpdir), timeout=0.01, concurrency=concurrency
+    ))
+    assert [record['event'] for record in records] == [JOB_STARTED, SCREENSHOT, SCREENSHOT, JOB_FINISHED]
+    assert records[0]['url'] == 'http://www.example.com'
+    screenshots = sorted(records[1:3], key=lambda record: record['browser'])
+    assert [record['browser'] for record in screenshots] == ['chrome', 'firefox']
+    for record in screenshots:
+        assert record['state'] == 'done'
+        assert record['bytes'] == 1024
+        assert record['path'].startswith(str(tmpdir))
+        assert record['elapsed'] >= 0
+    assert records[-1]['state'] == 'done'
+    assert records[-1]['saved'] == 2
+    assert collect_saved(records) == dict((record['image_url'], record['path']) for record in screenshots)
+
+
+def test_timed_out(fake_api, fake_server, tmpdir):
+    fake_server.timeout_rate = 1
+    records = list(fake_api.iter_make('http://www.example.com', DEFAULT_BROWSERS[:1], str(tmpdir), timeout=0.01))
+    assert records[1]['state'] == 'timed-out'
+    assert records[1]['path'] is None
+    assert records[-1]['failed'] == 1
+    assert collect_saved(records) == {}
+
+
+def test_streaming(fake_api, fake_server, tmpdir):
+    """
+    Screenshots are yielded before the job is finished.
+    """
+    job = fake_server.create_job('http://www.example.com', DEFAULT_BROWSERS[:2])
+    job.screenshots[1]['ready_at'] += 60
+    records = fake_api.iter_download(job.id, str(tmpdir), timeout=0.01, deadline=30)
+    assert next(records)['event'] == JOB_STARTED
+    record = next(records)
+    assert record['event'] == SCREENSHOT
+    assert record['browser'] == 'chrome'
+    assert job.is_running(time())
+    records.close()
@@ -0,0 +1,132 @@
+# coding: utf-8
+import multiprocessing
+import os
+from time import time
+
+import pytest
+
+from browserstacker import ScreenShotsAPI
+from browserstacker.ratelimit import RateLimiter
+from browserstacker.screenshots import AuthError
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join('ratelimit.sqlite'))
+
+
+@pytest.fixture
+def fake_options():
+    return {'image_size': 128, 'credentials': ('user', 'key')}
+
+
+def take_tokens(path, count):
+    limiter = RateLimiter(path, rate=50, burst=1)
+    for _ in range(count):
+        limiter.acquire()
+
+
+def test_token_bucket(path):
+    limiter = RateLimiter(path, rate=10, burst=2)
+    assert limiter.take() == 0
+    # Bucket is shared by all limiters with the same file
+    assert RateLimiter(path, rate=10, burst=2).take() == 0
+    assert 0 < limiter.take() <= 0.1
+    # Another bucket
+    assert RateLimiter(path, rate=10, burst=2, name='other').take() == 0
+
+
+def test_unlimited_rate(path):
+    limiter = RateLimiter(path, max_jobs=1)
+    assert [limiter.take() for _ in range(10)] == [0] * 10
+
+
+def test_shared_by_processes(path):
+    start = time()
+    processes = [multiprocessing.Process(target=take_tokens, args=(path, 10)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * 3
+    # 30 tokens at 50 per second, the first one is available at once
+    assert time() - start >= 29 / 50.0
+
+
+def test_job_slots(path):
+    limiter = RateLimiter(path, max_jobs=2)
+    assert limiter.take_job('a')
+    assert limiter.take_job('b')
+    assert not limiter.has_free_job()
+    assert not RateLimiter(path, max_jobs=2).take_job('c')
+    limiter.release_job('a')
+    limiter.bind_job('b', 'job')
+    assert limiter.take_job('c')
+    limiter.release_job(job_id='job')
+    assert limiter.get_running() == 1
+    assert limiter.acquire_job('d') == 0
+
+
+def test_expired_slots(path):
+    process = multiprocessing.Process(target=os.getpid)
+    process.start()
+    process.join()
+    limiter = RateLimiter(path, max_jobs=1)
+    with limiter.transaction() as connection:
+        connection.execute('INSERT INTO slots VALUES (?, NULL, ?, ?)', ('dead', process.pid, time()))
+    assert limiter.get_running() == 0
+    limiter = RateLimiter(path, max_jobs=1, job_ttl=0)
+    assert limiter.take_job('old')
+    assert limiter.take_job('new')
+
+
+def test_api(fake_server, path, sleep, tmpdir):
+    limiter = RateLimiter(path, rate=1000, max_jobs=1)
+    api = ScreenShotsAPI('user', 'key', rate_limiter=limiter)
+    api.root_url = fake_server.url
+    job_id = api.generate('http://www.example.com')['job_id']
+    assert limiter.get_running() == 1
+    api.download(job_id, str(tmpdir))
+    assert limiter.get_running() == 0
+    api.make('http://www.example.com', destination=str(tmpdir))
+    assert limiter.get_running() == 0
+    api.auth = ('user', 'invalid')
+    with pytest.raises(AuthError):
+        api.generate('http://www.example.com')
+    assert limiter.get_running() == 0
+    api.close()
+
+
+def test_cli(isolated_cli_runner, monkeypatch, fake_server, path):
+    from browserstacker.cli import cli
+    from browserstacker.cli.helpers import APIWrapper
+
+    monkeypatch.setattr(APIWrapper, 'root_url', fake_server.url)
+    options = ['-u', 'user', '-k', 'key', '--rate-limit', '100', '--max-jobs', '1', '--rate-limit-file', path]
+    result = isolated_cli_runner.invoke(cli, options + ['make', 'http://www.example.com'], catch_exceptions=False)
+    assert not result.exception
+    assert RateLimiter(path).get_running() == 0
+    result = isolated_cli_runner.invoke(cli, options + ['generate', 'http://www.example.com'], catch_exceptions=False)
+    assert not result.exception
+    # The job is running until it is downloaded
+    assert RateLimiter(path).get_running() == 1
+
+
+def test_reused_job_keeps_slot(fake_server, path, sleep, tmpdir):
+    from browserstacker.cache import JobMemo
+
+    memo_path = str(tmpdir.join('memo.json'))
+    first, second = [
+        ScreenShotsAPI('user', 'key', rate_limiter=RateLimiter(path, max_jobs=2), memo=JobMemo(path=memo_path))
+        for _ in range(2)
+    ]
+    first.root_url = second.root_url = fake_server.url
+    job_id = first.generate('http://www.example.com')['job_id']
+    assert second.generate('http://www.example.com')['job_id'] == job_id
+    # The slot belongs to the process, that started the job
+    second.download(job_id, str(tmpdir.mkdir('second')))
+    assert first.rate_limiter.get_running() == 1
+    first.download(job_id, str(tmpdir.mkdir('first')))
+    assert first.rate_limiter.get_running() == 0
+    first.close()
+    second.close()
@@ -0,0 +1,163 @@
+# coding: utf-8
+from time import time
+
+import pytest
+import requests
+
+from browserstacker import ScreenShotsAPI
+from browserstacker.fake import DEFAULT_BROWSERS
+from browserstacker.hooks import RETRY
+from browserstacker.polling import Backoff
+from browserstacker.retry import APIError, RetryPolicy, parse_retry_after
+from browserstacker.screenshots import AuthError, IncompleteDownload
+
+
+@pytest.fixture
+def fake_options():
+    return {'browsers': DEFAULT_BROWSERS[:2], 'image_size': 4096}
+
+
+@pytest.fixture
+def policy():
+    return RetryPolicy(attempts=3, initial=0.1, maximum=1)
+
+
+@pytest.fixture
+def api_options(policy):
+    return {'retry_policy': policy}
+
+
+@pytest.fixture
+def retries(fake_api):
+    events = []
+    fake_api.hooks.register(RETRY, lambda event, data: events.append(data))
+    return events
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('120') == 120
+    assert parse_retry_after('-1') == 0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT', now=1445412470) == 10
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+@pytest.mark.parametrize('exc, idempotent, expected', (
+    (APIError('', 503), True, 'status_503'),
+    (APIError('', 502), True, 'status_502'),
+    (APIError('', 404), True, None),
+    (APIError('', 502), False, None),
+    (APIError('', 429), False, 'status_429'),
+    (IncompleteDownload(), True, 'incomplete'),
+    (requests.ConnectionError(), True, 'connection'),
+    (requests.ConnectionError(), False, None),
+    (requests.ReadTimeout(), True, 'timeout'),
+    (requests.ReadTimeout(), False, None),
+    (requests.ConnectTimeout(), False, 'timeout'),
+    (AuthError(), True, None),
+    (ValueError(), True, None),
+))
+def test_classify(policy, exc, idempotent, expected):
+    assert policy.classify(exc, idempotent) == expected
+
+
+def test_get_delay(policy):
+    backoff = Backoff(0.1, 1)
+    now = time()
+    assert 0.05 <= policy.get_delay(APIError('', 503), 0, now, backoff) <= 0.1
+    assert policy.get_delay(APIError('', 503, retry_after=5), 1, now, backoff) == 5
+    # Over the total time
+    assert policy.get_delay(APIError('', 503, retry_after=500), 1, now, backoff) is None
+    assert policy.get_delay(APIError('', 503), 1, now - 60, backoff) is None
+    # No attempts left
+    assert policy.get_delay(APIError('', 503), 3, now, backoff) is None
+
+
+def test_error_pages(fake_api, fake_server, policy, retries, tmpdir):
+    fake_server.fail(2, 503, path='/screenshots')
+    fake_server.fail(1, 502, path='/images/')
+    result = fake_api.make('http://www.example.com', fake_server.browsers, str(tmpdir))
+    assert len(result) == 2
+    assert [event['reason'] for event in retries] == ['status_503', 'status_503', 'status_502']
+    assert [event['attempt'] for event in retries] == [1, 2, 1]
+    assert policy.stats == {'retries': 3, 'recovered': 2, 'failed': 0}
+
+
+def test_retry_after(fake_api, fake_server, retries, sleep):
+    fake_server.fail(1, 429, retry_after=3, path='/screenshots')
+    assert fake_api.generate('http://www.example.com', fake_server.browsers)['job_id']
+    assert retries[0]['delay'] == 3
+    sleep.assert_called_once_with(3)
+
+
+def test_dropped_connection(fake_api, fake_server, retries, tmpdir):
+    fake_server.fail(1, None, path='/images/')
+    result = fake_api.make('http://www.example.com', fake_server.browsers[:1], str(tmpdir))
+    with open(list(result.values())[0], 'rb') as f:
+        assert f.read() == fake_server.image
+    assert len(retries) == 1
+    # The rest of the image is requested with a Range header
+    assert fake_server.stats['bytes'] < 2 * len(fake_server.image) + 4096
+
+
+def test_generate_is_not_repeated(fake_api, fake_server, policy):
+    fake_server.fail(1, None, path='/screenshots')
+    with pytest.raises(requests.ConnectionError):
+        fake_api.generate('http://www.example.com', fake_server.browsers)
+    assert fake_server.stats['jobs'] == 0
+    assert policy.stats['retries'] == 0
+
+
+def test_attempts_exhausted(fake_api, fake_server, policy):
+    fake_server.fail(10, 502, path='/screenshots/')
+    job_id = fake_api.generate('http://www.example.com', fake_server.browsers)['job_id']
+    with pytest.raises(APIError) as exc:
+        fake_api.list(job_id)
+    assert exc.value.status == 502
+    assert policy.stats == {'retries': 3, 'recovered': 0, 'failed': 1}
+
+
+def test_fatal_error(fake_api, fake_server, policy):
+    fake_server.fail(1, 404, path='/screenshots/')
+    with pytest.raises(APIError):
+        fake_api.list('job')
+    assert policy.stats['retries'] == 0
+
+
+def test_disabled(fake_server):
+    api = ScreenShotsAPI('user', 'key', retry_policy=False)
+    api.root_url = fake_server.url
+    fake_server.fail(1, 503)
+    with pytest.raises(APIError):
+        api.generate('http://www.example.com', fake_server.browsers)
+    api.close()
+
+
+def test_no_attempts(fake_server):
+    policy = RetryPolicy(attempts=0)
+    assert not policy
+    api = ScreenShotsAPI('user', 'key', retry_policy=policy)
+    api.root_url = fake_server.url
+    fake_server.fail(1, 503)
+    with pytest.raises(APIError):
+        api.generate('http://www.example.com', fake_server.browsers)
+    assert policy.stats == {'retries': 0, 'recovered': 0, 'failed': 0}
+    api.close()
+
+
+def test_cli(isolated_cli_runner, monkeypatch, fake_server):
+    from browserstacker.cli import cli
+    from browserstacker.cli.helpers import APIWrapper
+
+    monkeypatch.setattr(APIWrapper, 'root_url', fake_server.url)
+    fake_server.fail(1, 503)
+    result = isolated_cli_runner.invoke(
+        cli, ['--max-retries', '0', 'generate', 'http://www.example.com'], catch_exceptions=True
+    )
+    assert isinstance(result.exception, APIError)
+    fake_server.fail(1, 503)
+    result = isolated_cli_runner.invoke(
+        cli, ['--max-retries', '1', '--retry-total', '5', 'generate', 'http://www.example.com'],
+        catch_exceptions=False
+    )
+    assert not result.exception
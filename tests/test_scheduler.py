@@ -0,0 +1,149 @@
+# coding: utf-8
+import logging
+
+import pytest
+
+from browserstacker.hooks import Hooks
+from browserstacker.scheduler import DONE, FAILED, JobScheduler
+from browserstacker.screenshots import AuthError, ParallelLimitReached
+
+from ._compat import patch
+
+
+pytestmark = pytest.mark.usefixtures('clock')
+
+
+class FakeAPI(object):
+    """
+    Account with limited number of parallel jobs. Every job is done after `polls` polls.
+    """
+
+    def __init__(self, limit=2, polls=2):
+        self.limit = limit
+        self.polls = polls
+        self.jobs = {}
+        self.max_running = 0
+        self.rejections = 0
+        self.logger = logging.getLogger('test')
+        self.hooks = Hooks()
+        self.rate_limiter = None
+        self.ledger = None
+
+    @property
+    def running(self):
+        return [job_id for job_id, polls in self.jobs.items() if polls < self.polls]
+
+    def generate(self, url, browsers=None, **kwargs):
+        if url == 'invalid':
+            return {'message': 'Validation failed'}
+        if len(self.running) >= self.limit:
+            self.rejections += 1
+            raise ParallelLimitReached
+        job_id = 'job-%s' % len(self.jobs)
+        self.jobs[job_id] = 0
+        self.max_running = max(self.max_running, len(self.running))
+        return {'job_id': job_id}
+
+    def list(self, job_id):
+        self.jobs[job_id] += 1
+        state = 'done' if self.jobs[job_id] >= self.polls else 'processing'
+        return {'screenshots': [{'state': state, 'image_url': 'http://example.com/%s.png' % job_id}]}
+
+    def release_job(self, job_id=None, slot=None):
+        pass
+
+    def save_all(self, image_urls, destination=None, concurrency=1):
+        return dict((image_url, image_url.split('/')[-1]) for image_url in image_urls)
+
+
+def test_learns_parallel_limit():
+    api = FakeAPI(limit=2)
+    scheduler = JobScheduler(api, timeout=1)
+    for i in range(5):
+        scheduler.add('http://example.com/%s' % i)
+    jobs = scheduler.run()
+    assert [job.status for job in jobs] == [DONE] * 5
+    assert scheduler.parallel_limit == 2
+    assert api.max_running == 2
+    assert api.rejections == 1
+    assert jobs[0].result == {'http://example.com/job-0.png': 'job-0.png'}
+    assert sum(job.submissions for job in jobs) == 6
+
+
+def test_learned_limit_is_probed(clock):
+    # Another client's jobs occupy a slot for a while
+    api = FakeAPI(limit=1, polls=10)
+    scheduler = JobScheduler(api, timeout=1, retry_delay=5)
+    for i in range(6):
+        scheduler.add('http://example.com/%s' % i)
+    scheduler.submit()
+    scheduler.submit()
+    assert scheduler.parallel_limit == 1
+    assert not scheduler.has_capacity
+    api.limit = 3
+    jobs = scheduler.run()
+    assert [job.status for job in jobs] == [DONE] * 6
+    assert scheduler.parallel_limit == 3
+    assert api.max_running == 3
+
+def test_known_parallel_limit():
+    api = FakeAPI(limit=3)
+    scheduler = JobScheduler(api, parallel_limit=3, timeout=1)
+    for i in range(7):
+        scheduler.add('http://example.com/%s' % i)
+    assert all(job.status == DONE for job in scheduler.run())
+    assert api.rejections == 0
+    assert api.max_running == 3
+
+
+def test_slots_are_busy(clock):
+    api = FakeAPI(limit=0)
+    scheduler = JobScheduler(api, timeout=1, retry_delay=5)
+    job = scheduler.add('http://example.com')
+    scheduler.submit()
+    assert api.rejections == 1
+    assert scheduler.retry_at == 5
+    api.limit = 1
+    scheduler.run()
+    assert job.status == DONE
+    assert job.submissions == 2
+    assert clock.return_value >= 5
+
+
+def test_failed_job():
+    scheduler = JobScheduler(FakeAPI(), timeout=1)
+    invalid = scheduler.add('invalid')
+    valid = scheduler.add('http://example.com')
+    scheduler.run()
+    assert invalid.status == FAILED
+    assert invalid.error == "'job_id'"
+    assert valid.status == DONE
+
+
+def test_deadline():
+    scheduler = JobScheduler(FakeAPI(polls=100), timeout=1, deadline=10)
+    job = scheduler.add('http://example.com')
+    scheduler.run()
+    assert job.status == FAILED
+    assert job.error == 'Deadline exceeded'
+
+
+def test_auth_error():
+    api = FakeAPI()
+    scheduler = JobScheduler(api)
+    scheduler.add('http://example.com')
+    with patch.object(api, 'generate', side_effect=AuthError):
+        with pytest.raises(AuthError):
+            scheduler.run()
+
+
+def test_iter_run():
+    api = FakeAPI(limit=1, polls=1)
+    scheduler = JobScheduler(api, timeout=1)
+    scheduler.add('http://example.com/0')
+    scheduler.add('http://example.com/1')
+    jobs = scheduler.iter_run()
+    first = next(jobs)
+    assert first.status == DONE
+    assert scheduler.jobs[1].status != DONE
+    assert list(jobs) == [scheduler.jobs[1]]
@@ -4,6 +4,7 @@ import os
 import pytest
 
 from browserstacker import ScreenShotsAPI
+from browserstacker.screenshots import IncompleteDownload
 from ._compat import patch
 from .conftest import IMAGE_URL
 
@@ -13,7 +14,8 @@ def test_execute(screenshots_api, mocked_request):
     mocked_request.assert_called_with(
         'GET',
         'https://www.browserstack.com/test',
-        auth=screenshots_api.auth
+        auth=screenshots_api.auth,
+        timeout=screenshots_api.request_timeout
     )
 
 
@@ -22,7 +24,8 @@ def test_browsers(screenshots_api, browsers_response):
     browsers_response.assert_called_with(
         'GET',
         'https://www.browserstack.com/screenshots/browsers.json',
-        auth=screenshots_api.auth
+        auth=screenshots_api.auth,
+        timeout=screenshots_api.request_timeout
     )
 
 
@@ -87,10 +90,11 @@ def test_make(screenshots_api, mocked_request, mocked_get, mocked_image_response
         'POST',
         'https://www.browserstack.com/screenshots',
         auth=screenshots_api.auth,
+        timeout=screenshots_api.request_timeout,
         json={'url': url, 'browsers': [{}]}
     )
     # `open` args
-    assert mocked_open._mock_mock_calls[0][1] == (os.path.join(test_dir_name, 'test_image.jpg'), 'wb')
+    assert mocked_open._mock_mock_calls[0][1] == (os.path.join(test_dir_name, 'test_image.jpg.part'), 'wb')
     # `fd.write` args
     assert mocked_open._mock_mock_calls[2][1] == (mocked_image_response.content, )
     assert os.path.exists(test_dir_name)
@@ -111,6 +115,7 @@ def test_generate(screenshots_api, mocked_request, browsers, resulting_browsers)
         'POST',
         'https://www.browserstack.com/screenshots',
         auth=screenshots_api.auth,
+        timeout=screenshots_api.request_timeout,
         json={'url': url, 'browsers': resulting_browsers}
     )
 
@@ -121,7 +126,8 @@ def test_list(screenshots_api, mocked_request):
     mocked_request.assert_called_with(
         'GET',
         'https://www.browserstack.com/screenshots/%s.json' % job_id,
-        auth=screenshots_api.auth
+        auth=screenshots_api.auth,
+        timeout=screenshots_api.request_timeout
     )
 
 
@@ -153,11 +159,12 @@ def test_ensure_dir_exists(screenshots_api, test_dir_name):
         ('test_dir', 'test_dir/test_save.jpg')
     )
 )
-def test_save(screenshots_api, mocked_get, mocked_open, mocked_image_response, destination, filename):
+def test_save(screenshots_api, mocked_get, mocked_open, mocked_replace, mocked_image_response, destination, filename):
     mocked_get.return_value = mocked_image_response
     screenshots_api.save(IMAGE_URL, destination)
     # `open` args
-    assert mocked_open._mock_mock_calls[0][1] == (filename, 'wb')
+    assert mocked_open._mock_mock_calls[0][1] == (filename + '.part', 'wb')
+    mocked_replace.assert_called_with(filename + '.part', filename)
     # `fd.write` args
     assert mocked_open._mock_mock_calls[2][1] == (mocked_image_response.content, )
 
@@ -168,7 +175,100 @@ def test_download(screenshots_api, test_dir_name, mocked_get, mocked_open, mocke
         list.return_value = {'screenshots': [{'image_url': IMAGE_URL, 'state': 'done'}]}
         screenshots_api.download('123', test_dir_name)
     # `open` args
-    assert mocked_open._mock_mock_calls[0][1] == (os.path.join(test_dir_name, 'test_save.jpg'), 'wb')
+    assert mocked_open._mock_mock_calls[0][1] == (os.path.join(test_dir_name, 'test_save.jpg.part'), 'wb')
     # `fd.write` args
     assert mocked_open._mock_mock_calls[2][1] == (mocked_image_response.content, )
     assert os.path.exists(test_dir_name)
+
+
+@pytest.mark.parametrize('concurrency', (1, 4))
+def test_save_all(screenshots_api, concurrency):
+    image_urls = ['http://www.example.com/img/%s.jpg' % i for i in range(5)]
+    screenshots_api._cache[image_urls[0]] = '0.jpg'
+    with patch.object(screenshots_api, 'save') as save:
+        screenshots_api.save_all(image_urls + image_urls[1:3], 'test_dir', concurrency)
+    assert sorted(call[0][0] for call in save.call_args_list) == image_urls[1:]
+    assert all(call[0][1] == 'test_dir' for call in save.call_args_list)
+
+
+def test_download_concurrently(screenshots_api, test_dir_name):
+    image_urls = ['http://www.example.com/img/%s.jpg' % i for i in range(3)]
+    with patch.object(screenshots_api, 'list') as list, patch.object(screenshots_api, 'save') as save:
+        list.return_value = {
+            'screenshots': [{'image_url': image_url, 'state': 'done'} for image_url in image_urls + image_urls[:1]]
+        }
+        screenshots_api.download('123', test_dir_name, concurrency=3)
+    assert sorted(call[0][0] for call in save.call_args_list) == image_urls
+
+
+class RangeResponse(object):
+
+    def __init__(self, content, headers, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = dict(headers, **{'Content-Length': str(len(content))})
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def range_server(content, supports_range=True):
+
+    def get(url, headers, **kwargs):
+        if 'Range' in headers and supports_range:
+            offset = int(headers['Range'][6:-1])
+            if offset >= len(content):
+                return RangeResponse(b'', {}, 416)
+            content_range = 'bytes %s-%s/%s' % (offset, len(content) - 1, len(content))
+            return RangeResponse(content[offset:], {'Content-Range': content_range}, 206)
+        return RangeResponse(content, {})
+
+    return get
+
+
+@pytest.mark.parametrize('partial_content, supports_range, expected_headers', (
+    (None, True, {}),
+    (b'0123', True, {'Range': 'bytes=4-'}),
+    (b'0123', False, {'Range': 'bytes=4-'}),
+    (b'0123456789', True, {'Range': 'bytes=10-'}),
+))
+def test_fetch_resume(screenshots_api, mocked_get, tmpdir, partial_content, supports_range, expected_headers):
+    content = b'0123456789'
+    screenshots_api.chunk_size = 3
+    mocked_get.side_effect = range_server(content, supports_range)
+    filename = str(tmpdir.join('image.png'))
+    if partial_content:
+        tmpdir.join('image.png.part').write_binary(partial_content)
+    screenshots_api.fetch(IMAGE_URL, filename)
+    assert tmpdir.join('image.png').read_binary() == content
+    assert not tmpdir.join('image.png.part').exists()
+    assert mocked_get.call_args_list[0][1]['headers'] == expected_headers
+
+
+def test_fetch_wrong_range(screenshots_api, mocked_get, tmpdir):
+    content = b'0123456789'
+    tmpdir.join('image.png.part').write_binary(b'0123')
+    responses = [RangeResponse(content[2:], {'Content-Range': 'bytes 2-9/10'}, 206), RangeResponse(content, {})]
+    mocked_get.side_effect = lambda url, headers, **kwargs: responses.pop(0)
+    screenshots_api.fetch(IMAGE_URL, str(tmpdir.join('image.png')))
+    # The partial file is not spliced with another part
+    assert tmpdir.join('image.png').read_binary() == content
+    assert mocked_get.call_args[1]['headers'] == {}
+
+
+def test_fetch_incomplete(screenshots_api, mocked_get, tmpdir):
+    response = RangeResponse(b'0123456789', {})
+    response.headers['Content-Length'] = '20'
+    mocked_get.return_value = response
+    filename = str(tmpdir.join('image.png'))
+    with pytest.raises(IncompleteDownload):
+        screenshots_api.fetch(IMAGE_URL, filename)
+    assert not tmpdir.join('image.png').exists()
+    assert tmpdir.join('image.png.part').read_binary() == b'0123456789'
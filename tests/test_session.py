@@ -0,0 +1,52 @@
+# coding: utf-8
+from browserstacker import ScreenShotsAPI
+from browserstacker.session import get_pool_stats, make_session
+
+from ._compat import Mock, patch
+
+
+def test_make_session():
+    session = make_session(pool_connections=2, pool_maxsize=5)
+    adapter = session.get_adapter('https://www.browserstack.com/')
+    assert adapter is session.get_adapter('http://www.example.com/')
+    assert adapter._pool_connections == 2
+    assert adapter._pool_maxsize == 5
+    assert 'Connection' not in session.headers or session.headers['Connection'] != 'close'
+
+
+def test_make_session_without_keep_alive():
+    session = make_session(keep_alive=False)
+    assert session.headers['Connection'] == 'close'
+
+
+def test_pool_stats():
+    session = make_session()
+    adapter = session.get_adapter('https://www.browserstack.com/')
+    pool = adapter.poolmanager.connection_from_url('https://www.browserstack.com/')
+    pool.num_requests = 5
+    pool.num_connections = 2
+    assert get_pool_stats(session) == {'pools': 1, 'requests': 5, 'hits': 3, 'misses': 2}
+
+
+def test_pool_stats_empty(screenshots_api):
+    assert screenshots_api.pool_stats == {'pools': 0, 'requests': 0, 'hits': 0, 'misses': 0}
+
+
+def test_shared_session(screenshots_api, mocked_request, mocked_get, mocked_image_response, mocked_open):
+    mocked_get.return_value = mocked_image_response
+    mocked_request().json.return_value = {'screenshots': []}
+    screenshots_api.list('123')
+    screenshots_api.save('http://www.example.com/img/test_image.jpg')
+    assert mocked_request.called
+    mocked_get.assert_called_with(
+        'http://www.example.com/img/test_image.jpg', stream=True, timeout=screenshots_api.request_timeout, headers={}
+    )
+
+
+def test_context_manager():
+    api = ScreenShotsAPI(None, None)
+    with patch.object(api.session, 'close', Mock()) as close:
+        with api as entered:
+            assert entered is api
+            assert not close.called
+        assert close.called
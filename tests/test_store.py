@@ -0,0 +1,133 @@
+# coding: utf-8
+import json
+import os
+
+import pytest
+
+from browserstacker import ScreenShotsAPI
+from browserstacker.fake import DEFAULT_BROWSERS
+from browserstacker.manifest import new_hasher
+from browserstacker.store import ContentStore
+
+
+@pytest.fixture
+def fake_options():
+    return {'browsers': DEFAULT_BROWSERS[:3], 'image_size': 1024}
+
+
+@pytest.fixture
+def store(tmpdir):
+    return ContentStore(str(tmpdir.join('store')))
+
+
+@pytest.fixture
+def api_options(store):
+    return {'store': store}
+
+
+def get_digest(content):
+    hasher = new_hasher()
+    hasher.update(content)
+    return hasher.hexdigest()
+
+
+def list_objects(store):
+    return [name for _, _, names in os.walk(os.path.join(store.root, 'objects')) for name in names]
+
+
+def test_deduplication(fake_api, fake_server, store, tmpdir):
+    digest = get_digest(fake_server.image)
+    result = fake_api.make('http://www.example.com', fake_server.browsers, str(tmpdir.join('first')))
+    assert len(result) == 3
+    assert list_objects(store) == [digest]
+    assert store.stats == {'stored': 1, 'deduplicated': 2, 'bytes_stored': 1024, 'bytes_deduplicated': 2048}
+    for filename in result.values():
+        assert os.path.samefile(filename, store.get_path(digest))
+    fake_api.make('http://www.example.com', fake_server.browsers, str(tmpdir.join('second')))
+    assert list_objects(store) == [digest]
+    assert store.stats['deduplicated'] == 5
+    with open(store.refs_path) as f:
+        refs = [json.loads(line) for line in f]
+    assert len(refs) == 6
+    assert len(set(ref['job_id'] for ref in refs)) == 2
+    assert set(ref['digest'] for ref in refs) == set([digest])
+    assert sorted(ref['key'] for ref in refs[:3]) == [
+        'windows_10_chrome_50.0', 'windows_10_firefox_45.0', 'windows_8.1_ie_11.0'
+    ]
+    assert ContentStore(store.root).refs == store.refs
+
+
+def test_duplicates_are_not_written(fake_api, fake_server, store, tmpdir):
+    fake_api.make('http://www.example.com', fake_server.browsers[:1], str(tmpdir.join('first')))
+    path = store.get_path(get_digest(fake_server.image))
+    os.chmod(path, 0o444)
+    stamp = os.stat(path).st_mtime
+    fake_api.make('http://www.example.com', fake_server.browsers, str(tmpdir.join('second')))
+    assert os.stat(path).st_mtime == stamp
+    assert len(os.listdir(os.path.dirname(path))) == 1
+
+
+def test_manifest(fake_server, store, tmpdir):
+    api = ScreenShotsAPI('user', 'key', use_manifest=True, store=store)
+    api.root_url = fake_server.url
+    job_id = api.generate('http://www.example.com', fake_server.browsers)['job_id']
+    destination = str(tmpdir.join('screenshots'))
+    api.download(job_id, destination)
+    images = fake_server.stats['images']
+    api._cache.clear()
+    store.refs.clear()
+    api.download(job_id, destination)
+    api.close()
+    assert fake_server.stats['images'] == images
+    # References are restored from the manifest
+    assert len(store.refs) == 3
+
+
+@pytest.mark.parametrize('link', ('symlink', 'copy'))
+def test_link_modes(fake_server, tmpdir, link):
+    store = ContentStore(str(tmpdir.join('store')), link)
+    api = ScreenShotsAPI('user', 'key', store=store)
+    api.root_url = fake_server.url
+    result = api.make('http://www.example.com', fake_server.browsers, str(tmpdir.join('screenshots')))
+    api.close()
+    path = store.get_path(get_digest(fake_server.image))
+    for filename in result.values():
+        assert os.path.islink(filename) is (link == 'symlink')
+        assert os.path.samefile(filename, path) is (link == 'symlink')
+        with open(filename, 'rb') as f:
+            assert f.read() == fake_server.image
+
+
+def test_link_replaces_file(store, tmpdir):
+    spool = store.spool()
+    spool.write(b'content')
+    digest = get_digest(b'content')
+    assert store.put(digest, spool, 7) is True
+    assert store.put(digest, spool, 7) is False
+    filename = tmpdir.join('image.png')
+    filename.write(b'old')
+    store.link(digest, str(filename))
+    assert filename.read_binary() == b'content'
+    assert os.path.samefile(str(filename), store.get_path(digest))
+    # Already linked
+    store.link(digest, str(filename))
+    assert os.listdir(str(tmpdir.join('store', 'objects', digest[:2]))) == [digest]
+
+
+def test_unknown_link_mode(tmpdir):
+    with pytest.raises(ValueError):
+        ContentStore(str(tmpdir), 'reflink')
+
+
+def test_cli(isolated_cli_runner, monkeypatch, fake_server):
+    from browserstacker.cli import cli
+    from browserstacker.cli.helpers import APIWrapper
+
+    monkeypatch.setattr(APIWrapper, 'root_url', fake_server.url)
+    result = isolated_cli_runner.invoke(
+        cli, ['--store', 'store', 'make', 'http://www.example.com', '-os', 'Windows', '-ds', 'out'],
+        catch_exceptions=False
+    )
+    assert not result.exception
+    assert os.listdir(os.path.join('store', 'objects')) == [get_digest(fake_server.image)[:2]]
+    assert len(os.listdir('out')) == 4  # 3 images and manifest